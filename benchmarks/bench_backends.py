@@ -0,0 +1,53 @@
+"""
+Compare the decode backends (see `pyfitness.backends`) on the same fit files, tests/testdata by default.
+Reports rows/sec and peak traced memory of `fit2df` for each backend, the fastest backend is listed first.
+
+python benchmarks/bench_backends.py [fit files or directories]
+"""
+
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+from pyfitness.backends import BACKENDS, fit2df
+from synthetic import fit_files
+
+
+def measure(fit_file: Path, backend: str) -> tuple[int, float, int]:
+    """Return rows, seconds and peak traced bytes for one decode. Time and memory are measured in separate runs as
+    tracing slows the decoder down."""
+    start = time.perf_counter()
+    df = fit2df(str(fit_file), backend=backend)
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    fit2df(str(fit_file), backend=backend)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return len(df), elapsed, peak
+
+
+def main(paths: list[str]):
+    backends = list(BACKENDS)
+    for backend in backends:  # import outside of the timed decodes
+        fit2df(str(fit_files(paths)[0]), backend=backend)
+    totals = {backend: [0, 0.0, 0] for backend in backends}
+    print(f"{'file':<50} {'rows':>7} " + " ".join(f"{b[:14] + ' rows/s':>21} {b[:14] + ' MB':>17}" for b in backends))
+    for fit_file in fit_files(paths):
+        line = f"{fit_file.name[:50]:<50}"
+        for i, backend in enumerate(backends):
+            rows, elapsed, peak = measure(fit_file, backend)
+            if i == 0:
+                line += f" {rows:>7}"
+            totals[backend][0] += rows
+            totals[backend][1] += elapsed
+            totals[backend][2] = max(totals[backend][2], peak)
+            line += f" {rows / elapsed:>21.0f} {peak / 2**20:>17.1f}"
+        print(line)
+    print()
+    for backend, (rows, elapsed, peak) in sorted(totals.items(), key=lambda t: t[1][1]):
+        print(f"{backend:<16} {rows / elapsed:>10.0f} rows/s {peak / 2**20:>8.1f} MB peak")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
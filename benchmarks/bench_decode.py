@@ -0,0 +1,53 @@
+"""
+Compare the dict based and the columnar `fit2df` decoders on the fit files in tests/testdata.
+Reports rows/sec and peak traced memory for each path, measured in separate runs.
+
+python benchmarks/bench_decode.py [fit files or directories]
+"""
+
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+from pyfitness.fd_loader import fit2df
+from synthetic import fit_files
+
+
+def measure(fit_file: Path, columnar: bool) -> tuple[int, float, int]:
+    """Return rows, seconds and peak traced bytes for one decode. Time and memory are measured in separate runs as
+    tracing slows the decoder down."""
+    start = time.perf_counter()
+    df = fit2df(str(fit_file), columnar=columnar)
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    fit2df(str(fit_file), columnar=columnar)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return len(df), elapsed, peak
+
+
+def main(paths: list[str]):
+    totals = {False: [0, 0.0, 0], True: [0, 0.0, 0]}
+    print(f"{'file':<50} {'rows':>7} {'dict rows/s':>12} {'col rows/s':>12} {'dict MB':>8} {'col MB':>8}")
+    for fit_file in fit_files(paths):
+        results = {}
+        for columnar in (False, True):
+            rows, elapsed, peak = measure(fit_file, columnar)
+            results[columnar] = (rows, elapsed, peak)
+            totals[columnar][0] += rows
+            totals[columnar][1] += elapsed
+            totals[columnar][2] = max(totals[columnar][2], peak)
+        rows = results[False][0]
+        print(
+            f"{fit_file.name[:50]:<50} {rows:>7} {rows / results[False][1]:>12.0f} {rows / results[True][1]:>12.0f} "
+            f"{results[False][2] / 2**20:>8.1f} {results[True][2] / 2**20:>8.1f}"
+        )
+    print(
+        f"{'total':<50} {totals[False][0]:>7} {totals[False][0] / totals[False][1]:>12.0f} "
+        f"{totals[True][0] / totals[True][1]:>12.0f} {totals[False][2] / 2**20:>8.1f} {totals[True][2] / 2**20:>8.1f}"
+    )
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
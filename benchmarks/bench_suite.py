@@ -0,0 +1,135 @@
+"""
+Benchmarks of the decode, export and analytics hot paths, on the files in tests/testdata and on synthetic rides of
+1 h, 6 h and 24 h to show how they scale. Each benchmark records rows/sec, the peak traced memory of one call and the
+peak RSS of the process in extra_info.
+
+Timings depend on the machine, so no baseline is committed (.benchmarks/ is ignored by git). Save one on your machine
+from the commit to compare against, then run the suite on your change against it:
+
+git stash && pytest benchmarks/bench_suite.py --benchmark-save=baseline && git stash pop  # .benchmarks/*/0001_baseline
+pytest benchmarks/bench_suite.py --benchmark-compare=0001 --benchmark-compare-fail=mean:10%  # fail on a 10% slowdown
+pytest benchmarks/bench_suite.py -k "24h"  # only the 24 h rides
+"""
+
+import resource
+import sys
+import tracemalloc
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+from pyfitness.dynamics import simulator
+from pyfitness.fd_loader import fit2csv, fit2df, fit2dict, fitfileinfo
+from pyfitness.statistics import max_climb, max_effort
+
+sys.path.insert(0, str(Path(__file__).parent))
+from synthetic import fit_bytes, synthetic_ride
+
+TESTDATA = Path(__file__).parent.parent / "tests" / "testdata"
+TESTDATA_FILES = {
+    "indoor": TESTDATA / "indoor" / "Zwift_Innsbruck.fit",
+    "outdoor": TESTDATA / "outdoor" / "PARC_GATINEAU.fit",
+    "calibration": TESTDATA / "cheats" / "pedal_calibration" / "Garmin_Assioma_200mm_test_Dec_20_2022.fit",
+}
+SYNTHETIC_HOURS = [1, 6, 24]
+ROUNDS = 3
+SIMULATOR_PARAMS = dict(
+    rider_weight=70,
+    bike_weight=10,
+    wind_speed=3,
+    wind_direction=3,
+    temperature=20.1,
+    drag_coefficient=0.8,
+    frontal_area=0.565,
+    rolling_resistance=0.005,
+    efficiency_loss=0.04,
+)
+
+
+@pytest.fixture(scope="session")
+def synthetic_files(tmp_path_factory) -> dict[str, Path]:
+    directory = tmp_path_factory.mktemp("synthetic")
+    files = {}
+    for hours in SYNTHETIC_HOURS:
+        files[f"{hours}h"] = directory / f"synthetic_{hours}h.fit"
+        files[f"{hours}h"].write_bytes(fit_bytes(synthetic_ride(hours * 3600)))
+    return files
+
+
+@pytest.fixture(scope="session")
+def row_counts() -> dict[Path, int]:
+    return {}
+
+
+@pytest.fixture(params=[*TESTDATA_FILES, *[f"{h}h" for h in SYNTHETIC_HOURS]])
+def fit_file(request, synthetic_files, row_counts) -> tuple[Path, int]:
+    """A fit file and its number of rows"""
+    path = TESTDATA_FILES.get(request.param) or synthetic_files[request.param]
+    if path not in row_counts:
+        row_counts[path] = len(fit2df(path, columnar=True))
+    return path, row_counts[path]
+
+
+@pytest.fixture(params=[f"{h}h" for h in SYNTHETIC_HOURS])
+def ride(request) -> "pd.DataFrame":  # noqa: F821
+    df = synthetic_ride(int(request.param[:-1]) * 3600)
+    df["seconds"] = range(len(df))
+    return df
+
+
+def run(benchmark, rows: int, func, *args, **kwargs):
+    """Benchmark func and record rows/sec, the peak traced memory of one call and the peak process RSS"""
+    tracemalloc.start()
+    func(*args, **kwargs)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    result = benchmark.pedantic(func, args=args, kwargs=kwargs, rounds=ROUNDS)
+    benchmark.extra_info["rows"] = rows
+    if benchmark.stats is not None:
+        benchmark.extra_info["rows_per_sec"] = rows / benchmark.stats.stats.mean
+    benchmark.extra_info["peak_traced_mb"] = peak / 2**20
+    # ru_maxrss is in KB on Linux and bytes on macOS
+    scale = 2**20 if sys.platform == "darwin" else 2**10
+    benchmark.extra_info["max_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+    return result
+
+
+def test_fit2dict(benchmark, fit_file):
+    path, rows = fit_file
+    run(benchmark, rows, fit2dict, str(path))
+
+
+@pytest.mark.parametrize("columnar", [False, True], ids=["dict", "columnar"])
+def test_fit2df(benchmark, fit_file, columnar):
+    path, rows = fit_file
+    df = run(benchmark, rows, fit2df, str(path), columnar=columnar)
+    assert len(df) == rows
+
+
+def test_fit2csv(benchmark, fit_file, tmp_path):
+    path, rows = fit_file
+    df = fit2df(path, columnar=True)
+    run(benchmark, rows, lambda: fit2csv(df.copy(), tmp_path / "out.csv"))
+
+
+def test_fitfileinfo(benchmark, fit_file):
+    path, rows = fit_file
+    run(benchmark, rows, fitfileinfo, str(path))
+
+
+def test_simulator(benchmark, ride):
+    run(benchmark, len(ride), lambda: simulator(ride.copy(), **SIMULATOR_PARAMS))
+
+
+def test_simulator_not_inplace(benchmark, ride):
+    run(benchmark, len(ride), simulator, ride, inplace=False, **SIMULATOR_PARAMS)
+
+
+def test_max_effort(benchmark, ride):
+    run(benchmark, len(ride), max_effort, ride, seconds=1200, columns=["power", "heart_rate", "cadence"])
+
+
+def test_max_climb(benchmark, ride):
+    run(benchmark, len(ride), max_climb, ride, 1200)
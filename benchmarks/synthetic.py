@@ -0,0 +1,106 @@
+"""
+Synthetic rides of any length, as a `fit2df` style dataframe or as a FIT file, for scaling benchmarks, and the fit
+files the benchmark scripts run on.
+"""
+
+import struct
+from datetime import UTC, datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from fitdecode.utils import compute_crc
+
+FIT_EPOCH = datetime(1989, 12, 31, tzinfo=UTC)
+START = datetime(2023, 6, 1, 8, tzinfo=UTC)
+SEMICIRCLES = 2**31 / 180
+TESTDATA = Path(__file__).parent.parent / "tests" / "testdata"
+
+# (field number, FIT base type, numpy dtype) of the record message fields that are written
+RECORD_FIELDS = {
+    "timestamp": (253, 0x86, "<u4"),
+    "position_lat": (0, 0x85, "<i4"),
+    "position_long": (1, 0x85, "<i4"),
+    "altitude": (2, 0x84, "<u2"),
+    "heart_rate": (3, 0x02, "u1"),
+    "cadence": (4, 0x02, "u1"),
+    "distance": (5, 0x86, "<u4"),
+    "speed": (6, 0x84, "<u2"),
+    "power": (7, 0x84, "<u2"),
+    "temperature": (13, 0x01, "i1"),
+}
+
+
+def synthetic_ride(seconds: int, seed: int = 0) -> pd.DataFrame:
+    """A 1 Hz ride over rolling hills with power, heart rate, cadence, speed, distance, altitude and position"""
+    rng = np.random.default_rng(seed)
+    t = np.arange(seconds, dtype=np.float64)
+    speed = np.clip(8 + 2 * np.sin(t / 300) + rng.normal(0, 0.3, seconds), 0, None)
+    distance = np.cumsum(speed) - speed[0]
+    altitude = 200 + 80 * np.sin(distance / 5000) + 20 * np.sin(distance / 900)
+    power = np.clip(200 + 60 * np.sin(t / 600) + rng.normal(0, 40, seconds), 0, 1500).round()
+    heart_rate = (140 + 15 * np.sin(t / 600) + rng.normal(0, 2, seconds)).round()
+    cadence = np.clip(88 + rng.normal(0, 4, seconds), 0, 150).round()
+    heading = t / 3600
+    lat = 45.0 + np.cumsum(speed * np.cos(heading)) / 111_000
+    long = -75.0 + np.cumsum(speed * np.sin(heading)) / 78_000
+    return pd.DataFrame(
+        {
+            "position_lat": (lat * SEMICIRCLES).astype(np.int64),
+            "position_long": (long * SEMICIRCLES).astype(np.int64),
+            "distance": distance.round(2),
+            "enhanced_speed": speed.round(3),
+            "speed": speed.round(3),
+            "enhanced_altitude": (altitude * 5).round() / 5,
+            "altitude": (altitude * 5).round() / 5,
+            "power": power.astype(np.int64),
+            "heart_rate": heart_rate.astype(np.int64),
+            "cadence": cadence.astype(np.int64),
+            "temperature": np.full(seconds, 21, dtype=np.int64),
+        },
+        index=pd.date_range(START, periods=seconds, freq="s", name="timestamp"),
+    )
+
+
+def _definition(local: int, global_num: int, fields: list[tuple[int, int, int]]) -> bytes:
+    out = struct.pack("<BBBHB", 0x40 | local, 0, 0, global_num, len(fields))
+    return out + b"".join(struct.pack("<BBB", num, size, base) for num, size, base in fields)
+
+
+def fit_bytes(df: pd.DataFrame) -> bytes:
+    """Encode a `synthetic_ride` as a FIT activity file with file_id, record, session and activity messages"""
+    start = int((df.index[0] - FIT_EPOCH).total_seconds())
+    end = int((df.index[-1] - FIT_EPOCH).total_seconds())
+    body = _definition(0, 0, [(0, 1, 0x00), (1, 2, 0x84), (4, 4, 0x86)])
+    body += struct.pack("<BBHI", 0, 4, 255, start)  # file_id: activity, development manufacturer
+    dtype = np.dtype([("header", "u1")] + [(name, fmt) for name, (_, _, fmt) in RECORD_FIELDS.items()])
+    body += _definition(1, 20, [(num, dtype[name].itemsize, base) for name, (num, base, _) in RECORD_FIELDS.items()])
+    records = np.zeros(len(df), dtype=dtype)
+    records["header"] = 1
+    records["timestamp"] = start + np.arange(len(df))
+    records["position_lat"] = df.position_lat
+    records["position_long"] = df.position_long
+    records["altitude"] = ((df.altitude.to_numpy() + 500) * 5).round()
+    records["heart_rate"] = df.heart_rate
+    records["cadence"] = df.cadence
+    records["distance"] = (df.distance.to_numpy() * 100).round()
+    records["speed"] = (df.speed.to_numpy() * 1000).round()
+    records["power"] = df.power
+    records["temperature"] = df.temperature
+    body += records.tobytes()
+    body += _definition(2, 18, [(253, 4, 0x86), (2, 4, 0x86), (7, 4, 0x86), (9, 4, 0x86), (5, 1, 0x00)])
+    body += struct.pack("<BIIIIB", 2, end, start, (end - start) * 1000, int(df.distance.iloc[-1] * 100), 2)
+    body += _definition(3, 34, [(253, 4, 0x86), (1, 2, 0x84)])
+    body += struct.pack("<BIH", 3, end, 1)
+    header = struct.pack("<BBHI4s", 14, 0x20, 2172, len(body), b".FIT")
+    header += struct.pack("<H", compute_crc(header))
+    data = header + body
+    return data + struct.pack("<H", compute_crc(data))
+
+
+def fit_files(paths: list[str]) -> list[Path]:
+    """The given fit files, with directories searched recursively, tests/testdata without any"""
+    files = []
+    for p in [Path(p) for p in paths] or [TESTDATA]:
+        files.extend(sorted(f for f in p.rglob("*") if f.suffix.lower() == ".fit") if p.is_dir() else [p])
+    return files
@@ -0,0 +1,242 @@
+"""
+A compact, array backed container for the record data of one ride, an alternative to the `fit2df` dataframe when many
+rides are held in memory.
+
+Each field is one contiguous NumPy array with a fixed dtype per known FIT field (see FIELD_DTYPES), e.g. int16 power
+and uint8 heart rate and cadence, instead of float64 or object columns. An integer field with missing samples keeps a
+boolean mask next to its values. The class uses `__slots__` so an activity carries no per instance dict.
+
+activity = fit2activity("ride.fit")
+activity.nbytes, activity["power"], activity.get("power")  # raw int16 values, float64 with NaN where missing
+df = activity.to_df()  # zero-copy, the dataframe columns are views of the activity arrays
+activity = Activity.from_df(df)
+grid = activity.resample()  # on a uniform 1 Hz grid, cached on the activity
+"""
+
+from __future__ import annotations
+
+import math
+import os
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+from pyfitness.fd_loader import fit2columns
+from pyfitness.resample import MAX_GAP, PAUSED_ZERO, Resampled, resample, utc_datetime64, utc_timestamps
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# dtype of the known record fields, from the base type and scale of the FIT profile. Fields with a scale are stored
+# as float32 (float64 for distance, 0.01 m over 1000 km needs more than float32 precision).
+FIELD_DTYPES = {
+    "power": np.int16,
+    "heart_rate": np.uint8,
+    "cadence": np.uint8,
+    "fractional_cadence": np.float32,
+    "speed": np.float32,
+    "enhanced_speed": np.float32,
+    "vertical_speed": np.float32,
+    "altitude": np.float32,
+    "enhanced_altitude": np.float32,
+    "distance": np.float64,
+    "grade": np.float32,
+    "position_lat": np.int32,
+    "position_long": np.int32,
+    "temperature": np.int8,
+    "calories": np.uint16,
+    "accumulated_power": np.uint32,
+    "ascent": np.float32,
+    "descent": np.float32,
+    "resistance": np.uint8,
+    "gps_accuracy": np.uint8,
+    "cycle_length": np.float32,
+    "battery_soc": np.float32,
+    "left_right_balance": np.uint8,
+    "left_torque_effectiveness": np.float32,
+    "right_torque_effectiveness": np.float32,
+    "left_pedal_smoothness": np.float32,
+    "right_pedal_smoothness": np.float32,
+    "combined_pedal_smoothness": np.float32,
+    "left_pco": np.int8,
+    "right_pco": np.int8,
+    "respiration_rate": np.uint8,
+    "enhanced_respiration_rate": np.float32,
+    "core_temperature": np.float32,
+    "time_from_course": np.float32,
+}
+
+
+def _missing(values: np.ndarray) -> np.ndarray:
+    if values.dtype.kind == "f":
+        return np.isnan(values)
+    if values.dtype.kind == "O":
+        return np.array([v is None or (isinstance(v, float) and math.isnan(v)) for v in values], dtype=bool)
+    return np.zeros(len(values), dtype=bool)
+
+
+def typed_field(name: str, values: np.ndarray) -> tuple[np.ndarray, np.ndarray | None]:
+    """The values of a field in its FIELD_DTYPES dtype and the mask of missing samples (None if there are none).
+    Only integer fields get a mask, float fields hold NaN. A field that does not fit its dtype (fractions or out of
+    range values in an integer field) and unknown fields keep the dtype they have.
+    """
+    dtype = FIELD_DTYPES.get(name)
+    if dtype is None or values.dtype.kind not in "iuf":
+        return values, None
+    dtype = np.dtype(dtype)
+    if dtype.kind == "f":
+        return values.astype(dtype, copy=False), None
+    missing = _missing(values)
+    known = values[~missing]
+    info = np.iinfo(dtype)
+    if len(known) and (known.min() < info.min or known.max() > info.max or (known != np.round(known)).any()):
+        return values, None
+    if missing.any():
+        return np.where(missing, 0, values).astype(dtype), missing
+    return values.astype(dtype, copy=False), None
+
+
+class Activity(object):
+    """The record fields of a ride as NumPy arrays sharing a UTC `timestamp` array (naive datetime64).
+    columns: Field name -> values, in the dtype of FIELD_DTYPES for the known fields.
+    masks: Field name -> True where the sample is missing, only for integer fields with missing samples, their value
+        is 0 there.
+    """
+
+    __slots__ = ("_resampled", "columns", "masks", "timestamp")
+
+    def __init__(
+        self, timestamp: np.ndarray, columns: dict[str, np.ndarray], masks: dict[str, np.ndarray] | None = None
+    ):
+        if any(len(values) != len(timestamp) for values in columns.values()):
+            raise ValueError("Every column must have one value per timestamp")
+        self.timestamp = timestamp
+        self.columns = columns
+        self.masks = masks or {}
+        self._resampled = None
+
+    def __len__(self) -> int:
+        return len(self.timestamp)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.columns
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        return self.columns[name]
+
+    def __repr__(self) -> str:
+        return f"Activity({len(self)} samples, {len(self.columns)} fields, {self.nbytes / 2**10:.0f} KiB)"
+
+    @property
+    def fields(self) -> list[str]:
+        return list(self.columns)
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes used by the arrays, object columns count their pointers only"""
+        arrays = [self.timestamp, *self.columns.values(), *self.masks.values()]
+        return sum(arr.nbytes for arr in arrays)
+
+    def get(self, name: str, dtype=np.float64) -> np.ndarray:
+        """The values of a field as `dtype` (a float type) with NaN for the missing samples"""
+        values = self.columns[name].astype(dtype)
+        if name in self.masks:
+            values[self.masks[name]] = np.nan
+        return values
+
+    def resample(
+        self,
+        fill: dict[str, str] | None = None,
+        max_gap: float = MAX_GAP,
+        paused_zero: tuple[str, ...] | list[str] = PAUSED_ZERO,
+    ) -> Resampled:
+        """The numeric fields on a 1 Hz grid, see `pyfitness.resample.resample`.
+        The last grid is cached on the activity (its arrays are not expected to change), calling again with the same
+        arguments returns it without any work.
+        """
+        key = (tuple(sorted((fill or {}).items())), max_gap, tuple(paused_zero))
+        if self._resampled is None or self._resampled[0] != key:
+            known = self.timestamp[~np.isnat(self.timestamp)]
+            start = known.min() if len(known) else np.datetime64(0, "s")
+            seconds = (self.timestamp - start) / np.timedelta64(1, "s")
+            columns = {name: self.get(name) for name, values in self.columns.items() if values.dtype.kind in "biuf"}
+            grid = resample(seconds, columns, start, fill=fill, max_gap=max_gap, paused_zero=paused_zero)
+            self._resampled = (key, grid)
+        return self._resampled[1]
+
+    @classmethod
+    def from_columns(cls, columns: dict[str, np.ndarray]) -> Activity:
+        """An activity from `fit2columns` arrays. Like `records2df`, empty fields and empty samples are dropped."""
+        columns = dict(columns)
+        timestamp = utc_datetime64(columns.pop("timestamp"), unit="s")
+        missing = {name: _missing(values) for name, values in columns.items()}
+        missing = {name: m for name, m in missing.items() if not m.all()}
+        keep = ~np.logical_and.reduce(list(missing.values())) if missing else np.zeros(len(timestamp), dtype=bool)
+        if not keep.all():
+            timestamp = timestamp[keep]
+            missing = {name: m[keep] for name, m in missing.items()}
+        typed = {}
+        masks = {}
+        for name in missing:
+            values = columns[name] if keep.all() else columns[name][keep]
+            typed[name], mask = typed_field(name, values)
+            if mask is not None:
+                masks[name] = mask
+        return cls(timestamp, typed, masks)
+
+    @classmethod
+    def from_df(cls, df: pd.DataFrame) -> Activity:
+        """An activity from a dataframe indexed by timestamp, like `fit2df` returns.
+        Columns that already have their FIELD_DTYPES dtype (e.g. from `to_df`, nullable ones without missing samples)
+        and a naive index are not copied.
+        """
+        import pandas as pd
+
+        columns = {}
+        masks = {}
+        for name, col in df.items():
+            array = col.array
+            if isinstance(array, pd.arrays.IntegerArray):
+                # nullable integer column, as created by `to_df`
+                dtype = array.dtype.numpy_dtype
+                mask = array.isna()
+                if not mask.any():
+                    values, mask = array.to_numpy(dtype=dtype), None
+                elif np.dtype(FIELD_DTYPES.get(name, dtype)) == dtype:
+                    values = array.to_numpy(dtype=dtype, na_value=0)
+                else:
+                    values, mask = typed_field(name, array.to_numpy(dtype=np.float64, na_value=np.nan))
+            else:
+                values, mask = typed_field(name, col.to_numpy())
+            columns[name] = values
+            if mask is not None:
+                masks[name] = mask
+        return cls(utc_timestamps(df), columns, masks)
+
+    def to_df(self, nullable: bool = True, utc: bool = True) -> pd.DataFrame:
+        """The activity as a dataframe indexed by timestamp, the columns are views of the activity arrays.
+        nullable: Integer fields with missing samples become nullable integer columns ("Int16", "UInt8", ...) that
+            share the values and mask, False returns them as float64 with NaN (a copy).
+        utc: A UTC index like `fit2df`, which copies the timestamps, False keeps a naive index that is a view.
+        """
+        import pandas as pd
+
+        data = {}
+        for name, values in self.columns.items():
+            if name not in self.masks:
+                data[name] = values
+            elif nullable:
+                data[name] = pd.arrays.IntegerArray(values, self.masks[name])
+            else:
+                data[name] = self.get(name)
+        index = pd.DatetimeIndex(self.timestamp, name="timestamp", copy=False)
+        if utc:
+            index = index.tz_localize("UTC")
+        return pd.DataFrame(data, index=index, copy=False)
+
+
+def fit2activity(fit_file: str | os.PathLike | bytes) -> Activity:
+    """Load the record messages of a fit file into an `Activity`"""
+    if isinstance(fit_file, os.PathLike):
+        fit_file = os.fspath(fit_file)
+    return Activity.from_columns(fit2columns(fit_file))
@@ -0,0 +1,194 @@
+"""
+Decode fit files from asyncio code without blocking the event loop.
+
+Decoding runs in a `FitExecutor`, a bounded process (or thread) pool. At most `max_pending` decodes are submitted to
+the pool at once, more callers wait for a slot (backpressure), and cancelling the awaiting task cancels a decode that
+has not started yet. Uploads can be paths, bytes or file objects, including objects with an async `read()`.
+
+df = await afit2df(await request.body())
+async for result in afit2df_many(uploads, executor=FitExecutor(max_workers=4)):
+    ...  # BatchResult in completion order, result.error is None on success
+"""
+
+from __future__ import annotations
+
+import asyncio
+import inspect
+import os
+from contextlib import suppress
+from collections.abc import AsyncIterator, Callable, Iterable
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from typing import IO, TYPE_CHECKING, Any
+
+from pyfitness import backends
+from pyfitness.batch import BatchResult
+from pyfitness.fd_loader import fit2df, fit2dict
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+FitInput = str | os.PathLike | bytes | bytearray | memoryview | IO[bytes]
+
+
+class FitExecutor(object):
+    """A bounded pool for decoding fit files from asyncio code.
+    max_workers: Number of processes (or threads), the CPU budget, defaults to os.cpu_count().
+    processes: Decode in worker processes so the decodes run in parallel, False uses threads which start faster
+        but share the GIL with the event loop.
+    max_pending: Max number of decodes submitted to the pool (running or queued), defaults to 2 * max_workers.
+    """
+
+    def __init__(self, max_workers: int | None = None, processes: bool = True, max_pending: int | None = None):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.processes = processes
+        self.max_pending = max(1, max_pending or 2 * self.max_workers)
+        self._pool: Executor | None = None
+        self._slots: asyncio.Semaphore | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+    @property
+    def pool(self) -> Executor:
+        if self._pool is None:
+            pool_class = ProcessPoolExecutor if self.processes else ThreadPoolExecutor
+            self._pool = pool_class(max_workers=self.max_workers)
+        return self._pool
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:  # a semaphore belongs to one event loop
+            self._loop = loop
+            self._slots = asyncio.Semaphore(self.max_pending)
+        return self._slots
+
+    async def run(self, func: Callable, *args) -> Any:
+        """Run a picklable function in the pool once a slot is free and return its result.
+        The slot is held until the pool is done with the call: cancelling the caller cancels a decode that has not
+        started, one that is running keeps its slot until it finishes.
+        """
+        slots = self._semaphore()
+        await slots.acquire()
+        try:
+            future = self.pool.submit(func, *args)
+        except BaseException:
+            slots.release()
+            raise
+        loop = asyncio.get_running_loop()
+
+        def release(_):
+            with suppress(RuntimeError):  # the event loop was closed before the decode finished
+                loop.call_soon_threadsafe(slots.release)
+
+        future.add_done_callback(release)
+        wrapped = asyncio.wrap_future(future)
+        try:
+            return await asyncio.shield(wrapped)
+        except asyncio.CancelledError:
+            future.cancel()
+            wrapped.add_done_callback(lambda f: f.cancelled() or f.exception())  # nobody waits for it anymore
+            raise
+
+    def shutdown(self, wait: bool = True):
+        """Stop the pool, decodes that have not started are cancelled"""
+        if self._pool is not None:
+            self._pool.shutdown(wait=wait, cancel_futures=True)
+            self._pool = None
+
+    async def __aenter__(self) -> FitExecutor:
+        return self
+
+    async def __aexit__(self, *exc):
+        await asyncio.to_thread(self.shutdown)
+
+
+_default: dict[str, FitExecutor] = {}
+
+
+def get_executor() -> FitExecutor:
+    """The executor used when a call does not pass one, a process pool with one worker per CPU"""
+    if "executor" not in _default:
+        _default["executor"] = FitExecutor()
+    return _default["executor"]
+
+
+def set_executor(executor: FitExecutor):
+    """Set the executor used when a call does not pass one, e.g. to change the CPU budget"""
+    _default["executor"] = executor
+
+
+async def read_upload(fit_file: FitInput) -> str | bytes:
+    """A path as str, or the content of bytes and (sync or async) file objects, ready to send to a worker.
+    A sync `read()` runs in a thread so a slow file does not block the event loop.
+    """
+    if isinstance(fit_file, str | os.PathLike):
+        return os.fspath(fit_file)
+    if isinstance(fit_file, bytes | bytearray | memoryview):
+        return bytes(fit_file)
+    if hasattr(fit_file, "read"):
+        if inspect.iscoroutinefunction(fit_file.read):
+            return await fit_file.read()
+        data = await asyncio.to_thread(fit_file.read)
+        return await data if inspect.isawaitable(data) else data
+    raise ValueError(f"Expected a path, bytes or a file object, got {type(fit_file).__name__}")
+
+
+async def afit2df(
+    fit_file: FitInput, columnar: bool = False, executor: FitExecutor | None = None, backend: str | None = None
+) -> pd.DataFrame:
+    """`fit2df` in an executor, for a path, bytes or a file object"""
+    func = partial(fit2df, columnar=columnar, backend=backends.backend_name(backend))
+    data = await read_upload(fit_file)
+    return await (executor or get_executor()).run(func, data)
+
+
+async def afit2dict(fit_file: FitInput, executor: FitExecutor | None = None, backend: str | None = None) -> dict:
+    """`fit2dict` in an executor, for a path, bytes or a file object"""
+    func = partial(fit2dict, backend=backends.backend_name(backend))
+    data = await read_upload(fit_file)
+    return await (executor or get_executor()).run(func, data)
+
+
+async def _decode(func: Callable, index: int, fit_file: FitInput, executor: FitExecutor) -> BatchResult:
+    path = os.fspath(fit_file) if isinstance(fit_file, str | os.PathLike) else None
+    try:
+        return BatchResult(index, path, await executor.run(func, await read_upload(fit_file)), None)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:  # noqa: BLE001 - any decode error is returned in the BatchResult
+        return BatchResult(index, path, None, e)
+
+
+async def amap_fit_files(
+    func: Callable, fit_files: Iterable[FitInput], executor: FitExecutor | None = None
+) -> AsyncIterator[BatchResult]:
+    """Decode many fit files with a picklable function and yield a BatchResult for each in completion order.
+    Only `executor.max_pending` uploads are read and decoding at any time, the rest are not touched until a slot is
+    free. Closing the iterator (or cancelling the task using it) cancels the decodes in flight.
+    """
+    executor = executor or get_executor()
+    pending = set()
+    try:
+        for index, fit_file in enumerate(fit_files):
+            if len(pending) >= executor.max_pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    yield task.result()
+            pending.add(asyncio.ensure_future(_decode(func, index, fit_file, executor)))
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield task.result()
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+def afit2df_many(
+    fit_files: Iterable[FitInput],
+    columnar: bool = False,
+    executor: FitExecutor | None = None,
+    backend: str | None = None,
+) -> AsyncIterator[BatchResult]:
+    """Load many uploads into dataframes concurrently within the executor's CPU budget, see `amap_fit_files`"""
+    func = partial(fit2df, columnar=columnar, backend=backends.backend_name(backend))
+    return amap_fit_files(func, fit_files, executor)
@@ -0,0 +1,76 @@
+"""
+Select the library that decodes fit files. A backend is a module with `fit2dict(fit_file)` and `fit2df(fit_file)`
+returning the schema of `fd_loader`, the backend module is only imported when it is first used.
+
+- "fitdecode": `pyfitness.fd_loader` (default)
+- "garmin_fit_sdk": `pyfitness.sdk_loader`, the Garmin FIT SDK
+
+df = fit2df("ride.fit", backend="garmin_fit_sdk")  # one call
+set_backend("garmin_fit_sdk")  # every call without a backend, or set PYFITNESS_BACKEND=garmin_fit_sdk
+
+The default applies to `fd_loader.fit2df` and `fd_loader.fit2dict` and everything decoding through them: the batch and
+async APIs, `FitCache` (which keeps the results of each backend apart) and `RideIndex`.
+
+python benchmarks/bench_backends.py compares the decode speed and memory of the backends.
+"""
+
+from __future__ import annotations
+
+import importlib
+import os
+from typing import TYPE_CHECKING, Any, Protocol
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+BACKENDS = {"fitdecode": "pyfitness.fd_loader", "garmin_fit_sdk": "pyfitness.sdk_loader"}
+
+
+class FitBackend(Protocol):
+    def fit2dict(self, fit_file: str | os.PathLike | bytes) -> dict[str, Any]: ...
+
+    def fit2df(self, fit_file: str | os.PathLike | bytes) -> pd.DataFrame: ...
+
+
+def _check(name: str) -> str:
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown backend {name!r}, expected one of {', '.join(BACKENDS)}")
+    return name
+
+
+_default = {"backend": _check(os.environ.get("PYFITNESS_BACKEND", "fitdecode"))}
+
+
+def set_backend(name: str):
+    """Set the backend used when a call does not name one"""
+    _default["backend"] = _check(name)
+
+
+def backend_name(name: str | None = None) -> str:
+    """`name` if it is a known backend, or the name of the current default"""
+    return _check(name or _default["backend"])
+
+
+def get_backend(name: str | None = None) -> FitBackend:
+    """The backend module called `name`, or the current default"""
+    name = backend_name(name)
+    try:
+        return importlib.import_module(BACKENDS[name])
+    except ModuleNotFoundError as e:
+        if e.name != name:
+            raise
+        raise ImportError(f"The {name} backend is not installed, pip install pyfitness[sdk]") from e
+
+
+def fit2dict(fit_file: str | os.PathLike | bytes, backend: str | None = None) -> dict[str, Any]:
+    """Load a fit file into a dict with the given or default backend"""
+    from pyfitness.fd_loader import fit2dict
+
+    return fit2dict(fit_file, backend=backend)
+
+
+def fit2df(fit_file: str | os.PathLike | bytes, backend: str | None = None) -> pd.DataFrame:
+    """Load a fit file into a dataframe with the given or default backend"""
+    from pyfitness.fd_loader import fit2df
+
+    return fit2df(fit_file, backend=backend)
@@ -0,0 +1,150 @@
+"""
+Decode many fit files in parallel across a process pool.
+
+for result in fit2df_many(["rides/2023", "rides/2024"], workers=8):
+    if result.error is None:
+        ...  # result.value is the dataframe for result.path
+"""
+
+import os
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from functools import partial
+from pathlib import Path
+from typing import Any, NamedTuple
+
+from pyfitness import backends
+from pyfitness.fd_loader import fit2df, fit2dict
+
+
+class BatchResult(NamedTuple):
+    """The outcome of decoding one file, `error` is None on success and `value` is None on failure"""
+
+    index: int
+    path: str
+    value: Any
+    error: BaseException | None
+
+
+def find_fit_files(paths: str | os.PathLike | Iterable[str | os.PathLike], suffix: str = ".fit") -> list[str]:
+    """Expand files and directories (searched recursively for files ending in `suffix`, in any case, Garmin devices
+    write .FIT) into a list of fit file paths"""
+    if isinstance(paths, str | os.PathLike):
+        paths = [paths]
+    files = []
+    for p in map(Path, paths):
+        if p.is_dir():
+            files.extend(str(f) for f in sorted(p.rglob("*")) if f.suffix.lower() == suffix.lower() and f.is_file())
+        else:
+            files.append(str(p))
+    return files
+
+
+def _decode_chunk(func: Callable, chunk: list[tuple[int, str]]) -> list[BatchResult]:
+    """Worker task, decode each file in the chunk and capture the error instead of raising"""
+    results = []
+    for index, path in chunk:
+        try:
+            results.append(BatchResult(index, path, func(path), None))
+        except Exception as e:  # noqa: BLE001 - any decode error is returned in the BatchResult
+            results.append(BatchResult(index, path, None, e))
+    return results
+
+
+def map_fit_files(  # noqa: PLR0913 - the pool options are keyword-only
+    func: Callable[[str], Any],
+    paths: str | os.PathLike | Iterable[str | os.PathLike],
+    *,
+    workers: int | None = None,
+    ordered: bool = True,
+    chunksize: int = 1,
+    max_in_flight: int | None = None,
+) -> Iterator[BatchResult]:
+    """Apply a picklable decode function to many fit files in a process pool.
+    workers: Number of processes, defaults to os.cpu_count(). workers=1 decodes in this process.
+    ordered: Yield results in input order, otherwise in completion order.
+    chunksize: Number of files sent to a worker per task.
+    max_in_flight: Max number of chunks submitted or decoded but not yet yielded, this bounds the number of decoded
+        frames held in memory. Defaults to 2 * workers.
+    The worker processes decode with the default backend of this process (see `backends.set_backend`).
+    """
+    files = list(enumerate(find_fit_files(paths)))
+    chunks = [files[i : i + chunksize] for i in range(0, len(files), chunksize)]
+    if workers == 1:
+        for chunk in chunks:
+            yield from _decode_chunk(func, chunk)
+        return
+    workers = workers or os.cpu_count() or 1
+    max_in_flight = max(1, max_in_flight or 2 * workers)
+    task = partial(_decode_chunk, func)
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=backends.set_backend, initargs=(backends.backend_name(),)
+    ) as pool:
+        pending: dict[Future, list[tuple[int, str]]] = {}
+        done_chunks: dict[int, list[BatchResult]] = {}  # only used when ordered, keyed by chunk number
+        next_submit = 0
+        next_yield = 0
+        try:
+            while next_yield < len(chunks):
+                while next_submit < len(chunks) and len(pending) + len(done_chunks) < max_in_flight:
+                    pending[pool.submit(task, chunks[next_submit])] = next_submit
+                    next_submit += 1
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    chunk_number = pending.pop(future)
+                    try:
+                        results = future.result()
+                    except Exception as e:  # noqa: BLE001 - the worker died or the result could not be pickled
+                        results = [BatchResult(i, path, None, e) for i, path in chunks[chunk_number]]
+                    if ordered:
+                        done_chunks[chunk_number] = results
+                    else:
+                        next_yield += 1
+                        yield from results
+                while ordered and next_yield in done_chunks:
+                    yield from done_chunks.pop(next_yield)
+                    next_yield += 1
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def fit2df_many(  # noqa: PLR0913 - the pool options are keyword-only
+    paths: str | os.PathLike | Iterable[str | os.PathLike],
+    *,
+    workers: int | None = None,
+    ordered: bool = True,
+    chunksize: int = 1,
+    max_in_flight: int | None = None,
+    columnar: bool = False,
+    backend: str | None = None,
+) -> Iterator[BatchResult]:
+    """Load many fit files (or directories of fit files) into dataframes in parallel, see `map_fit_files`"""
+    return map_fit_files(
+        partial(fit2df, columnar=columnar, backend=backends.backend_name(backend)),
+        paths,
+        workers=workers,
+        ordered=ordered,
+        chunksize=chunksize,
+        max_in_flight=max_in_flight,
+    )
+
+
+def fit2dict_many(  # noqa: PLR0913 - the pool options are keyword-only
+    paths: str | os.PathLike | Iterable[str | os.PathLike],
+    *,
+    workers: int | None = None,
+    ordered: bool = True,
+    chunksize: int = 1,
+    max_in_flight: int | None = None,
+    backend: str | None = None,
+) -> Iterator[BatchResult]:
+    """Load many fit files (or directories of fit files) into dicts in parallel, see `map_fit_files`"""
+    return map_fit_files(
+        partial(fit2dict, backend=backends.backend_name(backend)),
+        paths,
+        workers=workers,
+        ordered=ordered,
+        chunksize=chunksize,
+        max_in_flight=max_in_flight,
+    )
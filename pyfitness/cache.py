@@ -0,0 +1,211 @@
+"""
+Opt-in on disk cache for decoded fit files.
+
+Entries are keyed by a hash of the fit file content plus the pyfitness version and the decode options, so a changed
+file or a new release never returns a stale result. Dataframes are stored column by column in a `.npz` file, `fit2dict`
+results are pickled. Writes go to a temp file that is renamed into place, so concurrent processes sharing a cache
+directory never see a partial entry. The directory is kept under `max_bytes` by evicting the least recently used
+entries. The cache keeps a running total of the directory size, the directory is only scanned (O(entries)) when a
+write takes the total over `max_bytes`, entries other processes write are counted at that scan.
+
+cache = FitCache("~/.cache/pyfitness")
+df = fit2df("ride.fit", cache=cache)  # or cache.fit2df("ride.fit")
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+from contextlib import suppress
+from importlib.metadata import PackageNotFoundError, version
+from pathlib import Path
+from typing import TYPE_CHECKING, Any
+
+import numpy as np
+
+from pyfitness import backends, fd_loader
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+CACHE_FORMAT = 1
+
+try:
+    PYFITNESS_VERSION = version("pyfitness")
+except PackageNotFoundError:
+    PYFITNESS_VERSION = "unknown"
+
+
+def content_hash(fit_file: str | os.PathLike | bytes) -> str:
+    """Hash of the fit file content, `fit_file` is a path or the file bytes"""
+    if isinstance(fit_file, bytes | bytearray | memoryview):
+        return hashlib.blake2b(fit_file, digest_size=20).hexdigest()
+    with open(fit_file, "rb") as f:
+        return hashlib.file_digest(f, lambda: hashlib.blake2b(digest_size=20)).hexdigest()
+
+
+def df2arrays(df: pd.DataFrame) -> dict[str, np.ndarray]:
+    """Split a dataframe (and its index) into arrays plus a json meta entry that `arrays2df` uses to restore dtypes"""
+    import pandas as pd
+
+    df = df.reset_index()
+    arrays = {}
+    meta = {"columns": [], "index": df.columns[0]}
+    for i, (name, col) in enumerate(df.items()):
+        tz = None
+        if isinstance(col.dtype, pd.DatetimeTZDtype):
+            tz = str(col.dtype.tz)
+            values = col.dt.tz_localize(None).to_numpy()
+        elif col.dtype.kind in "biufcmM":
+            values = col.to_numpy()
+        else:
+            values = col.to_numpy(dtype=object)
+        arrays[f"c{i}"] = values
+        meta["columns"].append({"name": name, "dtype": str(col.dtype), "tz": tz})
+    arrays["meta"] = np.array(json.dumps(meta))
+    return arrays
+
+
+def arrays2df(arrays: dict[str, np.ndarray]) -> pd.DataFrame:
+    """Rebuild the dataframe written by `df2arrays`"""
+    import pandas as pd
+
+    meta = json.loads(str(arrays["meta"]))
+    data = {}
+    for i, column in enumerate(meta["columns"]):
+        col = pd.Series(arrays[f"c{i}"])
+        if column["tz"] is not None:
+            col = col.dt.tz_localize(column["tz"])
+        elif str(col.dtype) != column["dtype"]:
+            col = col.astype(column["dtype"])
+        data[column["name"]] = col
+    return pd.DataFrame(data).set_index(meta["index"])
+
+
+class FitCache(object):
+    """Size bounded LRU cache of decoded fit files in a directory"""
+
+    def __init__(self, directory: str | os.PathLike, max_bytes: int = 2**30):
+        self.directory = Path(directory).expanduser()
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        # bytes in the directory at the last scan plus the writes since, None until the first scan
+        self._size: int | None = None
+
+    def stats(self) -> dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "writes": self.writes, "evictions": self.evictions}
+
+    def key(self, fit_file: str | os.PathLike | bytes, kind: str, **options) -> str:
+        """Cache key of a decode, `kind` is the loader name and `options` its keyword arguments"""
+        options = json.dumps(options, sort_keys=True)
+        parts = f"{content_hash(fit_file)}|{PYFITNESS_VERSION}|{CACHE_FORMAT}|{kind}|{options}"
+        return hashlib.blake2b(parts.encode("utf-8"), digest_size=20).hexdigest()
+
+    def _load(self, path: Path, loader) -> Any:
+        try:
+            with open(path, "rb") as f:
+                value = loader(f)
+        except FileNotFoundError:  # not cached, or evicted by another process
+            self.misses += 1
+            return None
+        with suppress(FileNotFoundError):
+            os.utime(path)  # mark as recently used
+        self.hits += 1
+        return value
+
+    def _store(self, path: Path, writer):
+        try:
+            replaced = path.stat().st_size
+        except FileNotFoundError:
+            replaced = 0
+        fd, tmp = tempfile.mkstemp(dir=self.directory, prefix=".tmp-", suffix=path.suffix)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                writer(f)
+                written = f.tell()
+            os.replace(tmp, path)
+        except BaseException:
+            Path(tmp).unlink(missing_ok=True)
+            raise
+        self.writes += 1
+        if self._size is not None:
+            self._size += written - replaced
+        if self._size is None or self._size > self.max_bytes:
+            self.evict()
+
+    def fit2df(
+        self, fit_file: str | os.PathLike | bytes, columnar: bool = False, backend: str | None = None
+    ) -> pd.DataFrame:
+        """Cached `fd_loader.fit2df`, the decodes of each backend are cached separately"""
+        backend = backends.backend_name(backend)
+        path = self.directory / f"{self.key(fit_file, 'fit2df', backend=backend)}.npz"
+        df = self._load(path, lambda f: arrays2df(dict(np.load(f, allow_pickle=True))))
+        if df is None:
+            df = fd_loader.fit2df(fit_file, columnar=columnar, backend=backend)
+            self._store(path, lambda f: np.savez(f, **df2arrays(df)))
+        return df
+
+    def fit2dict(self, fit_file: str | os.PathLike | bytes, backend: str | None = None) -> dict:
+        """Cached `fd_loader.fit2dict`, the decodes of each backend are cached separately"""
+        backend = backends.backend_name(backend)
+        path = self.directory / f"{self.key(fit_file, 'fit2dict', backend=backend)}.pkl"
+        fit_dict = self._load(path, pickle.load)
+        if fit_dict is None:
+            fit_dict = fd_loader.fit2dict(fit_file, backend=backend)
+            self._store(path, lambda f: pickle.dump(fit_dict, f, protocol=pickle.HIGHEST_PROTOCOL))
+        return fit_dict
+
+    def entries(self) -> list[os.DirEntry]:
+        """Cache entries, least recently used first"""
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.startswith(".tmp-") or not entry.is_file():
+                    continue
+                try:
+                    entries.append((entry.stat().st_mtime, entry))
+                except FileNotFoundError:
+                    continue
+        return [entry for _, entry in sorted(entries, key=lambda e: e[0])]
+
+    def size(self) -> int:
+        total = 0
+        for entry in self.entries():
+            try:
+                total += entry.stat().st_size
+            except FileNotFoundError:
+                continue
+        return total
+
+    def evict(self):
+        """Scan the directory and delete least recently used entries until the cache is under max_bytes"""
+        entries = self.entries()
+        sizes = []
+        for entry in entries:
+            try:
+                sizes.append(entry.stat().st_size)
+            except FileNotFoundError:
+                sizes.append(0)
+        total = sum(sizes)
+        for entry, entry_size in zip(entries, sizes, strict=True):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.unlink(entry.path)
+                self.evictions += 1
+            except FileNotFoundError:
+                pass
+            total -= entry_size
+        self._size = total
+
+    def clear(self):
+        for entry in self.entries():
+            Path(entry.path).unlink(missing_ok=True)
+        self._size = 0
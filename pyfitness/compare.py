@@ -0,0 +1,253 @@
+"""
+Compare two recordings of the same ride, e.g. pedals and a smart trainer, to check one power meter against another.
+
+Both rides are put on the 1 Hz grid of `resample_df`, the time offset between them is the peak of the FFT
+cross-correlation of their power (O(n log n), all lags at once) and the difference statistics are computed on the
+aligned overlap. Many pairs are aligned together, one batched FFT per padded length.
+
+result = compare_rides(fit2df("assioma.fit"), fit2df("kickr.fit"))
+result.offset, result.mean_difference, result.zone_bias, result.suspicious
+table = compare_files([("a1.fit", "b1.fit"), ("a2.fit", "b2.fit")], workers=8)  # one row of stats per pair
+"""
+
+from __future__ import annotations
+
+import os
+from collections.abc import Iterable, Sequence
+from functools import partial
+from typing import TYPE_CHECKING, NamedTuple
+
+import numpy as np
+
+from pyfitness import instrument
+from pyfitness.batch import map_fit_files
+from pyfitness.metrics import rolling_mean
+from pyfitness.resample import Resampled, resample_df
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Largest time offset in seconds searched between the recorded timestamps of the two rides, None searches all lags
+MAX_LAG = 600
+
+# Power zone edges in watts for the per zone bias, zone i is [ZONES[i - 1], ZONES[i]) of the mean of both meters
+ZONES = (100, 150, 200, 250, 300, 400, 500)
+
+# Suspicious segments: windows of WINDOW seconds where the meters disagree by more than the larger of MAX_DIFFERENCE
+# watts and MAX_RELATIVE of the reference power
+WINDOW = 60
+MAX_DIFFERENCE = 15.0
+MAX_RELATIVE = 0.08
+
+
+class Comparison(NamedTuple):
+    """Ride b aligned on ride a, `a` and `b` are their power on the common 1 Hz grid starting at `start`.
+    offset: Seconds to add to the timestamps of b to line it up with a.
+    correlation: Pearson correlation of the aligned power, near 1 for the same ride.
+    mean_difference: Mean of b - a in watts over the seconds where either meter reads power.
+    ratio: Total power of b over a, in the same seconds.
+    drift: Slope of b - a in watts per hour.
+    zone_bias: Mean of b - a in each zone of ZONES (NaN for zones without samples), zone_seconds the samples in each.
+    suspicious: [start, end) seconds from `start` of the stretches where the meters disagree, see WINDOW.
+    """
+
+    offset: int
+    correlation: float
+    start: np.datetime64
+    a: np.ndarray
+    b: np.ndarray
+    mean_difference: float
+    ratio: float
+    drift: float
+    zone_bias: np.ndarray
+    zone_seconds: np.ndarray
+    suspicious: np.ndarray
+
+    def stats(self) -> dict:
+        """The scalar statistics, a row of `compare_many`"""
+        return {
+            "offset": self.offset,
+            "correlation": self.correlation,
+            "overlap": len(self.a),
+            "mean_difference": self.mean_difference,
+            "ratio": self.ratio,
+            "drift": self.drift,
+            "suspicious_seconds": int(np.sum(self.suspicious[:, 1] - self.suspicious[:, 0])),
+            "suspicious_segments": len(self.suspicious),
+        }
+
+
+def power_grid(ride: pd.DataFrame | Resampled | str | os.PathLike, column: str = "power") -> Resampled:
+    """A ride's `column` on the 1 Hz grid, from a `fit2df` dataframe, a path or an already resampled ride"""
+    if isinstance(ride, Resampled):
+        return ride
+    if isinstance(ride, str | os.PathLike):
+        from pyfitness.fd_loader import fit2df
+
+        ride = fit2df(ride, columnar=True)
+    return resample_df(ride[[column]])
+
+
+def _lags(n_fft: int, len_a: int) -> np.ndarray:
+    """The lag k of each cross-correlation bin, b[i] lines up with a[i + k]"""
+    lags = np.arange(n_fft)
+    lags[lags >= len_a] -= n_fft
+    return lags
+
+
+@instrument.timed("compare.align")
+def align(
+    streams_a: Sequence[np.ndarray],
+    streams_b: Sequence[np.ndarray],
+    start_offsets: Sequence[float] | np.ndarray | None = None,
+    max_lag: int | None = MAX_LAG,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Lag and cross-correlation (normalised by both whole streams) of each pair of 1 Hz streams, b[i] lines up with
+    a[i + lag].
+    start_offsets: Seconds from the start of a to the start of b for each pair, with max_lag only lags within
+        max_lag seconds of what the recorded timestamps imply are searched.
+    The pairs are zero padded to the next power of two of len(a) + len(b) and every group with the same padded length
+    is correlated with one 2D rfft/irfft.
+    """
+    n_pairs = len(streams_a)
+    start_offsets = np.zeros(n_pairs) if start_offsets is None else np.asarray(start_offsets, dtype=np.float64)
+    lags = np.zeros(n_pairs, dtype=np.int64)
+    correlations = np.full(n_pairs, np.nan)
+    sizes = [1 << max(int(len(a) + len(b) - 1).bit_length(), 1) for a, b in zip(streams_a, streams_b, strict=True)]
+    for n_fft in set(sizes):
+        group = [i for i, size in enumerate(sizes) if size == n_fft]
+        padded_a = np.zeros((len(group), n_fft))
+        padded_b = np.zeros((len(group), n_fft))
+        for row, i in enumerate(group):
+            a = np.nan_to_num(np.asarray(streams_a[i], dtype=np.float64))
+            b = np.nan_to_num(np.asarray(streams_b[i], dtype=np.float64))
+            padded_a[row, : len(a)] = a - a.mean() if len(a) else a
+            padded_b[row, : len(b)] = b - b.mean() if len(b) else b
+        norms = np.sqrt(np.sum(padded_a**2, axis=1) * np.sum(padded_b**2, axis=1))
+        corr = np.fft.irfft(np.fft.rfft(padded_a) * np.conj(np.fft.rfft(padded_b)), n=n_fft)
+        for row, i in enumerate(group):
+            len_a, len_b = len(streams_a[i]), len(streams_b[i])
+            k = _lags(n_fft, len_a)
+            valid = (k > -len_b) & (k < len_a)
+            if max_lag is not None:
+                valid &= np.abs(k - start_offsets[i]) <= max_lag
+            if not valid.any() or norms[row] == 0:
+                continue
+            best = np.flatnonzero(valid)[np.argmax(corr[row][valid])]
+            lags[i] = k[best]
+            correlations[i] = corr[row, best] / norms[row]
+    return lags, correlations
+
+
+def _runs(flags: np.ndarray) -> np.ndarray:
+    """[start, end) of the runs of True"""
+    edges = np.flatnonzero(np.diff(np.concatenate([[0], flags.astype(np.int8), [0]])))
+    return edges.reshape(-1, 2)
+
+
+def _difference_stats(  # noqa: PLR0913 - the thresholds are keyword-only
+    a: np.ndarray,
+    b: np.ndarray,
+    zones: Sequence[float],
+    *,
+    window: int,
+    max_difference: float,
+    max_relative: float,
+) -> dict:
+    riding = (a > 0) | (b > 0)
+    diff = b - a
+    d, t = diff[riding], np.flatnonzero(riding)
+    sum_a = a[riding].sum()
+    drift = float(np.polyfit(t, d, 1)[0] * 3600) if len(d) > 1 and np.ptp(t) else np.nan
+    level = np.digitize((a + b)[riding] / 2, zones)
+    seconds = np.bincount(level, minlength=len(zones) + 1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        bias = np.bincount(level, weights=d, minlength=len(zones) + 1) / seconds
+    covered = np.zeros(len(a), dtype=bool)
+    if len(a) >= window:
+        flagged = np.abs(rolling_mean(diff, window)) > np.maximum(
+            max_difference, max_relative * rolling_mean(a, window)
+        )
+        marks = np.zeros(len(a) + 1, dtype=np.int64)
+        np.add.at(marks, np.flatnonzero(flagged), 1)
+        np.add.at(marks, np.flatnonzero(flagged) + window, -1)
+        covered = np.cumsum(marks[:-1]) > 0
+    return {
+        "mean_difference": float(d.mean()) if len(d) else np.nan,
+        "ratio": float(b[riding].sum() / sum_a) if sum_a else np.nan,
+        "drift": drift,
+        "zone_bias": bias,
+        "zone_seconds": seconds,
+        "suspicious": _runs(covered),
+    }
+
+
+def compare_many(  # noqa: PLR0913 - the options are keyword-only
+    pairs: Iterable[tuple[pd.DataFrame | Resampled | str | os.PathLike, pd.DataFrame | Resampled | str | os.PathLike]],
+    *,
+    column: str = "power",
+    max_lag: int | None = MAX_LAG,
+    zones: Sequence[float] = ZONES,
+    window: int = WINDOW,
+    max_difference: float = MAX_DIFFERENCE,
+    max_relative: float = MAX_RELATIVE,
+) -> list[Comparison]:
+    """Align and compare many (a, b) pairs of rides, a is the reference meter. See `Comparison` for the results.
+    The rides are `fit2df` dataframes, paths or `power_grid` results, see `compare_files` to decode the files in
+    parallel.
+    """
+    grids = [(power_grid(a, column), power_grid(b, column)) for a, b in pairs]
+    streams_a = [a.columns[column] for a, _ in grids]
+    streams_b = [b.columns[column] for _, b in grids]
+    start_offsets = [(b.start - a.start) / np.timedelta64(1, "s") for a, b in grids]
+    lags, correlations = align(streams_a, streams_b, start_offsets, max_lag)
+    results = []
+    for (grid_a, grid_b), stream_a, stream_b, lag, peak in zip(
+        grids, streams_a, streams_b, lags, correlations, strict=True
+    ):
+        lo, hi = max(0, lag), min(len(stream_a), len(stream_b) + lag)
+        a, b = stream_a[lo:hi], stream_b[lo - lag : hi - lag]
+        offset = int(lag - (grid_b.start - grid_a.start) / np.timedelta64(1, "s"))
+        correlation = peak
+        if np.isfinite(peak) and len(a) > 1 and np.std(a) and np.std(b):
+            correlation = np.corrcoef(a, b)[0, 1]
+        stats = _difference_stats(a, b, zones, window=window, max_difference=max_difference, max_relative=max_relative)
+        start = grid_a.start + np.timedelta64(int(lo), "s")
+        results.append(Comparison(offset, float(correlation), start, a, b, **stats))
+    return results
+
+
+def compare_rides(
+    a: pd.DataFrame | Resampled | str | os.PathLike, b: pd.DataFrame | Resampled | str | os.PathLike, **kwargs
+) -> Comparison:
+    """Align ride b on ride a (the reference) and compare their power, see `compare_many` for the kwargs"""
+    return compare_many([(a, b)], **kwargs)[0]
+
+
+def compare_files(
+    pairs: Iterable[tuple[str | os.PathLike, str | os.PathLike]], workers: int | None = None, **kwargs
+) -> pd.DataFrame:
+    """The `Comparison.stats` of many pairs of fit files, one row per pair. The files are decoded in a process pool
+    (see `map_fit_files`), NaN stats and an `error` for pairs where a file could not be read.
+    """
+    import pandas as pd
+
+    pairs = list(pairs)
+    paths = [os.fspath(path) for pair in pairs for path in pair]
+    grids = {}
+    errors = {}
+    for result in map_fit_files(partial(power_grid, column=kwargs.get("column", "power")), paths, workers=workers):
+        if result.error is None:
+            grids[result.index] = result.value
+        else:
+            errors[result.index] = repr(result.error)
+    ok = [i for i in range(len(pairs)) if 2 * i in grids and 2 * i + 1 in grids]
+    compared = compare_many([(grids[2 * i], grids[2 * i + 1]) for i in ok], **kwargs)
+    rows = [{} for _ in pairs]
+    for i, comparison in zip(ok, compared, strict=True):
+        rows[i] = comparison.stats()
+    table = pd.DataFrame(rows, index=pd.RangeIndex(len(pairs), name="pair"))
+    table.insert(0, "a", [str(a) for a, _ in pairs])
+    table.insert(1, "b", [str(b) for _, b in pairs])
+    table["error"] = [errors.get(2 * i) or errors.get(2 * i + 1) for i in range(len(pairs))]
+    return table
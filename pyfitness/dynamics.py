@@ -1,9 +1,18 @@
+from __future__ import annotations
+
 from math import exp, radians
+from typing import TYPE_CHECKING
 
 import numpy as np
-import pandas as pd
 
+from pyfitness import instrument
+from pyfitness.track import grade
+
+if TYPE_CHECKING:
+    import pandas as pd
 
+
+@instrument.timed("dynamics.simulator")
 def simulator(
     df: pd.DataFrame,
     rider_weight: float,
@@ -15,10 +24,40 @@ def simulator(
     frontal_area: float,
     rolling_resistance: float,
     efficiency_loss: float,
-    speedcol: str = None,
-    altitudecol: str = None,
+    speedcol: str | None = None,
+    altitudecol: str | None = None,
+    *,
+    inplace: bool = True,
+    outputs: list[str] | tuple[str, ...] = ("est_power",),
+    dtype=np.float64,
+    grade_window: float | None = None,
 ) -> pd.DataFrame:
-    """Estimate power output based on the given parameters"""
+    """Estimate power output based on the given parameters
+    By default the results (and speed_calculated, seconds when missing) are added as columns to df, which is returned.
+    inplace=False leaves df untouched and returns a new dataframe with only the `outputs` columns, see `simulate`.
+    grade_window: Meters, the slope is `pyfitness.track.grade` over this distance instead of the altitude change over
+        the distance change from the previous sample, which is noisy and spikes where the distance barely changes.
+    """
+    import pandas as pd
+
+    if not inplace:
+        return simulate(
+            df,
+            rider_weight,
+            bike_weight,
+            wind_speed,
+            wind_direction,
+            temperature,
+            drag_coefficient,
+            frontal_area,
+            rolling_resistance,
+            efficiency_loss,
+            speedcol=speedcol,
+            altitudecol=altitudecol,
+            outputs=outputs,
+            dtype=dtype,
+            grade_window=grade_window,
+        )
     try:
         assert all([c in df.columns for c in ["distance", "altitude"]]) or all(
             [c in df.columns for c in ["distance", "enhanced_altitude"]]
@@ -54,11 +93,14 @@ def simulator(
         df["seconds"] = df["seconds"] - df.seconds.min()
 
     df["vam"] = (df[altitudevar].diff() / df.seconds.diff()) * 3600
-    df["slope"] = df[altitudevar].diff() / df.distance.diff()
+    if grade_window is None:
+        df["slope"] = df[altitudevar].diff() / df.distance.diff()
+    else:
+        df["slope"] = grade(df[altitudevar].to_numpy(), df.distance.to_numpy(), grade_window)
 
     # # Constants
     CdA = drag_coefficient * frontal_area
-    altitude = (df.altitude.max() - df.altitude.min()) / 2
+    altitude = density_altitude(df, df[altitudevar].to_numpy(dtype=np.float64))
     # intermediate calculations
     df["air_density"] = (
         (101325 / (287.05 * 273.15))
@@ -96,26 +138,57 @@ def climb_power_estimate(
 ) -> dict[int, float, ...]:
     """Find the average estimated power for the given time period
     We assume the df is filtered to the area of interest"""
-    elapsed_time = df.seconds.max() - df.seconds.min()
-    distance = df.distance.max() - df.distance.min()
-    accent = df.altitude.max() - df.altitude.min()
+    return climb_power_terms(
+        elapsed_time=df.seconds.max() - df.seconds.min(),
+        distance=df.distance.max() - df.distance.min(),
+        accent=df.altitude.max() - df.altitude.min(),
+        avg_elevation=df.altitude.mean(),
+        rider_weight=rider_weight,
+        bike_weight=bike_weight,
+        wind_speed=wind_speed,
+        wind_direction=wind_direction,
+        temperature=temperature,
+        drag_coefficient=drag_coefficient,
+        frontal_area=frontal_area,
+        rolling_resistance=rolling_resistance,
+        efficiency_loss=efficiency_loss,
+    )
+
+
+def climb_power_terms(  # noqa: PLR0913, PLR0917 - the parameters of climb_power_estimate
+    elapsed_time: float | np.ndarray,
+    distance: float | np.ndarray,
+    accent: float | np.ndarray,
+    avg_elevation: float | np.ndarray,
+    rider_weight: float,
+    bike_weight: float,
+    wind_speed: float,
+    wind_direction: int,
+    temperature: float,
+    drag_coefficient: float,
+    frontal_area: float,
+    rolling_resistance: float,
+    efficiency_loss: float,
+) -> dict[str, float | np.ndarray]:
+    """The `climb_power_estimate` of a stretch from its duration, distance, altitude gain and mean altitude.
+    Takes floats for one stretch or arrays for many (e.g. the segments of `pyfitness.segments.segment_summary`).
+    """
     slope = accent / distance
     speed = distance / elapsed_time
     speed_kph = speed * 3.6
-    avg_elevation = df.altitude.mean()
     CdA = drag_coefficient * frontal_area
 
     air_density = (
         (101325 / (287.05 * 273.15))
         * (273.15 / (temperature + 273.15))
-        * exp((-101325 / (287.05 * 273.15)) * 9.8067 * (avg_elevation / 101325))
+        * np.exp((-101325 / (287.05 * 273.15)) * 9.8067 * (avg_elevation / 101325))
     )
     effective_wind_speed = np.cos(radians(wind_direction)) * wind_speed
     # # Components of power, watts
     air_drag_watts = 0.5 * CdA * air_density * (speed + effective_wind_speed) ** 2 * speed
     climbing_watts = (bike_weight + rider_weight) * 9.8067 * np.sin(np.arctan(slope)) * speed
     rolling_watts = np.cos(np.arctan(slope)) * 9.8067 * (bike_weight + rider_weight) * rolling_resistance * speed
-    est_power_no_loss = sum([air_drag_watts, climbing_watts, rolling_watts])
+    est_power_no_loss = air_drag_watts + climbing_watts + rolling_watts
     est_power = est_power_no_loss / (1 - efficiency_loss)
     vam_mhr = (accent / elapsed_time) * 3600
 
@@ -141,10 +214,421 @@ def climb_power_estimate(
     }
 
 
+GRAVITY = 9.8067
+
+SIMULATOR_PARAMETERS = (
+    "rider_weight",
+    "bike_weight",
+    "wind_speed",
+    "wind_direction",
+    "temperature",
+    "drag_coefficient",
+    "frontal_area",
+    "rolling_resistance",
+    "efficiency_loss",
+)
+
+
+def air_density(temperature: float | np.ndarray, altitude: float | np.ndarray) -> float | np.ndarray:
+    """Air density in kg/m^3 from the temperature in C and altitude in m, as used by `simulator`"""
+    return (
+        (101325 / (287.05 * 273.15))
+        * (273.15 / (temperature + 273.15))
+        * np.exp((-101325 / (287.05 * 273.15)) * GRAVITY * (altitude / 101325))
+    )
+
+
+def model_inputs(
+    df: pd.DataFrame, speedcol: str | None = None, altitudecol: str | None = None, dtype=np.float64
+) -> dict:
+    """The seconds (from the first sample), distance, altitude and speed columns used by the power model.
+    Columns are picked the same way `simulator` does and returned as read-only arrays, views of the dataframe columns
+    when they already have `dtype`. Speed is calculated from distance and time when there is no speed column.
+    """
+    if not (
+        all([c in df.columns for c in ["distance", "altitude"]])
+        or all([c in df.columns for c in ["distance", "enhanced_altitude"]])
+    ):
+        raise AssertionError("Missing columns in dataframe. Must have 'seconds', 'distance', and 'altitude'")
+    altitudevar = "enhanced_altitude" if "enhanced_altitude" in df.columns else "altitude"
+    if altitudecol is not None:
+        assert altitudecol in df.columns
+        altitudevar = altitudecol
+    if "seconds" in df.columns:
+        seconds = df["seconds"].to_numpy(dtype=dtype)
+    else:
+        seconds = (df.index - df.index[0]).total_seconds().to_numpy().astype(dtype, copy=False)
+    distance = df["distance"].to_numpy(dtype=dtype)
+    inputs = {"seconds": seconds, "distance": distance, "altitude": df[altitudevar].to_numpy(dtype=dtype)}
+    if speedcol is not None:
+        assert speedcol in df.columns
+        inputs["speed"] = df[speedcol].to_numpy(dtype=dtype)
+    elif "enhanced_speed" in df.columns:
+        inputs["speed"] = df["enhanced_speed"].to_numpy(dtype=dtype)
+    elif "speed" in df.columns:
+        inputs["speed"] = df["speed"].to_numpy(dtype=dtype)
+    else:
+        with np.errstate(divide="ignore", invalid="ignore"):
+            inputs["speed"] = _diff(distance) / _diff(seconds)
+    for arr in inputs.values():
+        arr.flags.writeable = False
+    return inputs
+
+
+def density_altitude(df: pd.DataFrame, altitude: np.ndarray) -> float:
+    """The altitude the air density of the power model is computed at: half the range of the `altitude` column, or of
+    the model's altitude array when there is no such column. Shared by `simulator`, `simulate` and `ride_arrays`.
+    """
+    if "altitude" in df.columns:
+        altitude = df["altitude"].to_numpy(dtype=np.float64)
+    return (np.nanmax(altitude) - np.nanmin(altitude)) / 2
+
+
+def _nan_to_zero(arr: np.ndarray) -> np.ndarray:
+    """NaN counts as 0 like in DataFrame.sum, infinite values are kept"""
+    return np.where(np.isnan(arr), 0.0, arr)
+
+
+def _diff(arr: np.ndarray) -> np.ndarray:
+    """Like Series.diff(), NaN first then the difference to the previous sample, keeps the dtype"""
+    return np.diff(arr, prepend=np.array([np.nan], dtype=arr.dtype))
+
+
+def ride_arrays(
+    df: pd.DataFrame, speedcol: str | None = None, altitudecol: str | None = None, grade_window: float | None = None
+) -> dict[str, np.ndarray]:
+    """The per sample inputs of the power model as read-only NumPy arrays, the dataframe is not modified.
+    Picks the columns (and the slope, see grade_window) the same way `simulator` does. Returns seconds, speed, slope,
+    acceleration (speed change per second), sin_slope and cos_slope (of the slope angle) and the altitude used for air
+    density.
+    """
+    inputs = model_inputs(df, speedcol=speedcol, altitudecol=altitudecol)
+    seconds, distance, altitude, speed = inputs["seconds"], inputs["distance"], inputs["altitude"], inputs["speed"]
+    dt = _diff(seconds)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        slope = _diff(altitude) / _diff(distance) if grade_window is None else grade(altitude, distance, grade_window)
+        acceleration = _diff(speed) / dt
+    angle = np.arctan(slope)
+    arrays = {
+        "seconds": seconds,
+        "speed": speed,
+        "slope": slope,
+        "acceleration": acceleration,
+        "sin_slope": np.sin(angle),
+        "cos_slope": np.cos(angle),
+        "altitude": np.asarray(density_altitude(df, altitude)),
+    }
+    for arr in arrays.values():
+        arr.flags.writeable = False
+    return arrays
+
+
+SIMULATOR_OUTPUTS = (
+    "vam",
+    "slope",
+    "air_density",
+    "effective_wind_speed",
+    "air_drag_watts",
+    "climbing_watts",
+    "rolling_watts",
+    "acceleration_watts",
+    "est_power_no_loss",
+    "est_power",
+    "efficiency_loss_watts",
+    "est_power_no_acc",
+)
+
+
+@instrument.timed("dynamics.simulate")
+def simulate(  # noqa: PLR0913, PLR0917 - the model parameters are positional, as in simulator
+    df: pd.DataFrame,
+    rider_weight: float,
+    bike_weight: float,
+    wind_speed: float,
+    wind_direction: int,
+    temperature: float,
+    drag_coefficient: float,
+    frontal_area: float,
+    rolling_resistance: float,
+    efficiency_loss: float,
+    speedcol: str | None = None,
+    altitudecol: str | None = None,
+    *,
+    outputs: list[str] | tuple[str, ...] = ("est_power",),
+    dtype=np.float64,
+    grade_window: float | None = None,
+) -> pd.DataFrame:
+    """Same model as `simulator` but the dataframe is not modified.
+    The input columns are read as read-only views (see `model_inputs`) and only what the requested outputs need is
+    computed, in `dtype` (np.float32 halves the memory).
+    outputs: Any of SIMULATOR_OUTPUTS.
+    Returns a new dataframe with only the output columns, sharing the index of df.
+    """
+    import pandas as pd
+
+    unknown = [c for c in outputs if c not in SIMULATOR_OUTPUTS]
+    if unknown:
+        raise ValueError(f"Unknown outputs {unknown}, must be in {SIMULATOR_OUTPUTS}")
+    inputs = model_inputs(df, speedcol=speedcol, altitudecol=altitudecol, dtype=dtype)
+    speed = inputs["speed"]
+    mass = bike_weight + rider_weight
+    cda = drag_coefficient * frontal_area
+    scalars = {
+        "air_density": air_density(temperature, density_altitude(df, inputs["altitude"])),
+        "effective_wind_speed": np.cos(radians(wind_direction)) * wind_speed,
+    }
+
+    def est_power_no_loss():
+        total = np.zeros(len(speed), dtype=dtype)
+        for name in ("air_drag_watts", "climbing_watts", "rolling_watts", "acceleration_watts"):
+            total += _nan_to_zero(get(name))
+        return total
+
+    # How to compute each output (and intermediate), only called for what is requested.
+    steps = {
+        "vam": lambda: _diff(inputs["altitude"]) / _diff(inputs["seconds"]) * 3600,
+        "slope": lambda: (
+            _diff(inputs["altitude"]) / _diff(inputs["distance"])
+            if grade_window is None
+            else grade(inputs["altitude"], inputs["distance"], grade_window).astype(dtype)
+        ),
+        "angle": lambda: np.arctan(get("slope")),
+        "air_drag_watts": lambda: (
+            0.5 * cda * get("air_density") * np.square(speed + get("effective_wind_speed")) * speed
+        ),
+        "climbing_watts": lambda: mass * GRAVITY * np.sin(get("angle")) * speed,
+        "rolling_watts": lambda: np.cos(get("angle")) * (GRAVITY * mass * rolling_resistance) * speed,
+        "acceleration_watts": lambda: mass * (_diff(speed) / _diff(inputs["seconds"])) * speed,
+        "est_power_no_loss": est_power_no_loss,
+        "est_power": lambda: get("est_power_no_loss") / (1 - efficiency_loss),
+        "efficiency_loss_watts": lambda: get("est_power_no_loss") - get("est_power"),
+        "est_power_no_acc": lambda: (get("est_power_no_loss") - get("acceleration_watts")) / (1 - efficiency_loss),
+    }
+    values = {}
+
+    def get(name):
+        if name in scalars:
+            return np.dtype(dtype).type(scalars[name])
+        if name not in values:
+            with np.errstate(divide="ignore", invalid="ignore"):
+                values[name] = steps[name]().astype(dtype, copy=False)
+        return values[name]
+
+    result = {}
+    for name in outputs:
+        if name in scalars:
+            result[name] = np.full(len(speed), scalars[name], dtype=dtype)
+        else:
+            result[name] = get(name)
+    return pd.DataFrame(result, index=df.index, copy=False)
+
+
+@instrument.timed("dynamics.simulate_sweep")
+def simulate_sweep(  # noqa: PLR0913 - the options are keyword-only
+    df: pd.DataFrame,
+    params: dict[str, float | np.ndarray] | pd.DataFrame,
+    *,
+    powercol: str = "power",
+    speedcol: str | None = None,
+    altitudecol: str | None = None,
+    return_power: bool = False,
+    block_size: int = 2**22,
+    grade_window: float | None = None,
+) -> dict[str, np.ndarray]:
+    """Evaluate the `simulator` power model for many parameter sets at once.
+    The ride is read once (see `ride_arrays`) and the model is broadcast over a (n_params x n_samples) grid, in blocks
+    of at most `block_size` elements, without touching the dataframe.
+    params: `simulator` keyword arguments (see SIMULATOR_PARAMETERS) as scalars or equal length 1-D arrays, or a
+        dataframe with one row per parameter set.
+    grade_window: See `simulator`.
+    Returns per parameter set the rmse, mae and bias (mean of estimated - measured) of `est_power` against the
+    measured power column, over the samples where the measured power is known and the estimate is finite (a repeated
+    timestamp gives an infinite acceleration), and `est_power` (n_params x n_samples, float32) if return_power.
+    simulate_sweep(df, {"rider_weight": 70, "bike_weight": 10, ..., "drag_coefficient": np.linspace(0.6, 1.0, 200)})
+    """
+    import pandas as pd
+
+    if isinstance(params, pd.DataFrame):
+        params = {k: params[k].to_numpy() for k in params.columns}
+    missing = [k for k in SIMULATOR_PARAMETERS if k not in params]
+    if missing:
+        raise ValueError(f"Missing simulator parameters: {missing}")
+    p = dict(
+        zip(
+            SIMULATOR_PARAMETERS,
+            np.broadcast_arrays(
+                *[np.atleast_1d(np.asarray(params[k], dtype=np.float64)) for k in SIMULATOR_PARAMETERS]
+            ),
+            strict=True,
+        )
+    )
+    n_params = len(p["rider_weight"])
+    ride = ride_arrays(df, speedcol=speedcol, altitudecol=altitudecol, grade_window=grade_window)
+    measured = df[powercol].to_numpy(dtype=np.float64) if powercol in df.columns else None
+    speed = ride["speed"]
+    n_samples = len(speed)
+
+    mass = (p["rider_weight"] + p["bike_weight"])[:, None]
+    drag = (0.5 * p["drag_coefficient"] * p["frontal_area"] * air_density(p["temperature"], ride["altitude"]))[:, None]
+    wind = (np.cos(np.radians(p["wind_direction"])) * p["wind_speed"])[:, None]
+    loss = (1 - p["efficiency_loss"])[:, None]
+    crr = p["rolling_resistance"][:, None]
+    # Per sample terms that do not depend on the parameters, NaN (e.g. the first sample) counts as 0 like in
+    # `simulator` where the components are added with DataFrame.sum. Infinite values (a repeated timestamp) are kept
+    # there and here, but left out of the scores.
+    with np.errstate(invalid="ignore"):
+        climb = _nan_to_zero(GRAVITY * ride["sin_slope"] * speed)
+        roll = _nan_to_zero(GRAVITY * ride["cos_slope"] * speed)
+        accel = _nan_to_zero(ride["acceleration"] * speed)
+    speed0 = _nan_to_zero(speed)
+
+    results = {k: np.full(n_params, np.nan) for k in ("rmse", "mae", "bias")}
+    est_power = np.empty((n_params, n_samples), dtype=np.float32) if return_power else None
+    valid = np.isfinite(measured) if measured is not None else None
+    step = max(1, block_size // max(n_samples, 1))
+    for i in range(0, n_params, step):
+        rows = slice(i, i + step)
+        power = drag[rows] * np.square(speed0 + wind[rows]) * speed0 + mass[rows] * (climb + crr[rows] * roll + accel)
+        power /= loss[rows]
+        if return_power:
+            est_power[rows] = power
+        if valid is not None and valid.any():
+            estimated = power[:, valid]
+            scored = np.isfinite(estimated)
+            error = np.where(scored, estimated - measured[valid], 0.0)
+            count = scored.sum(axis=1)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                results["rmse"][rows] = np.sqrt(np.square(error).sum(axis=1) / count)
+                results["mae"][rows] = np.abs(error).sum(axis=1) / count
+                results["bias"][rows] = error.sum(axis=1) / count
+    if return_power:
+        results["est_power"] = est_power
+    return results
+
+
+def virtual_elevation_terms(  # noqa: PLR0913 - the options are keyword-only
+    df: pd.DataFrame,
+    rider_weight: float,
+    bike_weight: float,
+    *,
+    wind_speed: float = 0.0,
+    wind_direction: int = 0,
+    temperature: float = 20.0,
+    efficiency_loss: float = 0.02,
+    powercol: str = "power",
+    speedcol: str | None = None,
+    altitudecol: str | None = None,
+    grade_window: float | None = None,
+) -> dict[str, np.ndarray]:
+    """Cumulative terms of the virtual elevation (Chung method) for a ride with power data.
+    Solving the `simulator` power balance for the slope and integrating it over the distance gives
+        virtual_elevation = z0 + power_term - Crr * rolling_term - CdA * drag_term
+    which is linear in z0, Crr and CdA. Each term is a cumulative sum over the samples in meters:
+        power_term: (power * (1 - efficiency_loss) * dt - change in kinetic energy) / (mass * g)
+        rolling_term: distance weighted by cos(slope), drag_term: 0.5 * air_density * (speed + wind)^2 * speed * dt
+        / (mass * g)
+    Also returns the measured `elevation`. grade_window: See `simulator`.
+    """
+    ride = ride_arrays(df, speedcol=speedcol, altitudecol=altitudecol, grade_window=grade_window)
+    altitudevar = altitudecol or ("enhanced_altitude" if "enhanced_altitude" in df.columns else "altitude")
+    mass = rider_weight + bike_weight
+    speed = np.nan_to_num(ride["speed"])
+    dt = np.nan_to_num(np.diff(ride["seconds"], prepend=ride["seconds"][0]))
+    power = np.nan_to_num(df[powercol].to_numpy(dtype=np.float64))
+    wind = np.cos(np.radians(wind_direction)) * wind_speed
+    rho = air_density(temperature, ride["altitude"])
+    kinetic = 0.5 * np.diff(np.square(speed), prepend=speed[0] ** 2)
+    cos_slope = np.nan_to_num(ride["cos_slope"], nan=1.0)
+    mg = mass * GRAVITY
+    return {
+        "power_term": np.cumsum(power * (1 - efficiency_loss) * dt / mg - kinetic / GRAVITY),
+        "rolling_term": np.cumsum(cos_slope * speed * dt),
+        "drag_term": np.cumsum(0.5 * rho * np.square(speed + wind) * speed * dt / mg),
+        "elevation": df[altitudevar].to_numpy(dtype=np.float64),
+    }
+
+
+@instrument.timed("dynamics.solve_cda_crr")
+def solve_cda_crr(  # noqa: PLR0913 - the options are keyword-only
+    df: pd.DataFrame,
+    rider_weight: float,
+    bike_weight: float,
+    *,
+    wind_speed: float = 0.0,
+    wind_direction: int = 0,
+    temperature: float = 20.0,
+    efficiency_loss: float = 0.02,
+    crr: float | None = None,
+    powercol: str = "power",
+    speedcol: str | None = None,
+    altitudecol: str | None = None,
+    max_iterations: int = 10,
+    tolerance: float = 1e-10,
+    grade_window: float | None = None,
+) -> dict[str, float | int | np.ndarray]:
+    """Estimate CdA and Crr from a ride with power data using the virtual elevation method.
+    Gauss-Newton least squares of the virtual elevation against the measured elevation, the unknowns are the start
+    elevation z0, Crr and CdA. The Jacobian is analytic: d/dz0 = 1, d/dCrr = -rolling_term, d/dCdA = -drag_term (see
+    `virtual_elevation_terms`). The model is linear in the unknowns so it converges after one step, the second only
+    confirms it.
+    crr: Keep Crr fixed at this value and only fit CdA and z0.
+    grade_window: See `simulator`.
+    Returns CdA, Crr, z0, rmse (m), iterations and the virtual_elevation array.
+    """
+    terms = virtual_elevation_terms(
+        df,
+        rider_weight,
+        bike_weight,
+        wind_speed=wind_speed,
+        wind_direction=wind_direction,
+        temperature=temperature,
+        efficiency_loss=efficiency_loss,
+        powercol=powercol,
+        speedcol=speedcol,
+        altitudecol=altitudecol,
+        grade_window=grade_window,
+    )
+    valid = np.isfinite(terms["elevation"])
+    elevation = terms["elevation"][valid]
+    power_term = terms["power_term"][valid]
+    rolling_term = terms["rolling_term"][valid]
+    drag_term = terms["drag_term"][valid]
+    if crr is None:
+        jacobian = np.column_stack([np.ones_like(elevation), -rolling_term, -drag_term])
+        theta = np.array([elevation[0], 0.005, 0.3])  # z0, Crr, CdA
+    else:
+        jacobian = np.column_stack([np.ones_like(elevation), -drag_term])
+        theta = np.array([elevation[0], 0.3])  # z0, CdA
+
+    def residual(theta: np.ndarray) -> np.ndarray:
+        rolling = crr if crr is not None else theta[1]
+        return theta[0] + power_term - rolling * rolling_term - theta[-1] * drag_term - elevation
+
+    iterations = 0
+    while iterations < max_iterations:
+        iterations += 1
+        step, *_ = np.linalg.lstsq(jacobian, -residual(theta), rcond=None)
+        theta = theta + step
+        if np.max(np.abs(step)) < tolerance:
+            break
+    z0, cda = theta[0], theta[-1]
+    crr = crr if crr is not None else theta[1]
+    virtual = np.full(len(terms["elevation"]), np.nan)
+    virtual[valid] = residual(theta) + elevation
+    return {
+        "CdA": cda,
+        "Crr": crr,
+        "z0": z0,
+        "rmse": float(np.sqrt(np.mean(np.square(residual(theta))))),
+        "iterations": iterations,
+        "virtual_elevation": virtual,
+    }
+
+
 class DynamicModel(object):
     """Estimate metrics from other data."""
 
-    def __int__(self, df: pd.DataFrame):
+    def __init__(self, df: pd.DataFrame):
         self.df = df
         self.altitudevar = None
         self.speedvar = None
@@ -153,6 +637,8 @@ class DynamicModel(object):
         """We assume the following to be constant or known.
         For example, we assume the Air Density can be calculated from known air tempurature and alititude.
         """
+        import pandas as pd
+
         try:
             assert all([c in self.df.columns for c in ["distance", "altitude"]]) or all(
                 [c in self.df.columns for c in ["distance", "enhanced_altitude"]]
@@ -186,5 +672,16 @@ class DynamicModel(object):
         # def columns(self) -> list:
         #     return [c for c in self.df.columns if c in self.known]
 
-    def estimate(self, columns: list[str]):
-        pass
+    def estimate(self, columns: list[str], rider_weight: float, bike_weight: float, **kwargs) -> dict[str, float]:
+        """Estimate the given unknowns, "CdA" and/or "Crr", from the power data with `solve_cda_crr`.
+        kwargs are passed to `solve_cda_crr`, Crr is held at kwargs["crr"] (default 0.005) unless it is in columns.
+        """
+        unknown = [c for c in columns if c not in ("CdA", "Crr")]
+        if unknown:
+            raise ValueError(f"Can not estimate {unknown}, only 'CdA' and 'Crr'")
+        if "Crr" in columns:
+            kwargs["crr"] = None
+        else:
+            kwargs.setdefault("crr", 0.005)
+        solution = solve_cda_crr(self.df, rider_weight, bike_weight, **kwargs)
+        return {c: solution[c] for c in columns}
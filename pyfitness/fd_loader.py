@@ -1,14 +1,21 @@
-import warnings
-from datetime import datetime
-from typing import Any
+from __future__ import annotations
+
+import io
+import os
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from typing import IO, TYPE_CHECKING, Any
 
 import fitdecode
-import pandas as pd
+import numpy as np
 
-warnings.simplefilter(action="ignore", category=FutureWarning)
+from pyfitness import backends, instrument
 
+if TYPE_CHECKING:
+    import pandas as pd
 
-pd.set_option("mode.chained_assignment", None)
+    from pyfitness.cache import FitCache
 
 """
 About Enhanced: https://developerportal.garmin.com/blog/activity-fit-files-deprecating-speed-and-altitude
@@ -73,8 +80,170 @@ def frame2dict(frame: fitdecode.records.FitDataMessage) -> dict:
     return frame_dict
 
 
-def fit2dict(fit_file: str | bytes, from_file=True) -> dict[str, None | dict | list[dict] | set[Any]]:
-    """Load a fit file"""
+class ColumnBuilder(object):
+    """Collect record fields into typed NumPy arrays, one array per field name.
+
+    Arrays start at `capacity` rows and double when full, so appending a row is amortized O(1) and no per-row dict
+    is ever built. Python ints are stored as int64, floats as float64 and anything else (datetime, str, tuple) as
+    object. A column is promoted (int -> float -> object) the first time it sees a value that does not fit.
+    `finish()` fills the gaps the same way `pd.DataFrame.from_dict` does for a list of `frame2dict` rows: a field
+    missing from a row is NaN, a field present with a None value is NaN in a numeric column and None otherwise.
+    """
+
+    __slots__ = ("capacity", "columns", "n", "nulls", "present")
+
+    def __init__(self, capacity: int = 1024):
+        self.capacity = capacity
+        self.n = 0
+        self.columns: dict[str, np.ndarray] = {}
+        self.present: dict[str, np.ndarray] = {}  # a value (not None) was set for the row
+        self.nulls: dict[str, np.ndarray] = {}  # the field was in the row with a None value
+
+    def _grow(self):
+        self.capacity *= 2
+        for name, arr in self.columns.items():
+            self.columns[name] = self._resize(arr, arr.dtype)
+            self.present[name] = self._resize(self.present[name], bool)
+            self.nulls[name] = self._resize(self.nulls[name], bool)
+
+    def _resize(self, arr: np.ndarray, dtype) -> np.ndarray:
+        grown = np.zeros(self.capacity, dtype=dtype) if dtype is bool else np.empty(self.capacity, dtype=dtype)
+        grown[: self.n] = arr[: self.n]
+        return grown
+
+    def _new_column(self, name: str, value):
+        if value is None:
+            dtype = np.float64  # the first value decides, until then a float column holds NaN
+        elif isinstance(value, bool):
+            dtype = object
+        elif isinstance(value, int):
+            dtype = np.int64
+        elif isinstance(value, float):
+            dtype = np.float64
+        else:
+            dtype = object
+        self.columns[name] = np.empty(self.capacity, dtype=dtype)
+        self.present[name] = np.zeros(self.capacity, dtype=bool)
+        self.nulls[name] = np.zeros(self.capacity, dtype=bool)
+
+    def _store(self, name: str, row: int, value):
+        arr = self.columns[name]
+        kind = arr.dtype.kind
+        if kind == "O":
+            arr[row] = value
+        elif value is None:
+            if kind == "i":
+                self.columns[name] = arr = arr.astype(np.float64)
+            self.nulls[name][row] = True
+            return
+        elif isinstance(value, int) and not isinstance(value, bool):
+            arr[row] = value  # int into an int or float column
+        elif isinstance(value, float):
+            if kind == "i":
+                self.columns[name] = arr = arr.astype(np.float64)
+            arr[row] = value
+        else:
+            self.columns[name] = arr = arr.astype(object)
+            arr[row] = value
+        self.present[name][row] = True
+
+    def append(self, frame: fitdecode.records.FitDataMessage):
+        """Append the fields of one data message as a new row"""
+        if self.n == self.capacity:
+            self._grow()
+        row = self.n
+        seen = set()
+        for field in frame.fields:
+            name = field.name
+            if name in seen or "unknown_" in name.lower():
+                continue  # same as frame.get_value(), the first field with a given name wins
+            seen.add(name)
+            if name not in self.columns:
+                self._new_column(name, field.value)
+            self._store(name, row, field.value)
+        self.n += 1
+
+    def finish(self) -> dict[str, np.ndarray]:
+        """Trim the arrays to the number of rows and fill the missing values"""
+        columns = {}
+        for name, allocated in self.columns.items():
+            values = allocated[: self.n]
+            present = self.present[name][: self.n]
+            nulls = self.nulls[name][: self.n]
+            if values.dtype.kind == "O":
+                values[~present] = np.nan
+                values[nulls] = None
+            elif not present.all():
+                if values.dtype.kind == "i":
+                    values = values.astype(np.float64)
+                values[~present] = np.nan
+            columns[name] = values
+        return columns
+
+
+def fit2columns(fit_file: str | bytes) -> dict[str, np.ndarray]:
+    """Load the record messages of a fit file into a dict of NumPy arrays keyed by field name"""
+    builder = ColumnBuilder()
+    frames = 0
+    with instrument.stage("fd_loader.fit2columns"):
+        for frame in fitdecode.FitReader(fit_file):
+            frames += 1
+            if isinstance(frame, fitdecode.records.FitDataMessage) and frame.name == "record":
+                builder.append(frame)
+        columns = builder.finish()
+    if instrument.enabled():
+        _count_decode(fit_file, frames, builder.n)
+    return columns
+
+
+def fit_source(fit_file: str | os.PathLike | bytes | IO[bytes], from_file: bool | None = None) -> str | bytes:
+    """The path or the content of a fit file, as fitdecode and the cache take it.
+    from_file: True if `fit_file` is a path, False if it is the file content (bytes or a binary file object, which is
+        read), None to tell from the type.
+    """
+    if from_file is None:
+        from_file = isinstance(fit_file, str | os.PathLike)
+    if from_file:
+        if not isinstance(fit_file, str | os.PathLike):
+            raise ValueError(f"from_file=True expects a path, got {type(fit_file).__name__}")
+        return os.fspath(fit_file)
+    if isinstance(fit_file, bytes | bytearray | memoryview):
+        return bytes(fit_file)
+    if hasattr(fit_file, "read"):
+        return fit_file.read()
+    raise ValueError(f"from_file=False expects bytes or a file object, got {type(fit_file).__name__}")
+
+
+def _count_decode(fit_file: str | bytes, frames: int, records: int):
+    """The `instrument` counters of one decode"""
+    instrument.count(
+        "fd_loader.bytes_read", len(fit_file) if isinstance(fit_file, bytes) else os.path.getsize(fit_file)
+    )
+    instrument.count("fd_loader.frames", frames)
+    instrument.count("fd_loader.records", records)
+
+
+def fit2dict(
+    fit_file: str | os.PathLike | bytes | IO[bytes],
+    from_file: bool | None = None,
+    cache: "FitCache | None" = None,
+    backend: str | None = None,
+) -> dict[str, dict | list[dict] | set[Any] | None]:
+    """Load a fit file from a path or from its content, see `fit_source` for from_file
+    cache: Optional `pyfitness.cache.FitCache`, the decoded file is loaded from or saved to the cache.
+    backend: The decoder, see `pyfitness.backends`, defaults to the one set with `backends.set_backend`.
+    """
+    fit_file = fit_source(fit_file, from_file)
+    backend = backends.backend_name(backend)
+    if cache is not None:
+        return cache.fit2dict(fit_file, backend=backend)
+    if backend != "fitdecode":
+        return backends.get_backend(backend).fit2dict(fit_file)
+    return _fit2dict(fit_file)
+
+
+def _fit2dict(fit_file: str | bytes) -> dict[str, dict | list[dict] | set[Any] | None]:
+    """The `fit2dict` decode of a path or the file content"""
     header = None
     definitions = []
     other_records = []
@@ -88,6 +257,10 @@ def fit2dict(fit_file: str | bytes, from_file=True) -> dict[str, None | dict | l
     fit = fitdecode.FitReader(fit_file)
     event = dict()
     columns = set()
+    timing = instrument.enabled()  # split the time between fitdecode and frame2dict of the records
+    start = time.perf_counter() if timing else 0.0
+    convert = 0.0
+    _i = -1
     for _i, frame in enumerate(fit):
         match frame:
             case fitdecode.records.FitHeader():
@@ -105,7 +278,10 @@ def fit2dict(fit_file: str | bytes, from_file=True) -> dict[str, None | dict | l
                         case "activity":
                             activity = frame2dict(frame)
                         case "record":
+                            t = time.perf_counter() if timing else 0.0
                             rec = frame2dict(frame)
+                            if timing:
+                                convert += time.perf_counter() - t
                             # rec.update(event)
                             columns.update(rec.keys())
                             records.append(rec)
@@ -115,6 +291,10 @@ def fit2dict(fit_file: str | bytes, from_file=True) -> dict[str, None | dict | l
                 crcs = slots2dict(frame)
             case _:
                 other.append(slots2dict(frame))
+    if timing:
+        instrument.emit("timing", "fd_loader.fit2dict.parse", time.perf_counter() - start - convert)
+        instrument.emit("timing", "fd_loader.fit2dict.frame2dict", convert)
+        _count_decode(fit_file, _i + 1, len(records))
     fit_dict = {
         "header": header,
         "definitions": definitions,
@@ -130,117 +310,144 @@ def fit2dict(fit_file: str | bytes, from_file=True) -> dict[str, None | dict | l
     return fit_dict
 
 
-def fit2df(fit_file: str) -> pd.DataFrame:
-    """Load a fit file into a pandas dataframe"""
-    fit_dict = fit2dict(fit_file)
-    # df = pd.DataFrame(columns=list(fit_dict['columns']))
-    df = pd.DataFrame.from_dict(fit_dict["records"])
-    df.set_index("timestamp", inplace=True)
-    df.dropna(how="all", axis="columns", inplace=True)
-    df.dropna(how="all", axis="index", inplace=True)
+def columns2df(columns: dict[str, np.ndarray]) -> pd.DataFrame:
+    """Build a dataframe from `fit2columns` output with the same dtypes `pd.DataFrame.from_dict` infers"""
+    import pandas as pd
+
+    with instrument.stage("fd_loader.columns2df"):
+        data = {}
+        for name, arr in columns.items():
+            data[name] = pd.Series(arr).infer_objects() if arr.dtype == object else arr
+        return pd.DataFrame(data)
+
+
+def fit2df(
+    fit_file: str | os.PathLike | bytes | IO[bytes],
+    columnar: bool = False,
+    cache: "FitCache | None" = None,
+    from_file: bool | None = None,
+    backend: str | None = None,
+) -> pd.DataFrame:
+    """Load a fit file into a pandas dataframe, from a path or from its content (see `fit_source` for from_file)
+    columnar=True decodes the records straight into NumPy arrays (see `fit2columns`) instead of building a dict per
+    record, this is faster and uses less memory and returns the same dataframe. Only used by the fitdecode backend.
+    cache: Optional `pyfitness.cache.FitCache`, the dataframe is loaded from or saved to the cache.
+    backend: The decoder, see `pyfitness.backends`, defaults to the one set with `backends.set_backend`.
+    """
+    fit_file = fit_source(fit_file, from_file)
+    backend = backends.backend_name(backend)
+    if cache is not None:
+        return cache.fit2df(fit_file, columnar=columnar, backend=backend)
+    if backend != "fitdecode":
+        return backends.get_backend(backend).fit2df(fit_file)
+    with instrument.stage("fd_loader.fit2df"):
+        if columnar:
+            return records2df(columns2df(fit2columns(fit_file)))
+        fit_dict = _fit2dict(fit_file)
+        # df = pd.DataFrame(columns=list(fit_dict['columns']))
+        return records2df(fit_dict["records"])
+
+
+def records2df(records: list[dict] | pd.DataFrame) -> pd.DataFrame:
+    """The fit2df dataframe of the record messages, indexed by timestamp without empty rows or columns"""
+    import pandas as pd
+
+    with instrument.stage("fd_loader.records2df.construct"):
+        df = records if isinstance(records, pd.DataFrame) else pd.DataFrame.from_dict(records)
+        df.set_index("timestamp", inplace=True)
+    rows, columns = df.shape
+    with instrument.stage("fd_loader.records2df.dropna"):
+        df.dropna(how="all", axis="columns", inplace=True)
+        df.dropna(how="all", axis="index", inplace=True)
+    instrument.count("fd_loader.rows_kept", len(df))
+    instrument.count("fd_loader.rows_dropped", rows - len(df))
+    instrument.count("fd_loader.columns_dropped", columns - df.shape[1])
     return df
 
 
-def fit2csv(fitfile: str | pd.DataFrame, outfile=None):
-    if isinstance(fitfile, str):
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def format_dates(df: pd.DataFrame) -> pd.DataFrame:
+    """Shallow copy of df with the datetime columns formatted as text, missing dates become empty strings"""
+    date_columns = df.select_dtypes(include=["datetime", "datetimetz"]).columns
+    if len(date_columns) == 0:
+        return df
+    # strftime only has a vectorised path for naive datetimes, the local wall time is the same text
+    return df.assign(**{c: _naive(df[c]).dt.strftime(DATE_FORMAT).fillna("") for c in date_columns})
+
+
+def _naive(dates: pd.Series) -> pd.Series:
+    return dates.dt.tz_localize(None) if dates.dt.tz is not None else dates
+
+
+@contextmanager
+def text_output(outfile: str | os.PathLike | IO) -> Iterator[IO[str]]:
+    """Open a path for writing utf-8 text, wrap a binary stream or pass a text stream through"""
+    if isinstance(outfile, io.TextIOBase):
+        yield outfile
+    elif hasattr(outfile, "write"):
+        text = io.TextIOWrapper(outfile, encoding="utf-8", newline="", write_through=True)
+        try:
+            yield text
+        finally:
+            text.flush()
+            text.detach()  # leave the caller's stream open
+    else:
+        with open(outfile, "w", encoding="utf-8", newline="") as f:
+            yield f
+
+
+def write_csv(df: pd.DataFrame, outfile: str | os.PathLike | IO, chunksize: int = 100_000):
+    """Write df as csv to a path or a text or binary stream, formatting and writing `chunksize` rows at a time"""
+    with text_output(outfile) as f:
+        for start in range(0, max(len(df), 1), chunksize):
+            format_dates(df.iloc[start : start + chunksize]).to_csv(f, header=start == 0)
+
+
+def fit2csv(
+    fitfile: str | os.PathLike | pd.DataFrame, outfile: str | os.PathLike | IO | None = None, chunksize: int = 100_000
+) -> bytes | None:
+    """Write a fit file (or a fit2df dataframe) as csv to outfile, a path or a stream. Returns the csv bytes when
+    outfile is None. See `stream.fit2csv_stream` to export a fit file without loading it into a dataframe.
+    """
+    import pandas as pd
+
+    if isinstance(fitfile, str | os.PathLike):
         df = fit2df(fitfile)
     elif isinstance(fitfile, pd.DataFrame):
         df = fitfile
     else:
         raise ValueError("fitfile must be a filename or a pandas dataframe")
-    # deal with timezone columns in FitDataMessages_df
-    try:
-        date_columns = df.select_dtypes(include=["datetime64[ns, UTC]"]).columns
-    except:
-        date_columns = []
-
-    for c in date_columns:
-        try:
-            df[c] = df[c].apply(lambda a: datetime.strftime(a, "%Y-%m-%d %H:%M:%S") if not pd.isnull(a) else "")
-        except:
-            raise
     if outfile:
-        return df.to_csv(outfile)
-    else:
-        return df.to_csv().encode("utf-8")
+        return write_csv(df, outfile, chunksize)
+    buffer = io.BytesIO()
+    write_csv(df, buffer, chunksize)
+    return buffer.getvalue()
 
 
-def fit2excel(fitfile, outfile=None):
-    df = fit2df(fitfile)
-    date_columns = df.select_dtypes(include=["datetime64[ns, UTC]"]).columns
-    for c in date_columns:
-        try:
-            df[c] = df[c].apply(lambda a: datetime.strftime(a, "%Y-%m-%d %H:%M:%S") if not pd.isnull(a) else "")
-        except:
-            raise
+def fit2excel(fitfile: str | os.PathLike | pd.DataFrame, outfile: str | os.PathLike | IO | None = None) -> bytes | None:
+    """Write a fit file (or a fit2df dataframe) as an Excel workbook to outfile. Returns the xlsx bytes when outfile is
+    None.
+    """
+    import pandas as pd
+
+    df = fitfile if isinstance(fitfile, pd.DataFrame) else fit2df(fitfile)
+    df = format_dates(df)  # Excel does not support timezones
+    if isinstance(df.index, pd.DatetimeIndex) and df.index.tz is not None:
+        df = df.set_axis(df.index.tz_localize(None))  # the UTC timestamp index as naive UTC
     if outfile:
         return df.to_excel(outfile)
-    else:
-        return df.to_excel().encode("utf-8")
+    buffer = io.BytesIO()
+    df.to_excel(buffer)
+    return buffer.getvalue()
 
 
 def fitfileinfo(fit, show_unkown=False):
-    """Creates a MarkDown text file object with information about the fit file"""
-    if fit.__class__ == fitdecode.reader.FitReader:
-        pass
-    else:
-        fit = fitdecode.FitReader(fit)
-    records = 0
-    record_fields = set()
-    events = 0
-    event_types = set()
-    sessions = 0
-    activitys = 0
-    laps = 0
-    fileinfo = "# Fit File details\n\n"
-    for d in fit:
-        match d:
-            case fitdecode.records.FitHeader():
-                fileinfo += "### Header:\n"
-                for k, v in slots2dict(d).items():
-                    fileinfo += f"- {k}: {v}\n"
-            case fitdecode.records.FitDataMessage():
-                records += 1 if d.name == "record" else 0
-                events += 1 if d.name == "event" else 0
-                sessions += 1 if d.name == "session" else 0
-                activitys += 1 if d.name == "activity" else 0
-                laps += 1 if d.name == "lap" else 0
-                if d.name == "record":
-                    record_fields.update(frame2dict(d).keys())
-                if d.name.lower() not in ["record", "event", "session", "activity", "lap"] and (
-                    show_unkown or "unknown_" not in d.name.lower()
-                ):
-                    fileinfo += f"### Data type: {d.name.upper()}\n"
-                    for field in d.fields:
-                        if show_unkown or "unknown_" not in field.name.lower():
-                            fileinfo += f"- {field.name}: {field.value}\n"
-                if d.name == "activity":
-                    fileinfo += "### activity\n"
-                    for k, v in frame2dict(d).items():
-                        fileinfo += f"- {k}: {v}\n"
-                if d.name == "session":
-                    fileinfo += "### session\n"
-                    for k, v in frame2dict(d).items():
-                        fileinfo += f"- {k}: {v}\n"
-                if d.name == "lap":
-                    fileinfo += "### lap\n"
-                    for k, v in frame2dict(d).items():
-                        fileinfo += f"- {k}: {v}\n"
-                if d.name == "event":
-                    event_types.add(d.get_value("event"))
-
-    fileinfo += (
-        f"### Data Records:\n"
-        f"- records: {records}\n"
-        f"- events: {events}\n"
-        f"- sessions: {sessions}\n"
-        f"- activitys: {activitys}\n"
-        f"- laps: {laps}\n"
-    )
-    fileinfo += "###Record Fields:\n"
-    for field in record_fields:
-        fileinfo += f"- {field}\n"
-    fileinfo += "###Event Types:\n"
-    for etype in event_types:
-        fileinfo += f"- {etype}\n"
-    return fileinfo
+    """Creates a MarkDown text file object with information about the fit file, see `summary.fitsummary`. All the
+    messages but the records and events are decoded, `summary2markdown(fitsummary(fit))` only decodes the session, lap
+    and activity messages and is faster on files with many other messages.
+    """
+    from pyfitness.summary import fitsummary, summary2markdown
+
+    return summary2markdown(fitsummary(fit, decode=None), show_unkown)
@@ -0,0 +1,190 @@
+"""
+Timings and counters from the loaders and analytics, for finding where a slow call spends its time.
+
+Instrumentation is off until a callback is registered or a `collect()` block is entered. While off, an instrumented
+function only pays for one check. Events are:
+- timings, in seconds, of a stage: "fd_loader.fit2dict", "fd_loader.fit2dict.frame2dict", "dynamics.simulator", ...
+- counters: "fd_loader.frames", "fd_loader.records", "fd_loader.bytes_read", "fd_loader.rows_dropped", ...
+
+add_callback(lambda event: statsd.timing(event.name, event.value) if event.kind == "timing" else ...)
+
+with collect() as report:  # only the events of this thread or asyncio task
+    df = fit2df("ride.fit")
+report.timings["fd_loader.records2df.dropna"], report.counts["fd_loader.frames"]
+
+with profile(memory=True) as p:  # cProfile and tracemalloc of a single call
+    fit2df("ride.fit")
+print(p.report())
+"""
+
+from __future__ import annotations
+
+import cProfile
+import io
+import pstats
+import time
+import tracemalloc
+from collections import defaultdict
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from functools import wraps
+from typing import NamedTuple
+
+
+class Event(NamedTuple):
+    """kind is "timing" (value in seconds) or "count" """
+
+    kind: str
+    name: str
+    value: float
+
+
+class Report(object):
+    """Events collected by `collect()`: total seconds and number of calls per stage, and the sum of each counter"""
+
+    __slots__ = ("calls", "counts", "timings")
+
+    def __init__(self):
+        self.timings: dict[str, float] = defaultdict(float)
+        self.calls: dict[str, int] = defaultdict(int)
+        self.counts: dict[str, float] = defaultdict(int)
+
+    def __call__(self, event: Event):
+        if event.kind == "timing":
+            self.timings[event.name] += event.value
+            self.calls[event.name] += 1
+        else:
+            self.counts[event.name] += event.value
+
+    def __repr__(self) -> str:
+        lines = [
+            f"{name}: {seconds * 1000:.2f} ms ({self.calls[name]} calls)" for name, seconds in self.timings.items()
+        ]
+        lines.extend(f"{name}: {value}" for name, value in self.counts.items())
+        return "\n".join(lines)
+
+
+_callbacks: list[Callable[[Event], None]] = []
+_reports: ContextVar[tuple[Report, ...]] = ContextVar("pyfitness_reports", default=())
+
+
+def add_callback(callback: Callable[[Event], None]):
+    """Call `callback(event)` for every event, from any thread"""
+    _callbacks.append(callback)
+
+
+def remove_callback(callback: Callable[[Event], None]):
+    _callbacks.remove(callback)
+
+
+def enabled() -> bool:
+    return bool(_callbacks or _reports.get())
+
+
+def emit(kind: str, name: str, value: float):
+    event = Event(kind, name, value)
+    for callback in _callbacks:
+        callback(event)
+    for report in _reports.get():
+        report(event)
+
+
+def count(name: str, value: float = 1):
+    """Add to a counter, a no-op while instrumentation is off"""
+    if _callbacks or _reports.get():
+        emit("count", name, value)
+
+
+@contextmanager
+def _timer(name: str) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        emit("timing", name, time.perf_counter() - start)
+
+
+_off = nullcontext()
+
+
+def stage(name: str):
+    """Context manager that times a block, a shared no-op context while instrumentation is off"""
+    if _callbacks or _reports.get():
+        return _timer(name)
+    return _off
+
+
+def timed(name: str) -> Callable[[Callable], Callable]:
+    """Decorator that times every call of a function as stage `name`"""
+
+    def decorator(func: Callable) -> Callable:
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not (_callbacks or _reports.get()):
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                emit("timing", name, time.perf_counter() - start)
+
+        return wrapper
+
+    return decorator
+
+
+@contextmanager
+def collect() -> Iterator[Report]:
+    """Collect the events of the code run in this block, in this thread or asyncio task, into a `Report`"""
+    report = Report()
+    token = _reports.set((*_reports.get(), report))
+    try:
+        yield report
+    finally:
+        _reports.reset(token)
+
+
+class Profile(object):
+    """cProfile statistics and (with memory=True) the tracemalloc peak and snapshot of a `profile()` block"""
+
+    def __init__(self):
+        self.stats: pstats.Stats | None = None
+        self.peak_bytes: int | None = None
+        self.snapshot: tracemalloc.Snapshot | None = None
+
+    def report(self, limit: int = 20, sort: str = "cumulative") -> str:
+        out = io.StringIO()
+        if self.stats is not None:
+            self.stats.stream = out
+            self.stats.sort_stats(sort).print_stats(limit)
+        if self.snapshot is not None:
+            out.write(f"Peak traced memory: {self.peak_bytes / 2**20:.1f} MB\n")
+            for stat in self.snapshot.statistics("lineno")[:limit]:
+                out.write(f"{stat}\n")
+        return out.getvalue()
+
+
+@contextmanager
+def profile(cpu: bool = True, memory: bool = False) -> Iterator[Profile]:
+    """Profile a block with cProfile (cpu) and tracemalloc (memory), for one call at a time as both slow it down"""
+    result = Profile()
+    profiler = cProfile.Profile() if cpu else None
+    tracing = memory and not tracemalloc.is_tracing()
+    if tracing:
+        tracemalloc.start()
+    if memory:
+        tracemalloc.reset_peak()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield result
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            result.stats = pstats.Stats(profiler)
+        if memory:
+            result.peak_bytes = tracemalloc.get_traced_memory()[1]
+            result.snapshot = tracemalloc.take_snapshot()
+        if tracing:
+            tracemalloc.stop()
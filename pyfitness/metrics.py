@@ -0,0 +1,188 @@
+"""
+Training load metrics: Normalized Power, Intensity Factor, TSS, TRIMP and W' balance.
+
+Everything works on 1 Hz arrays, `to_1hz(df, "power")` or `activity.resample().columns["power"]`. The batch versions
+take one array per ride.
+
+load_metrics(df, ftp=250, cp=260, w_prime=20000, hr_rest=50, hr_max=190)
+metrics = load_metrics_many(powers, ftp=250, heart_rates=heart_rates, hr_rest=50, hr_max=190)
+# FTP changed: only IF and TSS depend on it, no ride has to be read again
+metrics["intensity_factor"], metrics["tss"] = training_stress(metrics.normalized_power, metrics.duration, 265)
+"""
+
+from __future__ import annotations
+
+from collections.abc import Sequence
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+from pyfitness.statistics import to_1hz
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+    from pyfitness.resample import Resampled
+
+NP_WINDOW = 30
+
+# Banister TRIMP weighting factor
+TRIMP_K = {"male": 1.92, "female": 1.67}
+
+# Largest total decay (in e-folds) applied inside one block of `linear_recurrence`, exp(500) fits a float64
+_MAX_DECAY = 500.0
+
+
+def linear_recurrence(decay: np.ndarray | float, x: np.ndarray) -> np.ndarray:
+    """y[n] = decay[n] * y[n - 1] + x[n] with y[-1] = 0, the first order filter of `scipy.signal.lfilter([1], [1,
+    -decay], x)` but with a decay per sample.
+    Solved in closed form as y[n] = D[n] * cumsum(x / D)[n] with D the cumulative product of the decays, split in
+    blocks so D stays in the float64 range. decay must be in (0, 1].
+    """
+    x = np.asarray(x, dtype=np.float64)
+    n = len(x)
+    log_decay = np.log(np.broadcast_to(np.asarray(decay, dtype=np.float64), (n,)))
+    total = np.cumsum(log_decay)
+    y = np.empty(n, dtype=np.float64)
+    previous = 0.0
+    start = 0
+    while start < n:
+        origin = total[start - 1] if start else 0.0
+        end = max(int(np.searchsorted(-total, _MAX_DECAY - origin, side="right")), start + 1)
+        d = np.exp(total[start:end] - origin)
+        y[start:end] = d * (previous + np.cumsum(x[start:end] / d))
+        previous = y[end - 1]
+        start = end
+    return y
+
+
+def rolling_mean(values: np.ndarray, window: int) -> np.ndarray:
+    """Mean of every `window` long run of samples, n - window + 1 values"""
+    csum = np.concatenate([[0.0], np.cumsum(np.asarray(values, dtype=np.float64))])
+    return (csum[window:] - csum[:-window]) / window
+
+
+def normalized_power(power: np.ndarray, window: int = NP_WINDOW) -> float:
+    """Normalized Power of a 1 Hz power array: the fourth root of the mean of the 30 s rolling mean to the 4th power.
+    NaN if the ride is shorter than the window.
+    """
+    if len(power) < window:
+        return np.nan
+    rolling = np.square(rolling_mean(np.nan_to_num(power), window))
+    return float(np.mean(np.square(rolling)) ** 0.25)
+
+
+def training_stress(
+    normalized_power: float | np.ndarray, duration: float | np.ndarray, ftp: float | np.ndarray
+) -> tuple[float | np.ndarray, float | np.ndarray]:
+    """Intensity Factor and TSS from the Normalized Power and duration in seconds, for one ride or arrays of rides"""
+    intensity = np.asarray(normalized_power) / ftp
+    return intensity, np.asarray(duration) * intensity**2 / 36
+
+
+def trimp(heart_rate: np.ndarray, hr_rest: float, hr_max: float, sex: str = "male") -> float:
+    """Banister TRIMP of a 1 Hz heart rate array in minutes, samples without a heart rate (NaN or 0) count as rest"""
+    hrr = np.clip((np.nan_to_num(heart_rate) - hr_rest) / (hr_max - hr_rest), 0, None)
+    return float(np.sum(hrr * 0.64 * np.exp(TRIMP_K[sex] * hrr)) / 60)
+
+
+def w_prime_tau(power: np.ndarray, cp: float) -> float:
+    """Time constant in seconds of the W' recovery (Skiba 2012) from the mean power below CP"""
+    below = power[power < cp]
+    dcp = cp - (below.mean() if len(below) else 0.0)
+    return 546 * np.exp(-0.01 * dcp) + 316
+
+
+def w_prime_balance(power: np.ndarray, cp: float, w_prime: float, model: str = "integral") -> np.ndarray:
+    """W' balance in joules of a 1 Hz power array.
+    model: "integral" (Skiba 2012), the W' spent above CP recovers exponentially with the time constant of
+        `w_prime_tau`. "differential" (Skiba 2015), below CP the balance recovers by (CP - power) / W' of what was
+        spent each second.
+    """
+    power = np.nan_to_num(np.asarray(power, dtype=np.float64))
+    spent = np.clip(power - cp, 0, None)
+    if model == "integral":
+        decay = np.exp(-1 / w_prime_tau(power, cp))
+    elif model == "differential":
+        decay = np.clip(1 - np.clip(cp - power, 0, None) / w_prime, 1e-12, 1)
+    else:
+        raise ValueError("model must be 'integral' or 'differential'")
+    return w_prime - linear_recurrence(decay, spent)
+
+
+def load_metrics(  # noqa: PLR0913 - the rider parameters are keyword-only
+    df: pd.DataFrame | Resampled,
+    ftp: float,
+    *,
+    cp: float | None = None,
+    w_prime: float = 20000,
+    hr_rest: float | None = None,
+    hr_max: float | None = None,
+    sex: str = "male",
+) -> dict[str, float]:
+    """Load metrics of a ride, power and heart rate are put on a 1 Hz grid with `to_1hz` (a `Resampled` ride is
+    used as is).
+    cp: Critical power for W' balance, defaults to ftp.
+    Returns duration (seconds), normalized_power, intensity_factor, tss, w_prime_bal_min (lowest W' balance in joules)
+    and trimp when hr_rest and hr_max are given.
+    """
+    power = to_1hz(df, "power")
+    norm_power = normalized_power(power)
+    intensity, tss = training_stress(norm_power, len(power), ftp)
+    metrics = {
+        "duration": len(power),
+        "normalized_power": norm_power,
+        "intensity_factor": float(intensity),
+        "tss": float(tss),
+        "w_prime_bal_min": float(w_prime_balance(power, cp or ftp, w_prime).min()) if len(power) else np.nan,
+    }
+    if hr_rest is not None and hr_max is not None and "heart_rate" in df.columns:
+        metrics["trimp"] = trimp(to_1hz(df, "heart_rate", fill="ffill"), hr_rest, hr_max, sex)
+    return metrics
+
+
+def _per_ride(n_rides: int, value: float | np.ndarray) -> np.ndarray:
+    """One value per ride from a value for all rides or an array of them"""
+    return np.broadcast_to(np.asarray(value, dtype=np.float64), (n_rides,))
+
+
+def load_metrics_many(  # noqa: PLR0913 - the rider parameters are keyword-only
+    powers: Sequence[np.ndarray],
+    ftp: float | np.ndarray,
+    *,
+    cp: float | np.ndarray | None = None,
+    w_prime: float | np.ndarray = 20000,
+    heart_rates: Sequence[np.ndarray] | None = None,
+    hr_rest: float | np.ndarray | None = None,
+    hr_max: float | np.ndarray | None = None,
+    sex: str = "male",
+) -> pd.DataFrame:
+    """`load_metrics` for many rides, from 1 Hz power (and heart rate) arrays, one per ride.
+    Each ride is a few vectorised passes over its own arrays, which stay in the CPU cache. That is faster than
+    concatenating the rides into one large array.
+    ftp, cp, w_prime, hr_rest, hr_max: A value for all rides or an array with one per ride.
+    Returns a dataframe with one row per ride, see `load_metrics` for the columns.
+    """
+    import pandas as pd
+
+    n_rides = len(powers)
+    cp = _per_ride(n_rides, cp if cp is not None else ftp)
+    w_prime = _per_ride(n_rides, w_prime)
+    duration = np.array([len(p) for p in powers], dtype=np.int64)
+    norm_power = np.array([normalized_power(p) for p in powers], dtype=np.float64)
+    intensity, tss = training_stress(norm_power, duration, _per_ride(n_rides, ftp))
+    w_bal_min = np.array(
+        [w_prime_balance(p, c, w).min() if len(p) else np.nan for p, c, w in zip(powers, cp, w_prime, strict=True)],
+        dtype=np.float64,
+    )
+    metrics = {
+        "duration": duration,
+        "normalized_power": norm_power,
+        "intensity_factor": intensity,
+        "tss": tss,
+        "w_prime_bal_min": w_bal_min,
+    }
+    if heart_rates is not None and hr_rest is not None and hr_max is not None:
+        rides = zip(heart_rates, _per_ride(n_rides, hr_rest), _per_ride(n_rides, hr_max), strict=True)
+        metrics["trimp"] = np.array([trimp(hr, rest, top, sex) for hr, rest, top in rides], dtype=np.float64)
+    return pd.DataFrame(metrics)
@@ -0,0 +1,189 @@
+"""
+Put a ride on a uniform 1 Hz time grid.
+
+FIT files are not evenly spaced: smart recording skips seconds, pauses leave long gaps and some devices write the same
+timestamp twice. On the grid row i is second i from the first sample, so a time window is a slice
+`grid.columns["power"][start:start + seconds]` instead of a search over timestamps.
+
+Each field is filled by its FIELD_FILL method, seconds inside a gap longer than `max_gap` are marked as paused and the
+fields in PAUSED_ZERO are 0 there.
+
+grid = resample_df(fit2df("ride.fit"))  # or fit2activity("ride.fit").resample(), cached on the activity
+grid.columns["power"], grid.paused, grid.to_df()
+"""
+
+from __future__ import annotations
+
+from collections.abc import Iterable
+from datetime import UTC, datetime, timedelta
+from typing import TYPE_CHECKING, NamedTuple
+
+import numpy as np
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# How a field is filled at the seconds without a (non NaN) sample:
+#   "linear": interpolated between the samples around it, levels and slowly changing values
+#   "ffill": the last sample holds until the next one, counters and values that change in steps
+#   "zero": 0, efforts where no data means no effort
+# Seconds before the first sample take the first value for "linear" and "ffill". Other fields use DEFAULT_FILL.
+FIELD_FILL = {
+    "power": "zero",
+    "cadence": "zero",
+    "fractional_cadence": "zero",
+    "heart_rate": "linear",
+    "speed": "linear",
+    "enhanced_speed": "linear",
+    "vertical_speed": "linear",
+    "altitude": "linear",
+    "enhanced_altitude": "linear",
+    "distance": "linear",
+    "grade": "linear",
+    "position_lat": "linear",
+    "position_long": "linear",
+    "respiration_rate": "linear",
+    "enhanced_respiration_rate": "linear",
+    "core_temperature": "linear",
+}
+DEFAULT_FILL = "ffill"
+
+# Fields that are 0 while paused, whatever their fill method
+PAUSED_ZERO = ("power", "cadence", "fractional_cadence", "speed", "enhanced_speed", "vertical_speed")
+
+# Longest gap between samples in seconds that is filled as recording, longer gaps are pauses
+MAX_GAP = 10
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=UTC)
+_NAT = np.iinfo(np.int64).min
+
+
+def _ticks(value, step: timedelta) -> int:
+    if not isinstance(value, datetime):
+        return _NAT
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=UTC)
+    return (value - _EPOCH) // step
+
+
+def utc_datetime64(values: Iterable, unit: str = "us") -> np.ndarray:
+    """Naive UTC datetime64 of datetimes, aware ones are converted and naive ones taken as UTC, NaT for other values.
+    unit: "s", "ms" or "us".
+    """
+    step = np.timedelta64(1, unit).item()
+    return np.fromiter((_ticks(v, step) for v in values), np.int64).view(f"datetime64[{unit}]")
+
+
+def utc_timestamps(df: pd.DataFrame) -> np.ndarray:
+    """The timestamp index of a dataframe (`fit2df`) as naive UTC datetime64"""
+    import pandas as pd
+
+    index = df.index
+    if isinstance(index.dtype, pd.DatetimeTZDtype):
+        index = index.tz_convert("UTC").tz_localize(None)
+    return index.to_numpy()
+
+
+class Resampled(NamedTuple):
+    """A ride on a 1 Hz grid, row i of every array is `start` + i seconds.
+    sampled: True for the seconds with a sample in the source data.
+    paused: True for the seconds inside a gap of more than `max_gap` seconds between samples.
+    """
+
+    start: np.datetime64
+    columns: dict[str, np.ndarray]
+    sampled: np.ndarray
+    paused: np.ndarray
+
+    @property
+    def size(self) -> int:
+        return len(self.sampled)
+
+    def row(self, timestamp: np.datetime64 | datetime) -> int:
+        """Row of a timestamp, rounded down to the second"""
+        if getattr(timestamp, "tzinfo", None) is not None:
+            timestamp = timestamp.astimezone(UTC).replace(tzinfo=None)
+        return int((np.datetime64(timestamp, "s") - self.start.astype("datetime64[s]")) // np.timedelta64(1, "s"))
+
+    def to_df(self, utc: bool = True) -> pd.DataFrame:
+        """The grid as a dataframe indexed by timestamp, like `fit2df`, the columns are views of the grid arrays"""
+        import pandas as pd
+
+        index = pd.DatetimeIndex(self.start + np.arange(self.size).astype("timedelta64[s]"), name="timestamp")
+        if utc:
+            index = index.tz_localize("UTC")
+        return pd.DataFrame(self.columns, index=index, copy=False)
+
+
+def _fill(seconds: np.ndarray, values: np.ndarray, size: int, method: str) -> np.ndarray:
+    if method not in ("linear", "ffill", "zero"):
+        raise ValueError(f"Unknown fill method {method!r}, expected 'linear', 'ffill' or 'zero'")
+    known = ~np.isnan(values)
+    if method == "zero":
+        grid = np.zeros(size, dtype=np.float64)
+        grid[seconds[known]] = values[known]
+        return grid
+    if not known.any():
+        return np.full(size, np.nan)
+    if method == "linear":
+        return np.interp(np.arange(size), seconds[known], values[known])
+    grid = np.full(size, np.nan)
+    grid[seconds[known]] = values[known]
+    last = np.maximum.accumulate(np.where(np.isnan(grid), -1, np.arange(size)))
+    last[last < 0] = seconds[known][0]
+    return grid[last]
+
+
+def resample(  # noqa: PLR0913 - the options are keyword-only
+    seconds: np.ndarray,
+    columns: dict[str, np.ndarray],
+    start: np.datetime64,
+    *,
+    fill: dict[str, str] | None = None,
+    max_gap: float = MAX_GAP,
+    paused_zero: tuple[str, ...] | list[str] = PAUSED_ZERO,
+) -> Resampled:
+    """Resample numeric columns with a sample time in `seconds` (from `start`) to a 1 Hz grid starting at `start`.
+    Times are rounded to the second, for duplicate seconds the last sample wins. NaN values count as missing.
+    fill: Fill method per field, overrides FIELD_FILL.
+    """
+    fill = FIELD_FILL | (fill or {})
+    seconds = np.asarray(seconds, dtype=np.float64)
+    valid = ~np.isnan(seconds)  # NaT timestamps
+    rounded = np.rint(seconds[valid]).astype(np.int64)
+    if len(rounded):
+        origin = rounded.min()
+        rounded -= origin
+        start = start + np.timedelta64(int(origin), "s")
+    # last sample of every second, in time order
+    unique, first_reversed = np.unique(rounded[::-1], return_index=True)
+    rows = np.flatnonzero(valid)[len(rounded) - 1 - first_reversed]
+    size = int(unique[-1]) + 1 if len(unique) else 0
+    sampled = np.zeros(size, dtype=bool)
+    sampled[unique] = True
+    # seconds between the sample before and after each second
+    positions = np.arange(size)
+    before = np.maximum.accumulate(np.where(sampled, positions, 0))
+    after = np.minimum.accumulate(np.where(sampled, positions, size)[::-1])[::-1]
+    paused = ~sampled & (after - before > max_gap)
+    grid = {}
+    for name, values in columns.items():
+        grid[name] = _fill(unique, np.asarray(values, dtype=np.float64)[rows], size, fill.get(name, DEFAULT_FILL))
+        if name in paused_zero:
+            grid[name][paused] = 0.0
+    return Resampled(start, grid, sampled, paused)
+
+
+def resample_df(
+    df: pd.DataFrame,
+    fill: dict[str, str] | None = None,
+    max_gap: float = MAX_GAP,
+    paused_zero: tuple[str, ...] | list[str] = PAUSED_ZERO,
+) -> Resampled:
+    """Resample the numeric columns of a dataframe indexed by timestamp, like `fit2df`, see `resample`"""
+    timestamp = utc_timestamps(df)
+    known = timestamp[~np.isnat(timestamp)]
+    start = known.min() if len(known) else np.datetime64(0, "s")
+    seconds = (timestamp - start) / np.timedelta64(1, "s")
+    columns = {name: col.to_numpy(dtype=np.float64) for name, col in df.items() if col.dtype.kind in "biuf"}
+    return resample(seconds, columns, start, fill=fill, max_gap=max_gap, paused_zero=paused_zero)
@@ -0,0 +1,347 @@
+"""
+A persistent index of an athlete's rides in SQLite, for questions across the whole history without reading any fit
+file again.
+
+Each ride gets one row of summary values, taken from its session messages (or derived from the records when the
+device did not write them), and its mean maximal curves at CURVE_DURATIONS. `update` only decodes files that are new
+or changed since the last update, in parallel with `batch.map_fit_files`.
+
+index = RideIndex("~/rides/athlete.sqlite")
+index.update("~/rides")
+index.best("power", 1200, start="2024-01-01")  # best 20 min power this season
+index.rides(where="total_ascent > 1500")
+index.curve("power", by_year=True)  # power curve envelope of each year
+"""
+
+from __future__ import annotations
+
+import os
+import sqlite3
+from collections.abc import Iterable
+from datetime import UTC
+from functools import partial
+from itertools import repeat
+from pathlib import Path
+from typing import TYPE_CHECKING, Any
+
+import numpy as np
+
+from pyfitness import backends
+from pyfitness.batch import find_fit_files, map_fit_files
+from pyfitness.cache import content_hash
+from pyfitness.fd_loader import fit2df
+from pyfitness.statistics import mean_max_curve, seconds_index, to_1hz
+from pyfitness.summary import fitsummary
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+INDEX_FORMAT = 1
+
+# Durations in seconds the mean maximal curves are stored at
+CURVE_DURATIONS = (
+    *range(1, 61),
+    *range(75, 301, 15),
+    *range(360, 1201, 60),
+    *range(1500, 3601, 300),
+    *range(4500, 21601, 900),
+    *range(25200, 86401, 3600),
+)
+CURVE_COLUMNS = ("power", "heart_rate", "cadence")
+
+# Summary columns of the rides table: name -> SQLite type
+SUMMARY_COLUMNS = {
+    "start_time": "TEXT",
+    "sport": "TEXT",
+    "sub_sport": "TEXT",
+    "total_elapsed_time": "REAL",
+    "total_timer_time": "REAL",
+    "total_distance": "REAL",
+    "total_ascent": "REAL",
+    "total_descent": "REAL",
+    "total_calories": "REAL",
+    "avg_power": "REAL",
+    "max_power": "REAL",
+    "normalized_power": "REAL",
+    "avg_heart_rate": "REAL",
+    "max_heart_rate": "REAL",
+    "avg_cadence": "REAL",
+    "records": "INTEGER",
+}
+# How the fields of several sessions (multisport files) are combined
+_SUMMED = (
+    "total_elapsed_time",
+    "total_timer_time",
+    "total_distance",
+    "total_ascent",
+    "total_descent",
+    "total_calories",
+)
+_MAXED = ("max_power", "max_heart_rate")
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS rides (
+    id INTEGER PRIMARY KEY,
+    content_hash TEXT NOT NULL UNIQUE,
+    {", ".join(f"{name} {kind}" for name, kind in SUMMARY_COLUMNS.items())}
+);
+CREATE INDEX IF NOT EXISTS rides_start_time ON rides (start_time);
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    mtime REAL NOT NULL,
+    size INTEGER NOT NULL,
+    ride_id INTEGER NOT NULL REFERENCES rides (id) ON DELETE CASCADE
+);
+CREATE INDEX IF NOT EXISTS files_ride_id ON files (ride_id);
+CREATE TABLE IF NOT EXISTS curves (
+    ride_id INTEGER NOT NULL REFERENCES rides (id) ON DELETE CASCADE,
+    field TEXT NOT NULL,
+    duration INTEGER NOT NULL,
+    mean REAL NOT NULL,
+    start INTEGER NOT NULL,
+    PRIMARY KEY (field, duration, ride_id)
+) WITHOUT ROWID;
+"""
+
+# SQL for the (first) path of a ride
+_PATH = "SELECT min(path) FROM files WHERE files.ride_id = rides.id"
+
+
+def _time_text(value: Any) -> str | None:
+    """UTC timestamps as text that sorts and compares by time in SQLite"""
+    if value is None:
+        return None
+    if getattr(value, "tzinfo", None) is not None:
+        value = value.astimezone(UTC)
+    return value.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _sql_value(value: Any) -> Any:
+    if value is None or isinstance(value, int | float | str):
+        return value
+    if isinstance(value, np.generic):
+        return value.item()
+    return str(value)
+
+
+def session_summary(sessions: list[dict]) -> dict[str, Any]:
+    """One summary of the session messages of a file, totals are summed and averages weighted by timer time"""
+    if not sessions:
+        return {}
+    summary = {name: sessions[0].get(name) for name in SUMMARY_COLUMNS if name != "records"}
+    if len(sessions) > 1:
+        for name in _SUMMED:
+            values = [s[name] for s in sessions if s.get(name) is not None]
+            summary[name] = sum(values) if values else None
+        for name in _MAXED:
+            values = [s[name] for s in sessions if s.get(name) is not None]
+            summary[name] = max(values) if values else None
+        for name in ("avg_power", "normalized_power", "avg_heart_rate", "avg_cadence"):
+            weighted = [(s[name], s.get("total_timer_time") or 0) for s in sessions if s.get(name) is not None]
+            seconds = sum(w for _, w in weighted)
+            summary[name] = sum(v * w for v, w in weighted) / seconds if seconds else None
+    summary["start_time"] = _time_text(summary["start_time"])
+    return summary
+
+
+def _records_summary(df: pd.DataFrame) -> dict[str, Any]:
+    """The summary values a device may leave out of the session, from the records"""
+    summary = {
+        "start_time": _time_text(df.index.min()),
+        "total_elapsed_time": int(seconds_index(df)[-1]) + 1 if len(df) else 0,
+    }
+    if "distance" in df.columns:
+        summary["total_distance"] = df.distance.max() - df.distance.min()
+    altitudevar = "enhanced_altitude" if "enhanced_altitude" in df.columns else "altitude"
+    if altitudevar in df.columns:
+        step = np.diff(to_1hz(df, altitudevar, fill="ffill"))
+        summary["total_ascent"] = step[step > 0].sum()
+        summary["total_descent"] = -step[step < 0].sum()
+    for col, name in (("power", "power"), ("heart_rate", "heart_rate"), ("cadence", "cadence")):
+        if col in df.columns:
+            summary[f"avg_{name}"] = df[col].mean()
+            if name != "cadence":
+                summary[f"max_{name}"] = df[col].max()
+    return summary
+
+
+def index_entry(fit_file: str, backend: str | None = None) -> dict[str, Any]:
+    """Everything the index stores about one fit file: file identity, summary and mean maximal curves.
+    Module level and returning plain data so it runs in `map_fit_files` worker processes.
+    backend: The decoder of the records, see `pyfitness.backends`.
+    """
+    stat = os.stat(fit_file)
+    summary = fitsummary(fit_file)
+    values = session_summary(summary.sessions)
+    df = fit2df(fit_file, columnar=True, backend=backend)
+    for name, value in _records_summary(df).items():
+        if values.get(name) is None:
+            values[name] = value
+    values["records"] = summary.message_counts.get("record", 0)
+    curves = {}
+    for col in CURVE_COLUMNS:
+        if col in df.columns and df[col].notna().any():
+            curves[col] = mean_max_curve(to_1hz(df, col), CURVE_DURATIONS)
+    return {
+        "path": str(Path(fit_file).resolve()),
+        "content_hash": content_hash(fit_file),
+        "mtime": stat.st_mtime,
+        "size": stat.st_size,
+        "summary": {name: _sql_value(values.get(name)) for name in SUMMARY_COLUMNS},
+        "curves": curves,
+    }
+
+
+class RideIndex(object):
+    """Ride summaries and mean maximal curves of an athlete in a SQLite database"""
+
+    def __init__(self, path: str | os.PathLike = ":memory:"):
+        self.path = path if path == ":memory:" else Path(path).expanduser()
+        self.db = sqlite3.connect(self.path)
+        self.db.execute("PRAGMA foreign_keys = ON")
+        version = self.db.execute("PRAGMA user_version").fetchone()[0]
+        if version not in (0, INDEX_FORMAT):
+            raise ValueError(f"{path} is a version {version} index, expected {INDEX_FORMAT}. Delete it to rebuild.")
+        with self.db:
+            self.db.executescript(SCHEMA)
+            self.db.execute(f"PRAGMA user_version = {INDEX_FORMAT}")
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self) -> RideIndex:
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self) -> int:
+        return self.db.execute("SELECT count(*) FROM rides").fetchone()[0]
+
+    def add(self, entry: dict[str, Any], drop_orphans: bool = True):
+        """Store an `index_entry`. A file with the same content as an indexed ride (a copy) only adds its path.
+        drop_orphans: Delete the rides left without a file (the old content of a changed file), a full table scan.
+            Pass False when adding many entries and call `drop_orphans` once at the end.
+        """
+        with self.db:
+            row = self.db.execute("SELECT id FROM rides WHERE content_hash = ?", (entry["content_hash"],)).fetchone()
+            if row is None:
+                columns = ["content_hash", *SUMMARY_COLUMNS]
+                cursor = self.db.execute(
+                    f"INSERT INTO rides ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                    [entry["content_hash"], *entry["summary"].values()],
+                )
+                ride_id = cursor.lastrowid
+                for field, (durations, means, starts) in entry["curves"].items():
+                    rows = zip(repeat(ride_id), repeat(field), durations.tolist(), means.tolist(), starts.tolist())
+                    self.db.executemany("INSERT INTO curves VALUES (?, ?, ?, ?, ?)", rows)
+            else:
+                ride_id = row[0]
+            self.db.execute(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)",
+                (entry["path"], entry["mtime"], entry["size"], ride_id),
+            )
+            if drop_orphans:
+                self.drop_orphans()
+
+    def drop_orphans(self):
+        """Delete the rides without a file, e.g. after a file changed"""
+        with self.db:
+            self.db.execute("DELETE FROM rides WHERE id NOT IN (SELECT ride_id FROM files)")
+
+    def stale(self, fit_files: list[str]) -> list[str]:
+        """The fit files that are not in the index or changed (mtime or size) since they were indexed"""
+        known = {path: (mtime, size) for path, mtime, size in self.db.execute("SELECT path, mtime, size FROM files")}
+        stale = []
+        for fit_file in fit_files:
+            stat = os.stat(fit_file)
+            if known.get(str(Path(fit_file).resolve())) != (stat.st_mtime, stat.st_size):
+                stale.append(fit_file)
+        return stale
+
+    def update(
+        self, paths: str | os.PathLike | Iterable[str | os.PathLike], workers: int | None = None, prune: bool = False
+    ) -> dict[str, Any]:
+        """Index the new and changed fit files in `paths` (files or directories), see `map_fit_files` for workers.
+        prune: Also drop the files (and their rides) that no longer exist.
+        Returns the number of files added and unchanged, and the BatchResult of each file that failed to decode.
+        """
+        fit_files = find_fit_files(paths)
+        stale = self.stale(fit_files)
+        added, errors = 0, []
+        entry = partial(index_entry, backend=backends.backend_name())
+        for result in map_fit_files(entry, stale, workers=workers, ordered=False):
+            if result.error is None:
+                self.add(result.value, drop_orphans=False)
+                added += 1
+            else:
+                errors.append(result)
+        if prune:
+            gone = [(path,) for (path,) in self.db.execute("SELECT path FROM files") if not os.path.exists(path)]
+            with self.db:
+                self.db.executemany("DELETE FROM files WHERE path = ?", gone)
+        self.drop_orphans()
+        return {"added": added, "unchanged": len(fit_files) - len(stale), "errors": errors}
+
+    @staticmethod
+    def _period(start: str | None, end: str | None, column: str = "start_time") -> tuple[str, list]:
+        """SQL condition and parameters for start <= start_time < end, as dates or timestamps in UTC"""
+        conditions, params = ["1"], []
+        if start is not None:
+            conditions.append(f"{column} >= ?")
+            params.append(str(start))
+        if end is not None:
+            conditions.append(f"{column} < ?")
+            params.append(str(end))
+        return " AND ".join(conditions), params
+
+    def query(self, sql: str, params: Iterable = ()) -> pd.DataFrame:
+        """Run any SELECT on the rides, curves and files tables"""
+        import pandas as pd
+
+        return pd.read_sql_query(sql, self.db, params=list(params))
+
+    def rides(
+        self, start: str | None = None, end: str | None = None, where: str | None = None, params: Iterable = ()
+    ) -> pd.DataFrame:
+        """Summaries of the rides that started in [start, end), optionally filtered by a SQL condition on the
+        summary columns, e.g. where="total_ascent > ?", params=[1500]
+        """
+        condition, period_params = self._period(start, end)
+        if where:
+            condition += f" AND ({where})"
+        return self.query(
+            f"SELECT rides.*, ({_PATH}) AS path FROM rides WHERE {condition} ORDER BY start_time",
+            [*period_params, *params],
+        )
+
+    def best(
+        self, column: str, duration: int, start: str | None = None, end: str | None = None, limit: int = 10
+    ) -> pd.DataFrame:
+        """The rides with the best mean `column` over `duration` seconds (one of CURVE_DURATIONS) in [start, end)"""
+        condition, params = self._period(start, end, "rides.start_time")
+        return self.query(
+            f"SELECT rides.id AS ride_id, ({_PATH}) AS path, rides.start_time, curves.mean, curves.start "
+            "FROM curves JOIN rides ON rides.id = curves.ride_id "
+            f"WHERE curves.field = ? AND curves.duration = ? AND {condition} "
+            "ORDER BY curves.mean DESC LIMIT ?",
+            [column, duration, *params, limit],
+        )
+
+    def curve(
+        self, column: str = "power", start: str | None = None, end: str | None = None, by_year: bool = False
+    ) -> pd.DataFrame:
+        """Envelope of the mean maximal curves of the rides in [start, end): the best mean for each duration and the
+        ride it came from. by_year: One envelope per calendar year, with a `year` column.
+        """
+        condition, params = self._period(start, end, "rides.start_time")
+        year = "substr(rides.start_time, 1, 4)" if by_year else "''"
+        # SQLite returns the other columns of the row with the max() of an aggregate
+        df = self.query(
+            f"SELECT {year} AS year, curves.duration, max(curves.mean) AS mean, rides.id AS ride_id, rides.start_time "
+            "FROM curves JOIN rides ON rides.id = curves.ride_id "
+            f"WHERE curves.field = ? AND {condition} "
+            "GROUP BY year, curves.duration ORDER BY year, curves.duration",
+            [column, *params],
+        )
+        return df if by_year else df.drop(columns="year")
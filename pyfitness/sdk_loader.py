@@ -1,35 +1,163 @@
 """
 This loader uses the Garmin SDK to load the data from the FIT file.
 https://developer.garmin.com/fit/example-projects/python/
+
+`fit2dict` and `fit2df` return the same schema as `fd_loader`, see `pyfitness.backends` to select the decoder. All
+decode state is local to a call so several files can be decoded at once from different threads. Fields without a valid
+value are left out of the message dicts rather than set to None. The SDK ships a newer FIT profile than fitdecode, so it
+names some fields and messages that fitdecode reports as unknown (and fd_loader drops).
 """
 
-from garmin_fit_sdk import Decoder, Stream, Profile
+from __future__ import annotations
 
+import os
+import struct
+from functools import cache
+from typing import TYPE_CHECKING, Any
 
-record_fields = set()
-profile_types = set()
+from garmin_fit_sdk import Decoder, Profile, Stream
+from garmin_fit_sdk.crc_calculator import CrcCalculator
 
+from pyfitness.fd_loader import records2df
 
-def mesg_listener(mesg_num, message):
-    profile_types.add(mesg_num)
-    if mesg_num == Profile["mesg_num"]["RECORD"]:
-        for field in message:
-            record_fields.add(field)
+if TYPE_CHECKING:
+    import pandas as pd
 
+RECORD = Profile["mesg_num"]["RECORD"]
+EVENT = Profile["mesg_num"]["EVENT"]
+SESSION = Profile["mesg_num"]["SESSION"]
+ACTIVITY = Profile["mesg_num"]["ACTIVITY"]
+DEVELOPER_DATA_ID = Profile["mesg_num"]["DEVELOPER_DATA_ID"]
+FIELD_DESCRIPTION = Profile["mesg_num"]["FIELD_DESCRIPTION"]
+
+# A header of this size ends with a CRC of its first 12 bytes
+HEADER_SIZE_CRC = 14
+
+
+def _read(fit_file: str | os.PathLike | bytes) -> bytes:
+    if isinstance(fit_file, bytes | bytearray | memoryview):
+        return bytes(fit_file)
+    with open(fit_file, "rb") as f:
+        return f.read()
+
+
+def header2dict(data: bytes) -> dict:
+    """The file header in the layout of `fd_loader.fit2dict`"""
+    header_size, proto_ver, profile_ver, body_size = struct.unpack_from("<BBHI", data)
+    crc = crc_matched = None
+    if header_size >= HEADER_SIZE_CRC:
+        crc = struct.unpack_from("<H", data, 12)[0] or None
+        if crc is not None:
+            crc_matched = CrcCalculator.calculate_crc(data, 0, 12) == crc
+    return {
+        "header_size": header_size,
+        "proto_ver": (proto_ver >> 4, proto_ver & 0x0F),
+        "profile_ver": divmod(profile_ver, 100),
+        "body_size": body_size,
+        "crc": crc,
+        "crc_matched": crc_matched,
+        "chunk": None,
+    }
+
+
+@cache
+def _replaced_fields(mesg_num: int) -> list[tuple[str, frozenset[str]]]:
+    """(field, subfield names) of a message type, fitdecode only keeps the subfield when one applies"""
+    fields = Profile["messages"][mesg_num]["fields"].values()
+    return [(f["name"], frozenset(s["name"] for s in f["sub_fields"])) for f in fields if f.get("sub_fields")]
 
-def fit2dict(fit_file: str):
-    stream = Stream.from_file(fit_file)
-    decoder = Decoder(stream)
-    # loop through the messages
-    messages, errors = decoder.read(mesg_listener=mesg_listener)
 
-    if len(errors) > 0:
-        print(f"Something went wrong decoding the file: {errors}")
-        return
+def _clean(mesg_num: int, message: dict, dev_names: dict[int, str]) -> dict:
+    """Message fields like `fd_loader.frame2dict`: unknown fields dropped, arrays as tuples, named developer fields"""
+    skip = {name for name, sub_fields in _replaced_fields(mesg_num) if not sub_fields.isdisjoint(message)}
+    if mesg_num in (DEVELOPER_DATA_ID, FIELD_DESCRIPTION):
+        skip.add("key")  # added by the SDK
+    out = {}
+    for name, value in message.items():
+        if name in skip:
+            continue
+        if name == "developer_fields":
+            for key, dev_value in value.items():
+                if key in dev_names:
+                    out[dev_names[key]] = tuple(dev_value) if isinstance(dev_value, list) else dev_value
+        elif isinstance(name, str):
+            out[name] = tuple(value) if isinstance(value, list) else value
+    return out
 
-    print(record_fields)
-    print(profile_types)
+
+def crc2dict(data: bytes) -> dict | None:
+    """The file CRC after the data of the first FIT file in `data`, in the layout of `fd_loader.fit2dict`, None when
+    the file ends before it"""
+    header_size, _, _, body_size = struct.unpack_from("<BBHI", data)
+    end = header_size + body_size
+    if len(data) < end + 2:
+        return None
+    crc = struct.unpack_from("<H", data, end)[0]
+    return {"crc": crc, "matched": CrcCalculator.calculate_crc(data, 0, end) == crc, "chunk": None}
+
+
+def fit2dict(fit_file: str | os.PathLike | bytes) -> dict[str, dict | list[dict] | set[Any] | None]:
+    """Load a fit file with the Garmin SDK, raises ValueError if the file can't be decoded"""
+    data = _read(fit_file)
+    definitions = []
+    other_records = []
+    events = []
+    sessions = []
+    activity = None
+    records = []
+    columns = set()
+    dev_names = {}
+
+    def mesg_listener(mesg_num, message):
+        nonlocal activity
+        mesg_type = Profile["messages"].get(mesg_num)
+        if mesg_type is None:  # unknown message
+            return
+        message = _clean(mesg_num, message, dev_names)
+        if mesg_num == RECORD:
+            columns.update(message.keys())
+            records.append(message)
+        elif mesg_num == EVENT:
+            events.append(message)
+        elif mesg_num == SESSION:
+            sessions.append(message)
+        elif mesg_num == ACTIVITY:
+            activity = message
+        else:
+            other_records.append(message)
+
+    def mesg_definition_listener(mesg_def):
+        fields = Profile["messages"].get(mesg_def["global_mesg_num"], {}).get("fields", {})
+        names = [fields[f["field_id"]]["name"] for f in mesg_def["field_definitions"] if f["field_id"] in fields]
+        definitions.append({"name": names[-1], "is_dev": False} if names else {})
+
+    def field_description_listener(key, developer_data_id, field_description):
+        if field_description.get("field_name") is not None:
+            dev_names[key] = field_description["field_name"]
+
+    stream = Stream.from_byte_array(bytearray(data))
+    decoder = Decoder(stream)
+    _, errors = decoder.read(
+        mesg_listener=mesg_listener,
+        mesg_definition_listener=mesg_definition_listener,
+        field_description_listener=field_description_listener,
+    )
+    if errors:
+        raise ValueError(f"Could not decode the fit file: {errors[0]}") from errors[0]
+    return {
+        "header": header2dict(data),
+        "definitions": definitions,
+        "events": events,
+        "sessions": sessions,
+        "activity": activity,
+        "other_records": other_records,
+        "records": records,
+        "crcs": crc2dict(data),
+        "other": [],
+        "columns": columns,
+    }
 
 
-if __name__ == "__main__":
-    fit2dict("../tests/testdata/outdoor/Morning_Ride.fit")
+def fit2df(fit_file: str | os.PathLike | bytes) -> pd.DataFrame:
+    """Load a fit file into a pandas dataframe with the Garmin SDK"""
+    return records2df(fit2dict(fit_file)["records"])
@@ -0,0 +1,266 @@
+"""
+Split a ride into segments (laps, timer start/stop, distance or time splits) and summarise every segment at once.
+
+A segmentation is the array of the first record row of each segment, segment i is rows [starts[i], starts[i + 1]).
+The summaries are `np.add.reduceat` style reductions over those rows and the power curve points one pass over the 1 Hz
+grid per duration, so a ride with hundreds of laps costs about the same as one with a single lap.
+
+df = fit2df("ride.fit", columnar=True)
+laps = segment_summary(df, lap_starts(df, fitsummary("ride.fit").laps), durations=[60, 300])
+laps[["avg_power", "max_power", "power_60s"]]
+splits = segment_summary(df, distance_starts(df, every=1000), physics=dict(rider_weight=70, bike_weight=8, ...))
+fit2segments("ride.fit", by="timer")  # running and stopped segments, see the `running` column
+"""
+
+from __future__ import annotations
+
+import os
+from collections.abc import Iterable, Sequence
+from datetime import datetime
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+from pyfitness import instrument
+from pyfitness.dynamics import climb_power_terms
+from pyfitness.resample import utc_datetime64, utc_timestamps
+from pyfitness.statistics import seconds_index, to_1hz
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+    from pyfitness.resample import Resampled
+
+# Columns with an avg_ and max_ summary by default, when the ride has them
+SUMMARY_COLUMNS = ("power", "heart_rate", "cadence", "speed", "enhanced_speed", "altitude", "temperature")
+
+# Timer event types that stop the timer, "start" restarts it
+TIMER_STOPS = ("stop", "stop_all", "stop_disable", "stop_disable_all")
+
+
+def lap_starts(df: pd.DataFrame, laps: Sequence[dict]) -> np.ndarray:
+    """First row of each lap with a start_time (`FitSummary.laps`), the rows before the first lap belong to it.
+    A ride without laps is one lap starting at row 0.
+    """
+    times = utc_datetime64(lap["start_time"] for lap in laps if isinstance(lap.get("start_time"), datetime))
+    starts = np.searchsorted(utc_timestamps(df), np.sort(times), side="left")
+    if not len(starts):
+        return np.zeros(1, dtype=np.intp)
+    starts[0] = 0
+    return starts
+
+
+def timer_starts(df: pd.DataFrame, events: Sequence[dict]) -> tuple[np.ndarray, np.ndarray]:
+    """Segments between the timer start and stop events (`FitSummary.get("event")` or `fit2dict(...)["events"]`).
+    A record at the time of a stop belongs to the segment it stops. Returns the starts and a running flag per segment,
+    the ride starts running.
+    """
+    timer = [e for e in events if e.get("event") == "timer" and isinstance(e.get("timestamp"), datetime)]
+    timestamps = utc_timestamps(df)
+    starts = [0]
+    running = [True]
+    for event, time in zip(timer, utc_datetime64(e["timestamp"] for e in timer), strict=True):
+        run = event.get("event_type") not in TIMER_STOPS
+        if run == running[-1]:
+            continue
+        row = int(np.searchsorted(timestamps, time, side="left" if run else "right"))
+        if row >= len(timestamps):  # after the last record
+            break
+        if row > starts[-1]:
+            starts.append(row)
+            running.append(run)
+        elif len(starts) > 1:  # the previous change had no records, undo it
+            starts.pop()
+            running.pop()
+        else:
+            running[-1] = run
+    return np.array(starts, dtype=np.int64), np.array(running, dtype=bool)
+
+
+def _boundaries(total: float, every: float | None, at: Iterable[float] | None) -> np.ndarray:
+    bounds = [np.zeros(1)]
+    if every:
+        bounds.append(np.arange(every, total, every))
+    if at is not None:
+        bounds.append(np.asarray(list(at), dtype=np.float64))
+    return np.unique(np.concatenate(bounds))
+
+
+def time_starts(df: pd.DataFrame, every: float | None = None, at: Iterable[float] | None = None) -> np.ndarray:
+    """A segment every `every` seconds and/or at the `at` seconds from the first sample"""
+    seconds = seconds_index(df)
+    return np.searchsorted(seconds, _boundaries(seconds[-1] if len(seconds) else 0, every, at), side="left")
+
+
+def distance_starts(
+    df: pd.DataFrame, every: float | None = None, at: Iterable[float] | None = None, column: str = "distance"
+) -> np.ndarray:
+    """A segment every `every` meters and/or at the `at` meters from the first distance sample"""
+    distance = np.fmax.accumulate(df[column].to_numpy(dtype=np.float64))
+    known = distance[~np.isnan(distance)]
+    if not len(known):
+        return np.zeros(1, dtype=np.int64)
+    distance = np.nan_to_num(distance - known[0], nan=-np.inf)  # NaN only before the first sample
+    return np.searchsorted(distance, _boundaries(known[-1] - known[0], every, at), side="left")
+
+
+def segment_reduce(values: np.ndarray, starts: np.ndarray) -> dict[str, np.ndarray]:
+    """count (non NaN samples), sum, mean, max and min of `values` in each segment, NaN for segments without samples.
+    One `reduceat` over the whole array per reduction, a sentinel element keeps empty and trailing segments valid.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    known = ~np.isnan(values)
+    count = np.add.reduceat(np.append(known, False).astype(np.int64), starts)
+    total = np.add.reduceat(np.append(np.where(known, values, 0.0), 0.0), starts)
+    top = np.maximum.reduceat(np.append(np.where(known, values, -np.inf), -np.inf), starts)
+    bottom = np.minimum.reduceat(np.append(np.where(known, values, np.inf), np.inf), starts)
+    empty = (np.diff(np.append(starts, len(values))) <= 0) | (count == 0)
+    count[empty] = 0
+    total[empty] = 0.0
+    top[empty] = np.nan
+    bottom[empty] = np.nan
+    mean = total / np.where(empty, np.nan, count)
+    return {"count": count, "sum": total, "mean": mean, "max": top, "min": bottom}
+
+
+def segment_curve(grid: np.ndarray, grid_starts: np.ndarray, durations: Iterable[int]) -> dict[int, np.ndarray]:
+    """Best mean of each duration (seconds) inside each segment of a 1 Hz array, NaN for segments shorter than it.
+    grid_starts: First second of each segment. Windows are taken from one cumulative sum, those crossing the end of
+    their segment are masked and a `np.maximum.reduceat` picks the best per segment.
+    """
+    size = len(grid)
+    csum = np.concatenate([[0.0], np.cumsum(np.asarray(grid, dtype=np.float64))])
+    ends = np.append(grid_starts[1:], size)
+    segment = np.searchsorted(grid_starts, np.arange(size), side="right") - 1
+    window_end = np.where(segment >= 0, ends[np.maximum(segment, 0)], -1)  # seconds before the first segment: none
+    curve = {}
+    for d in durations:
+        best = np.full(size + 1, -np.inf)
+        if 1 <= d <= size:
+            sums = csum[d:] - csum[:-d]
+            best[: size - d + 1] = np.where(np.arange(size - d + 1) + d <= window_end[: size - d + 1], sums, -np.inf)
+        means = np.maximum.reduceat(best, grid_starts) / d
+        means[(np.diff(np.append(grid_starts, size)) < d) | ~np.isfinite(means)] = np.nan  # includes empty segments
+        curve[d] = means
+    return curve
+
+
+def _grid_starts(df: pd.DataFrame, starts: np.ndarray, seconds: np.ndarray, grid: Resampled | None) -> np.ndarray:
+    """First second of each segment on the 1 Hz grid of `to_1hz` or on `grid`, the end of it for empty segments"""
+    n = len(df)
+    first = np.minimum(starts, n - 1)
+    if grid is None:
+        return np.where(starts < n, seconds[first], seconds[-1] + 1)
+    offsets = (utc_timestamps(df)[first] - grid.start) // np.timedelta64(1, "s")
+    return np.where(starts < n, np.clip(offsets, 0, grid.size), grid.size)
+
+
+@instrument.timed("segments.segment_summary")
+def segment_summary(  # noqa: PLR0913 - the options are keyword-only
+    df: pd.DataFrame,
+    starts: Sequence[int] | np.ndarray,
+    *,
+    columns: Iterable[str] | None = None,
+    durations: Iterable[int] = (),
+    curve_columns: Iterable[str] = ("power",),
+    physics: dict[str, float] | None = None,
+    altitudecol: str | None = None,
+    grid: Resampled | None = None,
+) -> pd.DataFrame:
+    """Summary of every segment of a ride dataframe indexed by timestamp (`fit2df`), one row per segment.
+    starts: First row of each segment, non decreasing, from `lap_starts`, `timer_starts`, `time_starts`,
+        `distance_starts` or your own. Rows before starts[0] are in no segment.
+    columns: Columns with an avg_ and max_ value (over the samples with a value), defaults to SUMMARY_COLUMNS.
+    durations: Seconds of the power curve points, `{column}_{duration}s` is the best mean of the column over that
+        duration inside the segment on the 1 Hz grid of `to_1hz` (gaps count as 0).
+    grid: The ride already on the 1 Hz grid (`resample_df(df)`, `Activity.resample`) to take the curves from instead.
+    physics: The climb_power_estimate parameters (rider_weight, bike_weight, wind_speed, wind_direction, temperature,
+        drag_coefficient, frontal_area, rolling_resistance, efficiency_loss), adds the `climb_power_terms` columns.
+    A segment starts at its first sample and ends at the first sample of the next one (its last sample for the last
+    segment), elapsed_time and distance are measured between those.
+    """
+    import pandas as pd
+
+    n = len(df)
+    if not n:
+        raise ValueError("df has no rows")
+    starts = np.clip(np.asarray(starts, dtype=np.int64), 0, n)
+    if np.any(np.diff(starts) < 0):
+        raise ValueError("starts must be non decreasing")
+    first = np.minimum(starts, n - 1)
+    last = np.minimum(np.append(starts[1:], n - 1), n - 1)
+    seconds = seconds_index(df)
+    result = {
+        "start_row": starts,
+        "end_row": np.append(starts[1:], n),
+        "start_time": df.index[first],
+        "end_time": df.index[last],
+        "elapsed_time": seconds[last] - seconds[first],
+        "samples": np.diff(np.append(starts, n)),
+    }
+    if "distance" in df.columns:
+        distance = np.fmax.accumulate(df["distance"].to_numpy(dtype=np.float64))
+        result["distance"] = distance[last] - distance[first]
+    if columns is None:
+        columns = [col for col in SUMMARY_COLUMNS if col in df.columns]
+    for col in columns:
+        reduced = segment_reduce(df[col].to_numpy(dtype=np.float64), starts)
+        result[f"avg_{col}"] = reduced["mean"]
+        result[f"max_{col}"] = reduced["max"]
+    durations = list(durations)
+    if durations:
+        grid_starts = _grid_starts(df, starts, seconds, grid)
+        ride = df if grid is None else grid
+        for col in curve_columns:
+            if col in ride.columns:
+                for d, means in segment_curve(to_1hz(ride, col), grid_starts, durations).items():
+                    result[f"{col}_{d}s"] = means
+    if physics is not None:
+        if "distance" not in result:
+            raise ValueError("physics needs a distance column")
+        altitudecol = altitudecol or ("enhanced_altitude" if "enhanced_altitude" in df.columns else "altitude")
+        altitude = segment_reduce(df[altitudecol].to_numpy(dtype=np.float64), starts)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            terms = climb_power_terms(
+                elapsed_time=result["elapsed_time"].astype(np.float64),
+                distance=result["distance"],
+                accent=altitude["max"] - altitude["min"],
+                avg_elevation=altitude["mean"],
+                **physics,
+            )
+        result.update({name: value for name, value in terms.items() if name not in result})
+    return pd.DataFrame(result, index=pd.RangeIndex(len(starts), name="segment"))
+
+
+def fit2segments(
+    fit_file: str | os.PathLike | bytes,
+    by: str = "lap",
+    every: float | None = None,
+    at: Iterable[float] | None = None,
+    **kwargs,
+) -> pd.DataFrame:
+    """Load a fit file and summarise its segments, see `segment_summary` for the kwargs.
+    by: "lap", "timer" (adds a `running` column), "time" or "distance" (split `every` seconds or meters and/or `at`).
+    """
+    from pyfitness.fd_loader import fit2df
+    from pyfitness.summary import fitsummary
+
+    if not isinstance(fit_file, bytes):
+        with open(fit_file, "rb") as f:
+            fit_file = f.read()
+    df = fit2df(fit_file, columnar=True)
+    running = None
+    if by == "lap":
+        starts = lap_starts(df, fitsummary(fit_file).laps)
+    elif by == "timer":
+        starts, running = timer_starts(df, fitsummary(fit_file).get("event"))
+    elif by == "time":
+        starts = time_starts(df, every, at)
+    elif by == "distance":
+        starts = distance_starts(df, every, at)
+    else:
+        raise ValueError("by must be 'lap', 'timer', 'time' or 'distance'")
+    summary = segment_summary(df, starts, **kwargs)
+    if running is not None:
+        summary.insert(2, "running", running)
+    return summary
@@ -1,58 +1,284 @@
-import pandas as pd
+from __future__ import annotations
 
+from typing import TYPE_CHECKING
 
+import numpy as np
+
+from pyfitness import instrument
+from pyfitness.resample import Resampled, resample
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Start of the grids built by `to_1hz`, only the row numbers are used
+_EPOCH = np.datetime64(0, "s")
+
+# Default mean maximal curve durations: this many log spaced points per factor of 10 of the ride length
+CURVE_POINTS_PER_DECADE = 40
+
+
+def log_durations(n: int, per_decade: int = CURVE_POINTS_PER_DECADE) -> np.ndarray:
+    """Log spaced whole durations from 1 to n samples (both included), about per_decade of them per factor of 10"""
+    if n < 1:
+        return np.zeros(0, dtype=np.int64)
+    points = int(np.ceil(np.log10(n) * per_decade)) + 1
+    return np.unique(np.rint(np.geomspace(1, n, points)).astype(np.int64))
+
+
+def seconds_index(df: pd.DataFrame) -> np.ndarray:
+    """Whole seconds since the first sample, from the `seconds` column or else the timestamp index"""
+    if "seconds" in df.columns:
+        seconds = df["seconds"].to_numpy(dtype=np.float64)
+    else:
+        seconds = (df.index - df.index[0]).total_seconds().to_numpy()
+    return np.rint(seconds - seconds[0]).astype(np.int64)
+
+
+@instrument.timed("statistics.to_1hz")
+def to_1hz(df: pd.DataFrame | Resampled, col: str, fill: str = "zero") -> np.ndarray:
+    """Place a column on a 1 Hz grid starting at the first sample with `resample`, for duplicate seconds the last
+    sample wins and nothing is zeroed for pauses.
+    fill: How seconds without a sample (recording gaps, pauses) and NaN values are filled.
+        "zero" for metrics like power where no data means no effort, "ffill" for levels like altitude and distance
+        that hold the last known value (leading gaps take the first known value), or "linear".
+    A `Resampled` ride (`resample_df`, `Activity.resample`) already is on the grid, its column is returned as is.
+    """
+    if isinstance(df, Resampled):
+        return df.columns[col]
+    values = df[col].to_numpy(dtype=np.float64)
+    return resample(seconds_index(df), {col: values}, _EPOCH, fill={col: fill}, paused_zero=()).columns[col]
+
+
+@instrument.timed("statistics.mean_max_curve")
+def mean_max_curve(
+    values: np.ndarray, durations: np.ndarray | None = None
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Best average of a 1 Hz series for each duration (in samples).
+    Window sums come from one cumulative sum array, `csum[d:] - csum[:-d]` is every window of length d, so each
+    duration costs one subtraction and one argmax over contiguous memory: O(n) per duration, O(n * len(durations)).
+    durations: Defaults to `log_durations(n)`, about 150 points for a 10 hour ride. Every duration from 1 to n
+        (`np.arange(1, n + 1)`) is O(n^2), minutes for a multi hour ride.
+    Returns the durations, the best mean for each and the start index of each best window (end = start + duration).
+    """
+    values = np.asarray(values, dtype=np.float64)
+    n = len(values)
+    if durations is None:
+        durations = log_durations(n)
+    durations = np.asarray(durations, dtype=np.int64)
+    durations = durations[(durations >= 1) & (durations <= n)]
+    csum = np.concatenate([[0.0], np.cumsum(values)])
+    means = np.empty(len(durations), dtype=np.float64)
+    starts = np.empty(len(durations), dtype=np.int64)
+    for i, d in enumerate(durations):
+        sums = csum[d:] - csum[:-d]
+        start = sums.argmax()
+        starts[i] = start
+        means[i] = sums[start] / d
+    return durations, means, starts
+
+
+@instrument.timed("statistics.mean_max")
+def mean_max(
+    df: pd.DataFrame | Resampled, columns: list[str] | None = None, durations: list[int] | np.ndarray | None = None
+) -> dict[str, pd.DataFrame]:
+    """Mean maximal curve (best average for each duration) of each column, on a 1 Hz grid, see `to_1hz`.
+    df: A ride dataframe or an already resampled ride, e.g. `activity.resample()`.
+    durations: Seconds, defaults to log spaced durations from 1 s to the full ride, see `mean_max_curve` for the cost.
+    Returns a dataframe per column indexed by duration with the best `mean` and the `start`, `end` seconds (from the
+    first sample, end exclusive) of the window it came from.
+    mean_max(df, columns=['power', 'heart_rate', 'cadence'], durations=[5, 60, 300, 1200])
+    """
+    import pandas as pd
+
+    if columns is None:
+        columns = ["power", "heart_rate", "cadence"]
+    results = {}
+    for col in columns:
+        if col not in df.columns:
+            continue
+        d, means, starts = mean_max_curve(to_1hz(df, col), durations)
+        results[col] = pd.DataFrame(
+            {"mean": means, "start": starts, "end": starts + d}, index=pd.Index(d, name="duration")
+        )
+    return results
+
+
+@instrument.timed("statistics.max_effort")
 def max_effort(df: pd.DataFrame, **kwargs) -> dict:
-    """Find the max effort for the given metric:
+    """Find the max effort (best average) for the given metric:
     MAX given Metric
     Time: Find max of all metrics.
     max_effort(df, seconds=60, columns=['power', 'heart_rate', 'cadence'])
+    See `mean_max` for the start and end of the effort or many durations at once.
     """
-    if 'columns' in kwargs.keys():  # list of columns to use
-        columns = kwargs['columns']
+    if "columns" in kwargs.keys():  # list of columns to use
+        columns = kwargs["columns"]
     else:
-        columns = ['power', 'altitude', 'distance', 'speed', 'cadence', 'heart_rate', 'slope']
+        columns = ["power", "altitude", "distance", "speed", "cadence", "heart_rate", "slope"]
     results: dict = {}
-    if 'seconds' in kwargs.keys():
+    if "seconds" in kwargs.keys():
+        curves = mean_max(df, columns=columns, durations=[kwargs["seconds"]])
         for col in columns:
-            if col in df.columns:
-                idx = df[col].diff(kwargs['seconds']).idxmax()
-                # TODO: Calculate the start position and values
-                results[col] = df.loc[idx, col]
+            if col in curves and len(curves[col]):
+                results[col] = curves[col]["mean"].iloc[0]
             else:
                 results[col] = None
-    print(results)
     return results
 
 
+@instrument.timed("statistics.climb_curve")
+def climb_curve(df: pd.DataFrame | Resampled, durations: list[int] | np.ndarray) -> dict[str, np.ndarray]:
+    """Max elevation gain (altitude at the end minus altitude at the start) for each duration in seconds.
+    Altitude (enhanced_altitude if present) and distance are put on a 1 Hz grid with `to_1hz(fill="ffill")`, so a
+    window is plain index arithmetic and each duration is one vectorised pass. A `Resampled` ride is used as is.
+    Returns arrays of the durations, gain, start_time, end_time (seconds from the first sample), start_distance and
+    end_distance. Durations longer than the activity are dropped.
+    """
+    altitudevar = "enhanced_altitude" if "enhanced_altitude" in df.columns else "altitude"
+    altitude = to_1hz(df, altitudevar, fill="ffill")
+    distance = to_1hz(df, "distance", fill="ffill")
+    durations = np.asarray(durations, dtype=np.int64)
+    durations = durations[(durations >= 1) & (durations < len(altitude))]
+    gains = np.empty(len(durations), dtype=np.float64)
+    starts = np.empty(len(durations), dtype=np.int64)
+    for i, d in enumerate(durations):
+        diff = altitude[d:] - altitude[:-d]
+        start = diff.argmax()
+        starts[i] = start
+        gains[i] = diff[start]
+    ends = starts + durations
+    return {
+        "durations": durations,
+        "gain": gains,
+        "start_time": starts,
+        "end_time": ends,
+        "start_distance": distance[starts],
+        "end_distance": distance[ends],
+    }
+
+
+@instrument.timed("statistics.max_climb")
 def max_climb(df: pd.DataFrame, seconds: int) -> dict[str, int, int, float, float]:
     """Find the max elevation gain for the given time period
-    Assumes a column named seconds exists in the dataframe
+    Uses the seconds column if it exists, otherwise the timestamp index. See `climb_curve` for many durations at once.
     """
     try:
-        assert ('altitude' in df.columns or 'enhanced_altitude' in df.columns)
-        if 'enhanced_altitude' in df.columns:
-            altitudevar = 'enhanced_altitude'
-        else:
-            altitudevar = 'altitude'
-        assert (all([c in df.columns for c in ['seconds', 'distance']]))
+        assert "altitude" in df.columns or "enhanced_altitude" in df.columns
+        assert "distance" in df.columns
     except AssertionError:
-        print(f"{df.columns}")
-        raise AssertionError("Missing columns in dataframe. Must have 'seconds', 'distance', and 'altitude'")
+        raise AssertionError("Missing columns in dataframe. Must have 'distance', and 'altitude'")
     try:
-        assert (df.seconds.max() - df.seconds.min() > seconds)
+        assert seconds_index(df)[-1] > seconds
     except AssertionError:
         raise AssertionError("Time period is longer than the activity")
     try:
-        assert (df.distance.max() - df.distance.min() > 0)
+        assert df.distance.max() - df.distance.min() > 0
     except AssertionError:
         raise AssertionError("Distance is 0 in data.")
-    end_time, end_distance = df.loc[df[altitudevar].diff(seconds).idxmax(), ['seconds', 'distance']].values
-    start_time = end_time - seconds
-    start_distance = df.loc[df['seconds'] == start_time, 'distance'].values
-    end_distance = df.loc[df['seconds'] + seconds == start_time, 'distance'].values
-    p = ''
-    p += f"{seconds / 60}min: {int(df[altitudevar].diff(seconds).max())}m elevation gain over {int(end_distance - start_distance)}m\n"
-    p += f"-- Starting at {int(end_time - seconds)}sec,  start_distance: {int(start_distance)}m\n"
+    climb = climb_curve(df, [seconds])
+    origin = df["seconds"].iloc[0] if "seconds" in df.columns else 0
+    gain = climb["gain"][0]
+    start_time = climb["start_time"][0] + origin
+    end_time = climb["end_time"][0] + origin
+    start_distance = climb["start_distance"][0]
+    end_distance = climb["end_distance"][0]
+    p = ""
+    p += f"{seconds / 60}min: {int(gain)}m elevation gain over {int(end_distance - start_distance)}m\n"
+    p += f"-- Starting at {int(start_time)}sec,  start_distance: {int(start_distance)}m\n"
     p += f"-- Ending at {int(end_time)}sec, end_distance: {int(end_distance)}m"
-    return {'text': p, 'start_time': start_time, 'end_time': end_time, 'start_distance': start_distance,
-            'end_distance': end_distance}
+    return {
+        "text": p,
+        "gain": gain,
+        "start_time": start_time,
+        "end_time": end_time,
+        "start_distance": start_distance,
+        "end_distance": end_distance,
+    }
+
+
+# Climb categories by score (length in meters * average grade in percent), highest first.
+CLIMB_CATEGORIES = [("HC", 80000), ("1", 64000), ("2", 32000), ("3", 16000), ("4", 8000)]
+
+
+def _zigzag(values: np.ndarray, tolerance: float) -> list[int]:
+    """Alternating valley/peak positions in `values`, ignoring reversals smaller than `tolerance`.
+    The first returned position is always a valley and the last a peak.
+    """
+    turns = []
+    trend = 0  # 1 rising, -1 falling, 0 not known yet
+    low = high = candidate = 0
+    for i in range(1, len(values)):
+        v = values[i]
+        if trend == 0:
+            low = i if v < values[low] else low
+            high = i if v > values[high] else high
+            if values[high] - values[low] >= tolerance:
+                if low < high:
+                    turns.append(low)
+                    trend, candidate = 1, high
+                else:
+                    trend, candidate = -1, low
+        elif trend == 1:
+            if v > values[candidate]:
+                candidate = i
+            elif values[candidate] - v >= tolerance:
+                turns.append(candidate)
+                trend, candidate = -1, i
+        elif v < values[candidate]:
+            candidate = i
+        elif v - values[candidate] >= tolerance:
+            turns.append(candidate)
+            trend, candidate = 1, i
+    if trend == 1:
+        turns.append(candidate)
+    return turns
+
+
+@instrument.timed("statistics.find_climbs")
+def find_climbs(
+    df: pd.DataFrame | Resampled, min_gain: float = 10.0, tolerance: float = 10.0, categorized: bool = True
+) -> pd.DataFrame:
+    """Find all distinct climbs in a ride.
+    A climb runs from a valley to the next peak, descents smaller than `tolerance` meters do not end it.
+    Only the local extremes of the 1 Hz altitude (`to_1hz`, a `Resampled` ride is used as is) are walked in Python,
+    not every sample.
+    min_gain: Smallest elevation gain in meters to count as a climb.
+    categorized: Only return climbs with a category (see CLIMB_CATEGORIES), the rest have category None.
+    Returns a dataframe with one row per climb: start_time, end_time (seconds from the first sample), start_distance,
+    end_distance, gain, length, grade (percent), score and category.
+    """
+    import pandas as pd
+
+    altitudevar = "enhanced_altitude" if "enhanced_altitude" in df.columns else "altitude"
+    altitude = to_1hz(df, altitudevar, fill="ffill")
+    distance = to_1hz(df, "distance", fill="ffill")
+    columns = ["start_time", "end_time", "start_distance", "end_distance", "gain", "length", "grade", "score"]
+    if len(altitude) <= 1:
+        return pd.DataFrame(columns=[*columns, "category"])
+    # Local extremes: where the sign of the (non flat) slope changes, plus both ends.
+    step = np.sign(np.diff(altitude))
+    moving = np.flatnonzero(step)
+    extremes = moving[np.flatnonzero(np.diff(step[moving])) + 1] if len(moving) else moving
+    extremes = np.unique(np.concatenate([[0], extremes, [len(altitude) - 1]]))
+    turns = extremes[_zigzag(altitude[extremes], tolerance)]
+    starts, ends = turns[0::2], turns[1::2]
+    starts = starts[: len(ends)]
+    climbs = pd.DataFrame(
+        {
+            "start_time": starts,
+            "end_time": ends,
+            "start_distance": distance[starts],
+            "end_distance": distance[ends],
+            "gain": altitude[ends] - altitude[starts],
+        }
+    )
+    climbs["length"] = climbs.end_distance - climbs.start_distance
+    climbs["grade"] = climbs.gain / climbs.length.where(climbs.length > 0) * 100
+    climbs["score"] = climbs.length * climbs.grade
+    thresholds = [t for _, t in CLIMB_CATEGORIES]
+    labels = [c for c, _ in CLIMB_CATEGORIES]
+    climbs["category"] = np.select([climbs.score >= t for t in thresholds], labels, default=None)
+    climbs = climbs[climbs.gain >= min_gain]
+    if categorized:
+        climbs = climbs[climbs.category.notna()]
+    return climbs.reset_index(drop=True)
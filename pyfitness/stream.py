@@ -0,0 +1,386 @@
+"""
+Read the record messages of a fit file in fixed size batches with bounded memory.
+
+A `RecordStream` remembers the byte offset of the last complete message it decoded, plus the definition messages
+needed to decode what follows, so a file that is still being written (a live upload spool) can be tailed by calling
+`batches()` again after more data has been appended.
+
+stream = RecordStream("ride.fit", batch_size=4096)
+for df in stream.batches():
+    ...
+# later, after the file has grown
+for df in stream.batches():
+    ...
+
+Only the first FIT file of a chained file is read. When resuming, compressed timestamp headers and accumulated fields
+restart from zero because the data messages before the offset are not decoded again.
+
+`fit2csv_stream` and `fit2parquet_stream` export the records batch by batch, the full dataframe is never built.
+"""
+
+from __future__ import annotations
+
+import io
+import os
+import struct
+from collections import Counter
+from collections.abc import Container, Iterator
+from typing import IO, TYPE_CHECKING
+
+import fitdecode
+import numpy as np
+from fitdecode import profile
+
+from pyfitness.fd_loader import ColumnBuilder, columns2df, format_dates, text_output
+
+if TYPE_CHECKING:
+    import pandas as pd
+    import pyarrow as pa
+
+# Messages that change how the following messages are decoded, replayed in front of the data when resuming.
+_STATE_MESSAGES = ("developer_data_id", "field_description")
+_STATE_MESG_NUMS = (profile.MESG_NUM_DEVELOPER_DATA_ID, profile.MESG_NUM_FIELD_DESCRIPTION)
+RECORD_MESG_NUM = 20
+
+# A FIT file header is 12 bytes, or 14 with a CRC of the header in bytes 12-13
+_HEADER_SIZE = 12
+_HEADER_SIZE_CRC = 14
+
+
+def _read_header(f: IO[bytes]) -> bytearray | None:
+    """The FIT file header at the start of f, None if it is not a fit file or the header is not completely written"""
+    header = f.read(_HEADER_SIZE_CRC)
+    if len(header) < _HEADER_SIZE or header[8:12] != b".FIT" or len(header) < header[0]:
+        return None
+    return bytearray(header[: header[0]])
+
+
+def _header_for(header: bytearray, data_size: int) -> bytes:
+    """The header with its data size set to data_size and no header CRC to check"""
+    struct.pack_into("<I", header, 4, data_size)
+    if len(header) >= _HEADER_SIZE_CRC:
+        header[12:14] = b"\x00\x00"
+    return bytes(header)
+
+
+class _SpliceReader(object):
+    """File-like object reading `prefix` and then at most `size` bytes of `fd`"""
+
+    def __init__(self, prefix: bytes, fd, size: int):
+        self.prefix = memoryview(prefix)
+        self.fd = fd
+        self.size = size
+
+    def read(self, n: int = -1) -> bytes:
+        if n < 0:
+            n = len(self.prefix) + self.size
+        out = bytes(self.prefix[:n])
+        self.prefix = self.prefix[len(out) :]
+        n = min(n - len(out), self.size)
+        if n > 0:
+            data = self.fd.read(n)
+            self.size -= len(data)
+            out += data
+        return out
+
+
+class RecordStream(object):
+    """Iterate over the record messages of a fit file in batches, resumable from a byte offset.
+    batch_size: Max number of records in a batch.
+    as_frame: Yield dataframes indexed by timestamp like `fit2df`, otherwise dicts of NumPy arrays like `fit2columns`.
+    offset, state: Resume point, the `offset` and `state` attributes of a previous stream over the same file.
+    """
+
+    def __init__(
+        self,
+        fit_file: str | os.PathLike,
+        batch_size: int = 4096,
+        as_frame: bool = True,
+        offset: int = 0,
+        state: bytes = b"",
+    ):
+        self.fit_file = fit_file
+        self.batch_size = batch_size
+        self.as_frame = as_frame
+        self.offset = offset  # end of the last complete message that was decoded, 0 before the header is read
+        self.state = state  # raw definition and developer field messages seen before `offset`
+        self.finished = False  # the end of the FIT data (CRC footer) was reached
+
+    def _finish_batch(self, builder: ColumnBuilder) -> pd.DataFrame | dict[str, np.ndarray]:
+        columns = builder.finish()
+        if not self.as_frame:
+            return columns
+        df = columns2df(columns)
+        if "timestamp" in df.columns:
+            df.set_index("timestamp", inplace=True)
+        df.dropna(how="all", axis="columns", inplace=True)
+        df.dropna(how="all", axis="index", inplace=True)
+        return df
+
+    def batches(self) -> Iterator[pd.DataFrame | dict[str, np.ndarray]]:
+        """Yield the records after `offset` in batches, stops at the end of the data currently in the file"""
+        if self.finished:
+            return
+        with open(self.fit_file, "rb") as f:
+            file_size = os.fstat(f.fileno()).st_size
+            header = _read_header(f)
+            if header is None:
+                return
+            header_size = len(header)
+            body_size = struct.unpack_from("<I", header, 4)[0]
+            self.offset = max(self.offset, header_size)
+            complete = body_size > 0 and file_size >= header_size + body_size + 2
+            # still being written: read up to the end of the file
+            remaining = header_size + body_size - self.offset if complete else file_size - self.offset
+            # Point the header at the state messages followed by the data after offset.
+            header = _header_for(header, len(self.state) + remaining)
+            f.seek(self.offset)
+            splice = len(header) + len(self.state)
+            reader = fitdecode.FitReader(
+                _SpliceReader(header + self.state, f, remaining + 2 if complete else remaining),
+                check_crc=fitdecode.CrcCheck.DISABLED,
+                keep_raw_chunks=True,
+            )
+            builder = ColumnBuilder(min(self.batch_size, 1024))
+            try:
+                for frame in reader:
+                    if isinstance(frame, fitdecode.records.FitCRC):
+                        self.finished = complete
+                        break
+                    if isinstance(frame, fitdecode.records.FitHeader) or frame.chunk.offset < splice:
+                        continue  # the header and the replayed state messages
+                    if isinstance(frame, fitdecode.records.FitDefinitionMessage) or frame.name in _STATE_MESSAGES:
+                        self.state += frame.chunk.bytes
+                    elif frame.name == "record":
+                        builder.append(frame)
+                    self.offset += len(frame.chunk.bytes)
+                    if builder.n == self.batch_size:
+                        yield self._finish_batch(builder)
+                        builder = ColumnBuilder(min(self.batch_size, 1024))
+            except fitdecode.FitEOFError:
+                pass  # a message is only partly written, it is read again on the next call
+            finally:
+                reader.close()
+            if builder.n:
+                yield self._finish_batch(builder)
+
+
+def iter_records(
+    fit_file: str | os.PathLike, batch_size: int = 4096, as_frame: bool = True
+) -> Iterator[pd.DataFrame | dict[str, np.ndarray]]:
+    """Yield the records of a fit file in batches of `batch_size` rows, see `RecordStream`"""
+    return RecordStream(fit_file, batch_size=batch_size, as_frame=as_frame).batches()
+
+
+def _run_length(data: bytes, pos: int, end: int, size: int) -> int:
+    """Number of consecutive messages of `size` bytes from pos that have the same (normal) header byte"""
+    header = data[pos : pos + 1]
+    available = (end - pos) // size
+    count = 1
+    while count < available:
+        headers = data[pos + count * size : pos + min(available, count + 256) * size : size]
+        same = len(headers) - len(headers.lstrip(header))
+        count += same
+        if same < len(headers):
+            break
+    return count
+
+
+def walk_messages(data: bytes, start: int, end: int) -> Iterator[tuple[int, int, bool, int, int]]:
+    """Yield (offset, size, is_definition, global message number, count) of the messages in data[start:end], using the
+    definition messages to step over data messages without decoding them. `count` consecutive data messages of `size`
+    bytes each with the same header (the same definition) are yielded once, found with a bytes scan instead of a
+    Python loop. Stops at a truncated message.
+    """
+    layouts = {}  # local message number -> (global message number, data message size)
+    pos = start
+    while pos < end:
+        header = data[pos]
+        if header & 0x80:  # compressed timestamp header
+            global_num, size = layouts[(header >> 5) & 0x03]
+            size += 1
+            is_definition = False
+        elif header & 0x40:
+            if pos + 6 > end:
+                return
+            global_num = struct.unpack_from(">H" if data[pos + 2] else "<H", data, pos + 3)[0]
+            size = 6 + 3 * data[pos + 5]
+            data_size = sum(data[pos + 7 : pos + size : 3])
+            if header & 0x20:  # developer fields
+                if pos + size >= end:
+                    return
+                n_dev = data[pos + size]
+                data_size += sum(data[pos + size + 2 : pos + size + 1 + 3 * n_dev : 3])
+                size += 1 + 3 * n_dev
+            layouts[header & 0x0F] = (global_num, data_size)
+            is_definition = True
+        else:
+            global_num, size = layouts[header & 0x0F]
+            size += 1
+            if pos + size > end:
+                return
+            count = _run_length(data, pos, end, size)
+            yield pos, size, False, global_num, count
+            pos += size * count
+            continue
+        if pos + size > end:
+            return
+        yield pos, size, is_definition, global_num, 1
+        pos += size
+
+
+def fit_body(data: bytes) -> tuple[int, int]:
+    """Start and end of the messages of the first FIT file in data"""
+    if len(data) < _HEADER_SIZE or data[8:12] != b".FIT":
+        raise ValueError("not a fit file")
+    header_size = data[0]
+    return header_size, min(len(data), header_size + struct.unpack_from("<I", data, 4)[0])
+
+
+def fit_data(header: bytes, messages: list[bytes]) -> bytes:
+    """A FIT file of the messages, readable by fitdecode with CRC checks disabled"""
+    body = b"".join(messages)
+    return _header_for(bytearray(header), len(body)) + body + b"\x00\x00"
+
+
+def filter_messages(data: bytes, keep: Container[int]) -> tuple[bytes, Counter]:
+    """Reduce the first FIT file in `data` to the messages whose global message number is in `keep` and one copy of
+    each other definition message layout (the other definitions only matter to `message_fields`), readable by
+    fitdecode with CRC checks disabled. Also returns the number of data messages dropped per global message number.
+    """
+    start, end = fit_body(data)
+    kept = []
+    layouts = set()
+    dropped = Counter()
+    for offset, size, is_definition, global_num, count in walk_messages(data, start, end):
+        if global_num in keep:
+            kept.append(data[offset : offset + size * count])
+        elif not is_definition:
+            dropped[global_num] += count
+        elif (layout := (data[offset] & 0x20, data[offset + 1 : offset + size])) not in layouts:
+            layouts.add(layout)  # a new layout, whichever local message number it is defined on
+            kept.append(data[offset : offset + size])
+    return fit_data(data[:start], kept), dropped
+
+
+def message_fields(definition: fitdecode.records.FitDefinitionMessage) -> list[str]:
+    """Names of the fields fitdecode decodes from the data messages of a definition, in order"""
+    names = []
+    for field_def in definition.all_field_defs:
+        field = field_def.field
+        for component in (field.components or []) if field is not None else []:
+            names.append(definition.mesg_type.fields[component.def_num].name)  # fitdecode adds them before the field
+        names.append(field_def.name)
+    return names
+
+
+def record_columns(fit_file: str | os.PathLike) -> list[str]:
+    """Names of the record fields a fit file can contain, in `fit2df` order. Only the definition and developer field
+    messages are decoded, so this is much cheaper than reading the records.
+    """
+    with open(fit_file, "rb") as f:
+        data, _ = filter_messages(f.read(), _STATE_MESG_NUMS)
+    names = {}
+    with fitdecode.FitReader(data, check_crc=fitdecode.CrcCheck.DISABLED) as reader:
+        for frame in reader:
+            if isinstance(frame, fitdecode.records.FitDefinitionMessage) and frame.global_mesg_num == RECORD_MESG_NUM:
+                names.update(dict.fromkeys(message_fields(frame)))
+    return [name for name in names if "unknown_" not in name and name != "timestamp"]
+
+
+def _export_batches(fit_file: str | os.PathLike, columns: list[str], batch_size: int) -> Iterator[pd.DataFrame]:
+    """Record batches indexed by timestamp with the given columns. Object columns are not converted per batch (as
+    `columns2df` does), so a value is written the same way whichever batch it is in.
+    """
+    import pandas as pd
+
+    for batch in RecordStream(fit_file, batch_size=batch_size, as_frame=False).batches():
+        df = pd.DataFrame(batch)
+        if "timestamp" in df.columns:
+            df = df.set_index(pd.DatetimeIndex(df.pop("timestamp"), name="timestamp"))
+        yield df.dropna(how="all").reindex(columns=columns)
+
+
+def fit2csv_stream(
+    fit_file: str | os.PathLike, outfile: str | os.PathLike | IO | None = None, batch_size: int = 65536
+) -> bytes | None:
+    """Decode a fit file straight to csv, one batch of records at a time. Same layout as `fd_loader.fit2csv` except
+    that columns with no values are kept. Returns the csv bytes when outfile is None.
+    """
+    import pandas as pd
+
+    if outfile is None:
+        buffer = io.BytesIO()
+        fit2csv_stream(fit_file, buffer, batch_size)
+        return buffer.getvalue()
+    columns = record_columns(fit_file)
+    with text_output(outfile) as f:
+        header = True
+        for df in _export_batches(fit_file, columns, batch_size):
+            format_dates(df).to_csv(f, header=header)
+            header = False
+        if header:  # no records
+            pd.DataFrame(columns=["timestamp", *columns]).to_csv(f, index=False)
+
+
+def _typed_batch(df: pd.DataFrame, schema: pa.Schema) -> pd.DataFrame:
+    """The batch with its columns converted to the float64 or string fields of the schema, raises ValueError for a
+    value of a float64 column that is not a number"""
+    import pandas as pd
+    import pyarrow as pa
+
+    columns = {}
+    for field in schema:
+        if field.name == "timestamp":
+            continue
+        values = df[field.name]
+        if pa.types.is_floating(field.type):
+            columns[field.name] = pd.to_numeric(values, errors="coerce").astype("float64")
+            lost = columns[field.name].isna() & values.notna()
+            if lost.any():
+                raise ValueError(
+                    f"{field.name} is a number column of the parquet schema but has {values[lost].iloc[0]!r} at "
+                    f"{values[lost].index[0]}, pass a schema with a string field for it"
+                )
+        else:
+            columns[field.name] = values.map(str, na_action="ignore")
+    return pd.DataFrame(columns, index=df.index)
+
+
+def fit2parquet_stream(
+    fit_file: str | os.PathLike,
+    outfile: str | os.PathLike | IO,
+    batch_size: int = 65536,
+    schema: pa.Schema | None = None,
+) -> pa.Schema | None:
+    """Decode a fit file straight to a parquet file, one row group per batch of records. Requires pyarrow, pip install
+    pyfitness[parquet].
+    schema: A timestamp field and a float64 or string field per record column. By default it is taken from the first
+        batch: numeric columns (and columns without values) are stored as float64 and the others as strings. Raises
+        ValueError when a later batch has a value that is not a number in a float64 column, instead of dropping it.
+    Returns the schema, to pass for files of the same device, None when the file has no records.
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ModuleNotFoundError as e:
+        raise ImportError("fit2parquet_stream needs pyarrow, pip install pyfitness[parquet]") from e
+
+    columns = record_columns(fit_file) if schema is None else [c for c in schema.names if c != "timestamp"]
+    writer = None
+    try:
+        for df in _export_batches(fit_file, columns, batch_size):
+            if schema is None:
+                numeric = {c for c in columns if df[c].dtype.kind in "biuf"}
+                schema = pa.schema(
+                    [pa.field("timestamp", pa.timestamp("s", tz="UTC"))]
+                    + [pa.field(c, pa.float64() if c in numeric else pa.string()) for c in columns]
+                )
+            typed = _typed_batch(df, schema)
+            if writer is None:
+                writer = pq.ParquetWriter(outfile, schema)
+            writer.write_table(pa.Table.from_pandas(typed.reset_index(), schema=schema, preserve_index=False))
+    finally:
+        if writer is not None:
+            writer.close()
+    return schema
@@ -0,0 +1,179 @@
+"""
+Summarise a fit file without decoding its records.
+
+The definition messages give the size of every data message, so the messages that are not part of the summary
+(records, events, device_info, hrv, ...) are counted and stepped over while file_id, session, lap and activity are
+decoded. The event types are read straight from the event messages with their definition layout.
+
+summary = fitsummary("ride.fit")
+summary.message_counts["record"], summary.sessions[0]["total_elapsed_time"]
+print(summary2markdown(summary))
+"""
+
+import os
+from collections import Counter
+from collections.abc import Iterable
+from typing import Any, NamedTuple
+
+import fitdecode
+from fitdecode import profile
+
+from pyfitness.fd_loader import slots2dict
+from pyfitness.stream import RECORD_MESG_NUM, fit_body, fit_data, message_fields, walk_messages
+
+# Messages decoded by default, the others are only counted
+SUMMARY_MESSAGES = ("file_id", "activity", "session", "lap")
+EVENT_MESG_NUM = 21
+EVENT_FIELD_NUM = 0  # the event field (an enum, one byte) of the event message
+INVALID_ENUM = 0xFF
+
+
+class FitSummary(NamedTuple):
+    """What `fitfileinfo` reports about a fit file. `messages` are the decoded messages in file order as (name, [(field,
+    value), ...]), the messages in `message_counts` but not in `messages` were only counted.
+    """
+
+    header: dict
+    message_counts: dict[str, int]
+    record_fields: list[str]
+    event_types: list
+    messages: list[tuple[str, list[tuple[str, Any]]]]
+
+    def get(self, name: str) -> list[dict]:
+        """Fields of the decoded messages called `name`, the first value of a repeated field name like `frame2dict`"""
+        return [_first_values(fields) for message, fields in self.messages if message == name]
+
+    @property
+    def sessions(self) -> list[dict]:
+        return self.get("session")
+
+    @property
+    def laps(self) -> list[dict]:
+        return self.get("lap")
+
+    @property
+    def activities(self) -> list[dict]:
+        return self.get("activity")
+
+
+def _first_values(fields: list[tuple[str, Any]]) -> dict:
+    first = {}
+    for name, value in fields:
+        first.setdefault(name, value)
+    return first
+
+
+def _message_name(global_num: int) -> str:
+    mesg_type = profile.MESSAGE_TYPES.get(global_num)
+    return mesg_type.name if mesg_type is not None else f"unknown_{global_num}"
+
+
+def _field_offset(data: bytes, definition: int, field_num: int) -> int | None:
+    """Offset of a field in the data messages of the definition message at `definition`, None if it has no such field"""
+    offset = 0
+    for pos in range(definition + 6, definition + 6 + 3 * data[definition + 5], 3):
+        if data[pos] == field_num:
+            return offset
+        offset += data[pos + 1]
+    return None
+
+
+def _scan(data: bytes, keep: set[int]) -> tuple[bytes, Counter, list]:
+    """Like `stream.filter_messages`, also returns the event types of the event messages in file order"""
+    start, end = fit_body(data)
+    kept = []
+    layouts = set()
+    dropped = Counter()
+    event_offsets = {}  # local message number -> offset of the event field in its data messages
+    events = {}
+    for offset, size, is_definition, global_num, count in walk_messages(data, start, end):
+        header = data[offset]
+        local = (header >> 5) & 0x03 if header & 0x80 else header & 0x0F
+        if is_definition:
+            is_event = global_num == EVENT_MESG_NUM
+            event_offsets[local] = _field_offset(data, offset, EVENT_FIELD_NUM) if is_event else None
+        elif global_num == EVENT_MESG_NUM and event_offsets[local] is not None:
+            events.update(dict.fromkeys(data[offset + 1 + event_offsets[local] : offset + size * count : size]))
+        if global_num in keep:
+            kept.append(data[offset : offset + size * count])
+        elif not is_definition:
+            dropped[global_num] += count
+        elif (layout := (header & 0x20, data[offset + 1 : offset + size])) not in layouts:
+            layouts.add(layout)  # one copy of each layout for the record fields
+            kept.append(data[offset : offset + size])
+    names = profile.MESSAGE_TYPES[EVENT_MESG_NUM].fields[EVENT_FIELD_NUM].type.enum
+    event_types = [names.get(event, event) for event in events if event != INVALID_ENUM]
+    return fit_data(data[:start], kept), dropped, event_types
+
+
+def fitsummary(
+    fit: str | os.PathLike | bytes | fitdecode.FitReader, decode: Iterable[str] | None = SUMMARY_MESSAGES
+) -> FitSummary:
+    """Summary of the first fit file in a path or bytes.
+    decode: The messages decoded into `messages`, None for all but the records and events. The other messages are only
+        counted from the definition layout, stepping over runs of records with a bytes scan, so the size of the file
+        barely matters (under 40 ms for the testdata files). Each decoded message adds about 0.25 ms: a ride with 180
+        laps takes about 50 ms, and decode=None is slower on files with thousands of device_info or hrv messages.
+        A FitReader is read in full, nothing can be skipped.
+    """
+    if decode is None:
+        decode = {mesg_type.name for mesg_type in profile.MESSAGE_TYPES.values()} - {"record", "event"}
+    decode = set(decode)
+    counts = Counter()
+    from_reader = isinstance(fit, fitdecode.FitReader)
+    if from_reader:
+        reader = fit
+        header = None
+        event_types = {}  # from the decoded event messages
+    else:
+        if not isinstance(fit, bytes | bytearray | memoryview):
+            with open(fit, "rb") as f:
+                fit = f.read()
+        with fitdecode.FitReader(fit) as header_reader:
+            header = slots2dict(next(iter(header_reader)))
+        keep = {num for num, mesg_type in profile.MESSAGE_TYPES.items() if mesg_type.name in decode}
+        keep |= {profile.MESG_NUM_DEVELOPER_DATA_ID, profile.MESG_NUM_FIELD_DESCRIPTION}  # to decode developer fields
+        data, dropped, event_types = _scan(fit, keep)
+        counts.update({_message_name(num): n for num, n in dropped.items()})
+        reader = fitdecode.FitReader(data, check_crc=fitdecode.CrcCheck.DISABLED)
+    record_fields = {}
+    messages = []
+    with reader:
+        for frame in reader:
+            match frame:
+                case fitdecode.records.FitHeader() if header is None:
+                    header = slots2dict(frame)
+                case fitdecode.records.FitDefinitionMessage() if frame.global_mesg_num == RECORD_MESG_NUM:
+                    record_fields.update(dict.fromkeys(message_fields(frame)))
+                case fitdecode.records.FitDataMessage():
+                    counts[frame.name] += 1
+                    if from_reader and frame.name == "event":
+                        event_types.setdefault(frame.get_value("event", fallback=None), None)
+                    if frame.name in decode:
+                        messages.append((frame.name, [(field.name, field.value) for field in frame.fields]))
+                case fitdecode.records.FitCRC():
+                    break  # only the first file of a chained file
+    record_fields = [name for name in record_fields if "unknown_" not in name]
+    return FitSummary(header, dict(counts), record_fields, list(event_types), messages)
+
+
+def summary2markdown(summary: FitSummary, show_unkown: bool = False) -> str:
+    """Markdown report of a `FitSummary`"""
+    lines = ["# Fit File details", "", "### Header:"]
+    lines.extend(f"- {k}: {v}" for k, v in summary.header.items())
+    for name, fields in summary.messages:
+        if name in ("activity", "session", "lap"):
+            lines.append(f"### {name}")
+            lines.extend(f"- {k}: {v}" for k, v in _first_values(fields).items() if "unknown_" not in k.lower())
+        elif name not in ("record", "event") and (show_unkown or "unknown_" not in name.lower()):
+            lines.append(f"### Data type: {name.upper()}")
+            lines.extend(f"- {k}: {v}" for k, v in fields if show_unkown or "unknown_" not in k.lower())
+    counts = summary.message_counts
+    lines.append("### Data Records:")
+    for name in ("record", "event", "session", "activity", "lap"):
+        lines.append(f"- {name}s: {counts.get(name, 0)}")
+    lines.append("###Record Fields:")
+    lines.extend(f"- {field}" for field in summary.record_fields)
+    lines.append("###Event Types:")
+    lines.extend(f"- {event_type}" for event_type in summary.event_types)
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,281 @@
+"""
+GPS track processing: distance from positions, elevation and grade smoothing, and a streaming GPX reader.
+
+Everything works on NumPy arrays of a whole track (or a batch of points), positions are in degrees or FIT semicircles.
+Grade is rise over run measured between the points half a distance window before and after each point, so a stop or
+a GPS jump does not divide by a near zero distance step like `altitude.diff() / distance.diff()`.
+
+arrays = track_arrays(fit2df("ride.fit"), smoothing="gaussian", window=50, grade_window=100)
+arrays["distance"], arrays["altitude"], arrays["grade"]
+df = gpx2df("route.gpx")  # position_lat/position_long in semicircles, altitude, distance like fit2df
+for points in iter_gpx("huge.gpx", batch_size=100_000): ...
+"""
+
+from __future__ import annotations
+
+import os
+import warnings
+import xml.etree.ElementTree as ET
+from collections.abc import Iterator
+from datetime import UTC, datetime
+from typing import IO, TYPE_CHECKING
+
+import numpy as np
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Degrees per FIT semicircle, a position is an int32 where 2^31 semicircles are 180 degrees
+SEMICIRCLE = 180 / 2**31
+
+# Mean earth radius in meters
+EARTH_RADIUS = 6371008.8
+
+# GPX trkpt extension elements (Garmin TrackPointExtension and the usual power element) -> fit2df column
+GPX_EXTENSIONS = {"hr": "heart_rate", "cad": "cadence", "power": "power", "atemp": "temperature"}
+
+
+def semicircles_to_degrees(values: np.ndarray) -> np.ndarray:
+    return np.asarray(values, dtype=np.float64) * SEMICIRCLE
+
+
+def degrees_to_semicircles(values: np.ndarray) -> np.ndarray:
+    return np.asarray(values, dtype=np.float64) / SEMICIRCLE
+
+
+def haversine(lat: np.ndarray, lon: np.ndarray, semicircles: bool = False) -> np.ndarray:
+    """Great circle distance in meters from each point to the next, one fewer than the points.
+    Steps from or to a point without a position (NaN) are NaN.
+    """
+    scale = np.radians(SEMICIRCLE) if semicircles else np.radians(1.0)
+    lat = np.asarray(lat, dtype=np.float64) * scale
+    lon = np.asarray(lon, dtype=np.float64) * scale
+    dlat = np.diff(lat)
+    dlon = np.diff(lon)
+    h = np.sin(dlat / 2) ** 2 + np.cos(lat[:-1]) * np.cos(lat[1:]) * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.minimum(h, 1.0)))
+
+
+def track_distance(lat: np.ndarray, lon: np.ndarray, semicircles: bool = False) -> np.ndarray:
+    """Cumulative distance in meters from the first point, the distance holds over points without a position"""
+    if not len(lat):
+        return np.zeros(0)
+    return np.concatenate([[0.0], np.cumsum(np.nan_to_num(haversine(lat, lon, semicircles)))])
+
+
+def _kernel(method: str, width: int) -> np.ndarray:
+    if method == "mean":
+        return np.ones(width)
+    if method == "gaussian":  # the window is +-2 standard deviations
+        x = np.arange(width) - (width - 1) / 2
+        return np.exp(-0.5 * (x / max(width / 4, 1e-9)) ** 2)
+    raise ValueError(f"Unknown smoothing {method!r}, expected 'mean', 'gaussian' or 'median'")
+
+
+def smooth(values: np.ndarray, window: int, method: str = "gaussian") -> np.ndarray:
+    """Centered moving filter over `window` samples (rounded up to odd): "mean", "gaussian" (weights fall to about
+    0.14 at the edges of the window) or "median". NaN samples are left out, the window shrinks at both ends.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    width = max(int(window), 1) | 1  # odd, centered on the sample
+    if width == 1 or len(values) <= 1:
+        return values.copy()
+    known = ~np.isnan(values)
+    if method == "median":
+        padded = np.pad(values, width // 2, constant_values=np.nan)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)  # all NaN windows
+            return np.nanmedian(np.lib.stride_tricks.sliding_window_view(padded, width), axis=1)
+    kernel = _kernel(method, width)
+    total = np.convolve(np.where(known, values, 0.0), kernel, mode="same")
+    weight = np.convolve(known.astype(np.float64), kernel, mode="same")
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(weight > 0, total / weight, np.nan)
+
+
+def smooth_over_distance(
+    values: np.ndarray, distance: np.ndarray, window: float, method: str = "gaussian", step: float = 1.0
+) -> np.ndarray:
+    """`smooth` over a window in meters instead of samples, so slow and fast stretches are smoothed the same.
+    The values are interpolated on a `step` meter grid, filtered and read back at each point's distance.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    distance = np.fmax.accumulate(np.asarray(distance, dtype=np.float64))
+    known = ~np.isnan(values) & ~np.isnan(distance)
+    if known.sum() <= 1:
+        return values.copy()
+    start, end = distance[known][0], distance[known][-1]
+    grid = np.arange(start, end + step, step)
+    filtered = smooth(np.interp(grid, distance[known], values[known]), round(window / step), method)
+    smoothed = np.interp(distance, grid, filtered)
+    smoothed[np.isnan(distance)] = np.nan
+    return smoothed
+
+
+def grade(altitude: np.ndarray, distance: np.ndarray, window: float = 50.0) -> np.ndarray:
+    """Rise over run (0.05 is 5%) between window / 2 meters before and after each point, the run is shorter at the
+    ends of the track. Points are read off the track by interpolation so the grade is not sensitive to the sampling,
+    0 where the track has no length.
+    """
+    altitude = np.asarray(altitude, dtype=np.float64)
+    distance = np.fmax.accumulate(np.asarray(distance, dtype=np.float64))
+    known = ~np.isnan(altitude) & ~np.isnan(distance)
+    result = np.full(len(altitude), np.nan)
+    if known.sum() <= 1:
+        return np.where(known, 0.0, result)
+    xp, fp = distance[known], altitude[known]
+    lo = np.clip(distance - window / 2, xp[0], xp[-1])
+    hi = np.clip(distance + window / 2, xp[0], xp[-1])
+    run = hi - lo
+    rise = np.interp(hi, xp, fp) - np.interp(lo, xp, fp)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        result = np.where(run > 0, rise / run, 0.0)
+    result[np.isnan(distance)] = np.nan
+    return result
+
+
+def track_arrays(  # noqa: PLR0913 - the options are keyword-only
+    df: pd.DataFrame,
+    *,
+    smoothing: str | None = "gaussian",
+    window: float = 50.0,
+    grade_window: float = 100.0,
+    altitudecol: str | None = None,
+    recompute_distance: bool = False,
+) -> dict[str, np.ndarray]:
+    """Distance, smoothed altitude and grade of a `fit2df` or `gpx2df` dataframe.
+    distance: The distance column or, without one (or with recompute_distance), the haversine distance of the
+        position_lat/position_long semicircles.
+    smoothing: `smooth_over_distance` method for the altitude over `window` meters, None keeps the raw altitude.
+    grade_window: Meters, see `grade`.
+    """
+    if "distance" in df.columns and not recompute_distance:
+        distance = df["distance"].to_numpy(dtype=np.float64)
+    elif "position_lat" in df.columns and "position_long" in df.columns:
+        lat = df["position_lat"].to_numpy(dtype=np.float64)
+        lon = df["position_long"].to_numpy(dtype=np.float64)
+        distance = track_distance(lat, lon, semicircles=True)
+    else:
+        raise ValueError("The dataframe needs a distance column or position_lat and position_long")
+    altitudecol = altitudecol or ("enhanced_altitude" if "enhanced_altitude" in df.columns else "altitude")
+    altitude = df[altitudecol].to_numpy(dtype=np.float64)
+    if smoothing is not None:
+        altitude = smooth_over_distance(altitude, distance, window, smoothing)
+    return {"distance": distance, "altitude": altitude, "grade": grade(altitude, distance, grade_window)}
+
+
+def _local(tag: str) -> str:
+    return tag.rpartition("}")[2]
+
+
+def _gpx_times(times: list[str | None]) -> np.ndarray:
+    """UTC datetime64[ms] of ISO 8601 strings, NaT where missing"""
+    stripped = [t[:-1] if t and t.endswith("Z") else (t or "NaT") for t in times]
+    # numpy only warns on a UTC offset, times with one are converted to naive UTC first
+    naive = [_utc(t) if "+" in t[10:] or "-" in t[10:] else t for t in stripped]
+    return np.array(naive, dtype="datetime64[ms]")
+
+
+def _utc(time: str) -> datetime:
+    """Naive UTC datetime of an ISO 8601 string with a UTC offset"""
+    return datetime.fromisoformat(time).astimezone(UTC).replace(tzinfo=None)
+
+
+def _gpx_batch(lat: list, lon: list, ele: list, time: list, extensions: dict[str, list]) -> dict[str, np.ndarray]:
+    batch = {
+        "timestamp": _gpx_times(time),
+        "lat": np.array(lat, dtype=np.float64),
+        "lon": np.array(lon, dtype=np.float64),
+        "ele": np.array(ele, dtype=np.float64),
+    }
+    for name, values in extensions.items():
+        batch[name] = np.array(values, dtype=np.float64)
+    return batch
+
+
+def _gpx_point(point: ET.Element) -> tuple[str | None, str | None, dict[str, str | None]]:
+    """The ele, time and GPX_EXTENSIONS texts of a trkpt or rtept. The first one is used when a point repeats a tag, for
+    example hr in two extension namespaces."""
+    ele = time = None
+    extensions = {}
+    for child in point.iter():
+        name = _local(child.tag)
+        if name == "ele":
+            ele = child.text
+        elif name == "time":
+            time = child.text
+        elif name in GPX_EXTENSIONS:
+            extensions.setdefault(GPX_EXTENSIONS[name], child.text)
+    return ele, time, extensions
+
+
+def iter_gpx(source: str | os.PathLike | IO[bytes], batch_size: int = 65536) -> Iterator[dict[str, np.ndarray]]:
+    """Stream the track (trkpt) and route (rtept) points of a GPX file in batches of up to `batch_size` points.
+    Each batch is a dict of arrays: timestamp (naive UTC datetime64, NaT without a time), lat and lon (degrees), ele
+    (NaN without one) and the GPX_EXTENSIONS found in the file (NaN where a point has none). Each point is removed
+    from the tree once read, memory does not grow with the file.
+    """
+    lat, lon, ele, time = [], [], [], []
+    extensions: dict[str, list] = {}
+    n = 0
+    open_elements = []  # the element being parsed and its ancestors
+    for event, elem in ET.iterparse(source, events=("start", "end")):
+        if event == "start":
+            open_elements.append(elem)
+            continue
+        open_elements.pop()
+        if _local(elem.tag) not in ("trkpt", "rtept"):
+            continue
+        lat.append(elem.get("lat"))
+        lon.append(elem.get("lon"))
+        point_ele, point_time, point_extensions = _gpx_point(elem)
+        ele.append(point_ele)
+        time.append(point_time and point_time.strip())
+        for name, value in point_extensions.items():
+            extensions.setdefault(name, [None] * n).append(value)
+        n += 1
+        for column in extensions.values():
+            if len(column) < n:
+                column.append(None)
+        if open_elements:
+            open_elements[-1].remove(elem)  # the point is the last child of its trkseg or rte
+        if n == batch_size:
+            yield _gpx_batch(lat, lon, ele, time, extensions)
+            lat, lon, ele, time = [], [], [], []
+            extensions = {name: [] for name in extensions}
+            n = 0
+    if n:
+        yield _gpx_batch(lat, lon, ele, time, extensions)
+
+
+def gpx2arrays(source: str | os.PathLike | IO[bytes]) -> dict[str, np.ndarray]:
+    """All the points of a GPX file, see `iter_gpx`"""
+    batches = list(iter_gpx(source))
+    if not batches:
+        return {name: np.zeros(0) for name in ("lat", "lon", "ele")} | {"timestamp": np.zeros(0, "datetime64[ms]")}
+    names = dict.fromkeys(name for batch in batches for name in batch)
+    return {
+        name: np.concatenate([batch.get(name, np.full(len(batch["lat"]), np.nan)) for batch in batches])
+        for name in names
+    }
+
+
+def gpx2df(source: str | os.PathLike | IO[bytes], utc: bool = True) -> pd.DataFrame:
+    """Load a GPX file into a dataframe shaped like `fit2df`: indexed by timestamp with position_lat and
+    position_long in semicircles, altitude, distance (haversine, meters) and the GPX_EXTENSIONS columns.
+    """
+    import pandas as pd
+
+    points = gpx2arrays(source)
+    index = pd.DatetimeIndex(points.pop("timestamp").astype("datetime64[ns]"), name="timestamp")
+    if utc:
+        index = index.tz_localize("UTC")
+    lat, lon = points.pop("lat"), points.pop("lon")
+    data = {
+        "position_lat": degrees_to_semicircles(lat),
+        "position_long": degrees_to_semicircles(lon),
+        "altitude": points.pop("ele"),
+        "distance": track_distance(lat, lon),
+    }
+    data.update(points)
+    return pd.DataFrame(data, index=index)
@@ -1,9 +1,59 @@
+import asyncio
+import io
 import os
+import shutil
+import subprocess
+import sys
+import time
+import tracemalloc
+import warnings
+from concurrent.futures import ThreadPoolExecutor
 
+import fitdecode
+import numpy as np
+import pandas as pd
+import pytest
+
+from pyfitness import backends, instrument
+from pyfitness.activity import Activity, fit2activity
+from pyfitness.aio import FitExecutor, afit2df, afit2df_many
+from pyfitness.batch import find_fit_files, fit2df_many
+from pyfitness.cache import FitCache
+from pyfitness.compare import align, compare_files, compare_rides
 from pyfitness.fd_loader import fit2dict, fit2df, fit2csv, fit2excel
-from pyfitness.dynamics import simulator
-from pyfitness.statistics import max_climb, max_effort
+from pyfitness.dynamics import (
+    DynamicModel, air_density, climb_power_estimate, simulate_sweep, simulator, solve_cda_crr
+)
+from pyfitness.stream import RecordStream, fit2csv_stream, fit2parquet_stream, iter_records, record_columns
+from pyfitness.metrics import load_metrics, load_metrics_many, normalized_power, w_prime_balance
+from pyfitness.resample import resample_df
+from pyfitness.segments import distance_starts, fit2segments, lap_starts, segment_summary, timer_starts
+from pyfitness.ride_index import RideIndex, _records_summary
+from pyfitness.summary import fitsummary, summary2markdown
+from pyfitness.track import (
+    degrees_to_semicircles, gpx2df, grade, haversine, iter_gpx, smooth, track_arrays, track_distance
+)
+from pyfitness.statistics import climb_curve, find_climbs, max_climb, max_effort, mean_max, to_1hz
+
+
 
+def test_import_time():
+    """The loaders and analysis modules import without pandas, matplotlib or the Garmin SDK"""
+    code = (
+        "import sys, time\n"
+        "start = time.perf_counter()\n"
+        "import pyfitness.fd_loader, pyfitness.stream, pyfitness.summary, pyfitness.statistics, pyfitness.dynamics\n"
+        "import pyfitness.batch, pyfitness.cache, pyfitness.backends, pyfitness.activity\n"
+        "import pyfitness.resample, pyfitness.metrics, pyfitness.ride_index, pyfitness.aio, pyfitness.instrument\n"
+        "import pyfitness.segments, pyfitness.compare, pyfitness.track\n"
+        "print(time.perf_counter() - start)\n"
+        "print(*[m for m in ('pandas', 'matplotlib', 'garmin_fit_sdk') if m in sys.modules])"
+    )
+    for _ in range(2):  # the first run may compile the modules
+        result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    seconds, heavy = result.stdout.split("\n")[:2]
+    assert heavy == ""
+    assert float(seconds) < 0.5
 
 
 def test_fit2dict():
@@ -26,6 +76,172 @@ def test_fit2df():
         df = fit2df(fit)
         assert len(df) > 0
 
+
+def test_fit2df_columnar():
+    fit1 = "testdata/cheats/pedal_calibration/Garmin_Assioma_200mm_test_Dec_20_2022.fit"
+    fit2 = "testdata/indoor/Zwift_Innsbruck.fit"
+    fit3 = "testdata/Luciano/Outdoor/Luciano_indoor_climb_599m_distance_42.809km_power5_NA.fit"
+    for fit in [fit1, fit2, fit3]:
+        pd.testing.assert_frame_equal(fit2df(fit), fit2df(fit, columnar=True))
+
+def test_fit2df_many():
+    fits = ["testdata/indoor/Zwift_Zwift_Fast_Fridays_Bologna_Time_Trial_E_.fit", "testdata/missing.fit",
+            "testdata/Luciano/Indoor/Luciano_indoor_climb_196m_distance_11.837km_power5_364.fit"]
+    results = list(fit2df_many(fits, workers=2, max_in_flight=2))
+    assert [r.path for r in results] == fits
+    assert results[1].error is not None and results[1].value is None
+    assert len(results[0].value) == len(fit2df(fits[0]))
+    assert len(results[2].value) == 1236
+    unordered = list(fit2df_many(fits, workers=2, ordered=False, chunksize=2))
+    assert sorted(r.index for r in unordered) == [0, 1, 2]
+
+def test_find_fit_files(tmp_path):
+    for name in ("a.fit", "B.FIT", "sub/c.Fit", "notes.txt"):
+        (tmp_path / name).parent.mkdir(exist_ok=True)
+        (tmp_path / name).write_bytes(b"")
+    found = find_fit_files(tmp_path)
+    assert sorted(os.path.relpath(f, tmp_path) for f in found) == ["B.FIT", "a.fit", os.path.join("sub", "c.Fit")]
+    assert find_fit_files(tmp_path, suffix=".FIT") == found
+
+def test_fit2df_from_content():
+    fitfile = "testdata/cheats/pedal_calibration/Garmin_Assioma_200mm_test_Dec_20_2022.fit"
+    with open(fitfile, "rb") as f:
+        data = f.read()
+    df = fit2df(fitfile)
+    assert fit2df(data).equals(df) and fit2df(io.BytesIO(data), from_file=False).equals(df)
+    with pytest.raises(ValueError):
+        fit2dict(data, from_file=True)
+
+
+def test_async():
+    fit1 = "testdata/cheats/pedal_calibration/Garmin_Assioma_200mm_test_Dec_20_2022.fit"
+    fit2 = "testdata/Luciano/Outdoor/Luciano_indoor_climb_528m_distance_22.98km_power5_291.fit"
+    with open(fit1, "rb") as f:
+        data = f.read()
+
+    async def main():
+        async with FitExecutor(max_workers=2, max_pending=2) as executor:
+            df = await afit2df(io.BytesIO(data), executor=executor)
+            results = [r async for r in afit2df_many([fit1, data, fit2, b"not a fit file"], executor=executor)]
+            task = asyncio.ensure_future(afit2df(fit2, executor=executor))
+            await asyncio.sleep(0)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+        return df, sorted(results)
+
+    df, results = asyncio.run(main())
+    assert df.equals(fit2df(fit1))
+    assert [r.path for r in results] == [fit1, None, fit2, None]
+    assert [r.error is None for r in results] == [True, True, True, False]
+    assert len(results[1].value) == len(df)
+
+
+def test_async_cancel_running():
+    async def main():
+        async with FitExecutor(max_workers=1, processes=False, max_pending=1) as executor:
+            task = asyncio.ensure_future(executor.run(time.sleep, 0.3))
+            await asyncio.sleep(0.1)  # running in the pool
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+            assert executor._semaphore().locked()  # the slot is held until the pool is done
+            await executor.run(time.sleep, 0)
+            return executor._semaphore().locked()
+
+    assert asyncio.run(main()) is False
+
+
+def test_instrument():
+    fit = "testdata/indoor/10k_vEveresting.fit"
+    events = []
+    instrument.add_callback(events.append)
+    try:
+        with instrument.collect() as report:
+            df = fit2df(fit)
+            fit2df(fit, columnar=True)
+            mean_max(df, columns=["power"])
+    finally:
+        instrument.remove_callback(events.append)
+    assert report.calls["fd_loader.fit2df"] == 2 and report.calls["statistics.mean_max"] == 1
+    assert report.timings["fd_loader.fit2dict.frame2dict"] > 0
+    assert report.counts["fd_loader.bytes_read"] == 2 * os.path.getsize(fit)
+    assert report.counts["fd_loader.rows_kept"] == 2 * len(df)
+    assert report.counts["fd_loader.records"] == report.counts["fd_loader.rows_kept"] + report.counts[
+        "fd_loader.rows_dropped"]
+    assert {event.name for event in events} == set(report.timings) | set(report.counts)
+    assert not instrument.enabled()
+    with instrument.profile(memory=True) as profile:
+        fit2df(fit, columnar=True)
+    assert profile.peak_bytes > 0 and "fit2columns" in profile.report()
+
+
+def test_fit_cache(tmp_path):
+    fit1 = "testdata/cheats/pedal_calibration/Garmin_Assioma_200mm_test_Dec_20_2022.fit"
+    fit2 = "testdata/indoor/Zwift_Zwift_Fast_Fridays_Bologna_Time_Trial_E_.fit"
+    cache = FitCache(tmp_path)
+    df = fit2df(fit1, cache=cache)
+    pd.testing.assert_frame_equal(fit2df(fit1, cache=cache), df)
+    assert fit2dict(fit1, cache=cache)['header'] == fit2dict(fit1, cache=cache)['header']
+    assert cache.stats() == {'hits': 2, 'misses': 2, 'writes': 2, 'evictions': 0}
+    cache.max_bytes = cache.size() + 1
+    fit2df(fit2, cache=cache)
+    assert cache.evictions >= 1 and cache.size() <= cache.max_bytes
+    scans = []
+    cache.entries = lambda entries=cache.entries: scans.append(1) or entries()
+    cache.max_bytes = 2**30
+    fit2dict(fit2, cache=cache)
+    assert cache.writes == 4 and not scans  # under max_bytes a write does not scan the directory
+
+def test_iter_records(tmp_path):
+    fitfile = "testdata/indoor/Zwift_Innsbruck.fit"
+    batches = list(iter_records(fitfile, batch_size=1000))
+    assert max(len(b) for b in batches) == 1000
+    assert sum(len(b) for b in batches) == len(fit2df(fitfile))
+    # tail a file that is still being written, the header body size is 0 until the file is complete
+    with open(fitfile, "rb") as f:
+        data = f.read()
+    live = tmp_path / "live.fit"
+    live.write_bytes(data[:4] + bytes(4) + data[8:len(data) // 2])
+    stream = RecordStream(live, batch_size=1000)
+    rows = sum(len(b) for b in stream.batches())
+    with open(live, "ab") as f:
+        f.write(data[len(data) // 2:])
+    with open(live, "r+b") as f:
+        f.write(data[:data[0]])
+    stream = RecordStream(live, batch_size=1000, offset=stream.offset, state=stream.state)
+    rows += sum(len(b) for b in stream.batches())
+    assert stream.finished and rows == len(fit2df(fitfile))
+
+def test_backends(tmp_path):
+    pytest.importorskip("garmin_fit_sdk")
+    fitfile = "testdata/cheats/pedal_calibration/Garmin_Assioma_200mm_test_Dec_20_2022.fit"
+    fd_df = backends.fit2df(fitfile)
+    sdk_dict = backends.fit2dict(fitfile, backend="garmin_fit_sdk")
+    assert sdk_dict['header'] == fit2dict(fitfile)['header']
+    assert len(sdk_dict['records']) == 3033 and len(sdk_dict['events']) == 248
+    assert sdk_dict['crcs']['crc'] == fit2dict(fitfile)['crcs']['crc'] and sdk_dict['crcs']['matched']
+    with open(fitfile, "rb") as f:
+        data = bytearray(f.read())
+    data[-1] ^= 0xFF
+    assert backends.get_backend("garmin_fit_sdk").crc2dict(bytes(data))['matched'] is False
+    cache = FitCache(tmp_path)
+    try:
+        backends.set_backend("garmin_fit_sdk")
+        with ThreadPoolExecutor(4) as pool:  # the sdk loader keeps no state between calls
+            sdk_dfs = list(pool.map(backends.fit2df, [fitfile] * 4))
+        assert fit2dict(fitfile)['columns'] == sdk_dict['columns']  # the default applies to fd_loader
+        assert next(fit2df_many([fitfile], workers=2)).value.equals(sdk_dfs[0])
+        assert fit2df(fitfile, cache=cache).equals(sdk_dfs[0])
+        assert fit2df(fitfile, cache=cache, backend="fitdecode").equals(fd_df)  # cached apart
+        assert cache.stats()["misses"] == 2
+    finally:
+        backends.set_backend("fitdecode")
+    assert all(df.equals(sdk_dfs[0]) for df in sdk_dfs)
+    sdk_df = sdk_dfs[0][fd_df.columns]
+    pd.testing.assert_frame_equal(fd_df[["power", "heart_rate", "cadence"]], sdk_df[["power", "heart_rate", "cadence"]])
+
+
 def test_fit2csv():
     fitfile = "testdata/cheats/pedal_calibration/Garmin_Assioma_200mm_test_Dec_20_2022.fit"
     outfile = "testdata/tempfiles/tempfile.csv"
@@ -33,15 +249,110 @@ def test_fit2csv():
     assert os.path.exists(outfile)
 
 
-def test_fit2excel():
-    try:
-        import openpyxl
-    except:
-        return
+def test_fit2csv_chunked(tmp_path):
     fitfile = "testdata/cheats/pedal_calibration/Garmin_Assioma_200mm_test_Dec_20_2022.fit"
-    outfile = "testdata/cheats/tempfile.xlsx"
+    df = fit2df(fitfile)
+    csv = fit2csv(df)
+    assert csv == fit2csv(df, chunksize=1000)
+    with open(tmp_path / "ride.csv", "wb") as f:
+        fit2csv(df, f, chunksize=1000)
+    assert (tmp_path / "ride.csv").read_bytes() == csv
+    streamed = pd.read_csv(io.BytesIO(fit2csv_stream(fitfile, batch_size=1000)))
+    assert set(df.columns) <= set(record_columns(fitfile))
+    pd.testing.assert_frame_equal(pd.read_csv(io.BytesIO(csv)), streamed[["timestamp", *df.columns]], check_dtype=False)
+
+
+def test_fit2parquet_stream(tmp_path):
+    pa = pytest.importorskip("pyarrow")
+    pq = pytest.importorskip("pyarrow.parquet")
+    fitfile = "testdata/cheats/pedal_calibration/Garmin_Assioma_200mm_test_Dec_20_2022.fit"
+    df = fit2df(fitfile)
+    schema = fit2parquet_stream(fitfile, tmp_path / "ride.parquet", batch_size=1000)
+    parquet = pq.ParquetFile(tmp_path / "ride.parquet")
+    assert parquet.metadata.num_row_groups == 4 and parquet.schema_arrow.names == schema.names
+    out = pd.read_parquet(tmp_path / "ride.parquet").set_index("timestamp")
+    numeric = [c for c in df.columns if df[c].dtype.kind in "biuf"]
+    pd.testing.assert_frame_equal(out[numeric], df[numeric], check_dtype=False, check_index_type=False)
+    assert out.left_power_phase.dropna().iloc[0] == str(df.left_power_phase.dropna().iloc[0])
+    as_text = pa.schema([schema.field("timestamp"), pa.field("power", pa.string())])
+    fit2parquet_stream(fitfile, tmp_path / "power.parquet", batch_size=1000, schema=as_text)
+    assert list(pd.read_parquet(tmp_path / "power.parquet").power) == [str(p) for p in df.power]
+    as_number = pa.schema([schema.field("timestamp"), pa.field("left_power_phase", pa.float64())])
+    with pytest.raises(ValueError, match="left_power_phase"):
+        fit2parquet_stream(fitfile, tmp_path / "phase.parquet", batch_size=1000, schema=as_number)
+
+
+def test_fit2excel(tmp_path):
+    pytest.importorskip("openpyxl")
+    fitfile = "testdata/cheats/pedal_calibration/Garmin_Assioma_200mm_test_Dec_20_2022.fit"
+    outfile = tmp_path / "tempfile.xlsx"
     fit2excel(fitfile, outfile)
     assert os.path.exists(outfile)
+    df = fit2df(fitfile)
+    sheet = pd.read_excel(io.BytesIO(fit2excel(df)), index_col=0)
+    assert len(sheet) == len(df) and df.index.tz is not None
+    assert (sheet.index == df.index.tz_localize(None)).all()
+
+def test_activity():
+    fitfile = "testdata/Luciano/Outdoor/Luciano_indoor_climb_528m_distance_22.98km_power5_291.fit"
+    df = fit2df(fitfile)
+    activity = fit2activity(fitfile)
+    assert len(activity) == len(df) and activity.fields == list(df.columns)
+    assert activity["power"].dtype == np.int16 and activity["heart_rate"].dtype == np.uint8
+    assert activity.nbytes < df.memory_usage().sum() / 2
+    out = activity.to_df()
+    assert np.shares_memory(out["power"].array._data, activity["power"])
+    assert (out.index == df.index).all()
+    for col in df.columns:
+        np.testing.assert_allclose(activity.get(col), df[col].to_numpy(dtype=np.float64), rtol=1e-6)
+    back = Activity.from_df(out)
+    assert np.array_equal(back["power"], activity["power"]) and back["power"].dtype == np.int16
+    assert back.masks.keys() == activity.masks.keys() and np.array_equal(back.masks["power"], activity.masks["power"])
+    assert np.shares_memory(back["heart_rate"], activity["heart_rate"])  # not copied
+    assert Activity.from_df(df)["cadence"].dtype == np.uint8
+
+
+def test_resample():
+    seconds = [0, 2, 2, 30, 31]  # a smart recording gap, a duplicate second and a pause
+    index = pd.DatetimeIndex(pd.Timestamp("2023-06-01", tz="UTC") + pd.to_timedelta(seconds, unit="s"),
+                             name="timestamp")
+    df = pd.DataFrame({"power": [100, 200, 300, 400, np.nan], "speed": [5, 7, 7, 6, 6],
+                       "altitude": [10, 12, 12, 40, 41]}, index=index)
+    grid = resample_df(df)
+    assert grid.size == 32 and grid.sampled.sum() == 4
+    assert list(np.flatnonzero(grid.paused)) == list(range(3, 30))
+    assert list(grid.columns["power"][:4]) == [100, 0, 300, 0]
+    assert list(grid.columns["speed"][:4]) == [5, 6, 7, 0] and grid.columns["altitude"][16] == 26
+    assert grid.row(index[3]) == 30 and len(grid.to_df()) == 32
+
+    activity = fit2activity("testdata/Luciano/Outdoor/Luciano_indoor_climb_528m_distance_22.98km_power5_291.fit")
+    grid = activity.resample()
+    assert activity.resample() is grid and activity.resample(max_gap=5) is not grid
+    assert grid.sampled.sum() == len(activity) and grid.size == grid.row(activity.timestamp[-1]) + 1
+    np.testing.assert_allclose(grid.columns["power"], to_1hz(activity.to_df(), "power"))
+
+
+def test_fitsummary():
+    fitfile = "testdata/cheats/pedal_calibration/Garmin_Assioma_200mm_test_Dec_20_2022.fit"
+    summary = fitsummary(fitfile)
+    fit_dict = fit2dict(fitfile)
+    assert summary.header["profile_ver"] == (21, 72)
+    assert summary.message_counts["record"] == len(fit_dict['records'])
+    assert summary.message_counts["event"] == len(fit_dict['events'])
+    assert summary.sessions[0]["sport"] == fit_dict['sessions'][0]["sport"]
+    assert set(fit2df(fitfile).columns) <= set(summary.record_fields)
+    assert {name for name, _ in summary.messages} == {"file_id", "activity", "session", "lap"}
+    assert summary.event_types == list(dict.fromkeys(event["event"] for event in fit_dict['events']))
+    markdown = summary2markdown(summary)
+    assert "- records: 3033\n" in markdown and "### session\n" in markdown
+    # the events and device_info messages of a long ride are stepped over, the event types read from their layout
+    fitfile = "testdata/outdoor/PARC_GATINEAU.fit"
+    summary, full = fitsummary(fitfile), fitsummary(fitfile, decode=None)
+    assert summary.message_counts == full.message_counts and summary.event_types == full.event_types
+    assert summary.message_counts["event"] == 1264 and "device_info" not in {name for name, _ in summary.messages}
+    with open(fitfile, "rb") as f:
+        assert fitsummary(fitdecode.FitReader(f)).event_types == summary.event_types
+
 
 def test_simulator():
     """Just testing that it runs"""
@@ -53,6 +364,276 @@ def test_simulator():
         sim = simulator(df, rider_weight=70, bike_weight=10, wind_speed=3, wind_direction=3, temperature=20.1,
                        drag_coefficient=0.8, frontal_area=0.565, rolling_resistance=0.005, efficiency_loss=0.04)
 
+def test_simulator_not_inplace():
+    fit = "testdata/Luciano/Outdoor/Luciano_indoor_climb_528m_distance_22.98km_power5_291.fit"
+    df = fit2df(fit)
+    df["seconds"] = (df.index - df.index[0]).total_seconds()
+    params = dict(rider_weight=70, bike_weight=10, wind_speed=3, wind_direction=3, temperature=20.1,
+                  drag_coefficient=0.8, frontal_area=0.565, rolling_resistance=0.005, efficiency_loss=0.04)
+    columns = list(df.columns)
+    result = simulator(df, inplace=False, outputs=["est_power", "vam"], **params)
+    assert list(df.columns) == columns and list(result.columns) == ["est_power", "vam"]
+    assert result.index is df.index
+    sim = simulator(df.copy(), **params)
+    pd.testing.assert_frame_equal(result, sim[["est_power", "vam"]])
+    result32 = simulator(df, inplace=False, dtype=np.float32, **params)
+    assert result32.est_power.dtype == np.float32
+    assert np.allclose(result32.est_power, sim.est_power, atol=1, equal_nan=True)
+    pd.testing.assert_frame_equal(simulator(df, inplace=False, dtype="float32", **params), result32)
+    with pytest.raises(TypeError):
+        simulator(df, *params.values(), None, None, False)  # the options after altitudecol are keyword-only
+
+def test_simulate_sweep():
+    fit = "testdata/Luciano/Outdoor/Luciano_indoor_climb_528m_distance_22.98km_power5_291.fit"
+    df = fit2df(fit)
+    df["seconds"] = (df.index - df.index[0]).total_seconds()
+    params = dict(rider_weight=70, bike_weight=10, wind_speed=3, wind_direction=3, temperature=20.1,
+                  drag_coefficient=0.8, frontal_area=0.565, rolling_resistance=0.005, efficiency_loss=0.04)
+    columns = list(df.columns)
+    sweep = simulate_sweep(df, {**params, "drag_coefficient": np.linspace(0.6, 1.0, 5)}, return_power=True)
+    assert list(df.columns) == columns
+    assert sweep["est_power"].shape == (5, len(df)) and sweep["rmse"].shape == (5,)
+    sim = simulator(df.copy(), **params)
+    assert np.allclose(sweep["est_power"][2], sim.est_power, atol=1e-3)
+    error = sim.est_power - df.power
+    assert np.isclose(sweep["rmse"][2], np.sqrt(np.mean(np.square(error[df.power.notna()]))))
+
+def test_simulate_sweep_single():
+    # enhanced_altitude for the slope, altitude for the air density, a repeated timestamp (infinite acceleration)
+    rng = np.random.default_rng(1)
+    seconds = np.concatenate([np.arange(300.0), [299.0], np.arange(300.0, 600.0)])
+    distance = np.cumsum(rng.uniform(4, 9, len(seconds)))
+    altitude = 200 + 40 * np.sin(distance / 800)
+    df = pd.DataFrame({"seconds": seconds, "distance": distance, "altitude": altitude,
+                       "enhanced_altitude": altitude + 1500, "speed": rng.uniform(4, 9, len(seconds)),
+                       "power": rng.uniform(100, 300, len(seconds))})
+    params = dict(rider_weight=70, bike_weight=10, wind_speed=3, wind_direction=3, temperature=20.1,
+                  drag_coefficient=0.8, frontal_area=0.565, rolling_resistance=0.005, efficiency_loss=0.04)
+    for grade_window in (None, 50):
+        sim = simulator(df.copy(), grade_window=grade_window, **params)
+        sweep = simulate_sweep(df, params, return_power=True, grade_window=grade_window)
+        assert np.isinf(sim.est_power[300])
+        np.testing.assert_allclose(sweep["est_power"][0], sim.est_power, rtol=1e-6)
+        error = (sim.est_power - df.power)[np.isfinite(sim.est_power)]
+        assert np.isfinite([sweep["rmse"][0], sweep["mae"][0], sweep["bias"][0]]).all()
+        assert sweep["rmse"][0] == pytest.approx(np.sqrt(np.mean(np.square(error))))
+        assert sweep["bias"][0] == pytest.approx(error.mean())
+    solution = solve_cda_crr(df.drop(index=300), rider_weight=70, bike_weight=10, grade_window=50)
+    assert np.isfinite(solution["CdA"])
+
+def test_solve_cda_crr():
+    # one hour at 6-10 m/s over rolling hills, power from the model with CdA 0.32 and Crr 0.0045
+    seconds = np.arange(3600.0)
+    speed = 8 + 2 * np.sin(seconds / 200)
+    distance = np.concatenate([[0], np.cumsum(speed[1:])])
+    altitude = 100 + 30 * np.sin(distance / 2000)
+    rise = np.diff(altitude, prepend=altitude[0])
+    run = np.diff(distance, prepend=0)
+    cos_slope = np.cos(np.arctan(np.divide(rise, run, out=np.zeros_like(rise), where=run > 0)))
+    kinetic = 0.5 * np.diff(speed ** 2, prepend=speed[0] ** 2)
+    rho = air_density(20.0, (altitude.max() - altitude.min()) / 2)
+    power = (80 * 9.8067 * (rise + 0.0045 * cos_slope * speed) + 0.5 * rho * 0.32 * speed ** 3 + 80 * kinetic) / 0.98
+    df = pd.DataFrame({"seconds": seconds, "distance": distance, "altitude": altitude, "speed": speed, "power": power})
+    solution = solve_cda_crr(df, rider_weight=70, bike_weight=10)
+    assert solution["iterations"] <= 2 and solution["rmse"] < 1e-6
+    assert round(solution["CdA"], 6) == 0.32 and round(solution["Crr"], 6) == 0.0045
+    estimate = DynamicModel(df).estimate(["CdA"], rider_weight=70, bike_weight=10, crr=0.0045)
+    assert list(estimate) == ["CdA"] and round(estimate["CdA"], 6) == 0.32
+
+def test_load_metrics():
+    power = np.r_[np.full(600, 200.0), np.full(600, 400.0), np.zeros(600)]
+    assert normalized_power(np.full(3600, 250.0)) == 250
+    assert 300 < normalized_power(power) < 330
+    # the differential model against the per second definition
+    balance = w_prime_balance(power, cp=300, w_prime=20000, model="differential")
+    expected, w_bal = [], 20000
+    for p in power:
+        w_bal += -(p - 300) if p > 300 else (20000 - w_bal) * (300 - p) / 20000
+        expected.append(w_bal)
+    np.testing.assert_allclose(balance, expected, atol=1e-6)
+    assert w_prime_balance(power, cp=300, w_prime=20000).min() > balance.min()
+
+    fits = ["testdata/Luciano/Outdoor/Luciano_indoor_climb_528m_distance_22.98km_power5_291.fit",
+            "testdata/cheats/pedal_calibration/Garmin_Assioma_200mm_test_Dec_20_2022.fit"]
+    dfs = [fit2df(fit) for fit in fits]
+    single = [load_metrics(df, ftp=250, cp=260, hr_rest=50, hr_max=190) for df in dfs]
+    many = load_metrics_many([to_1hz(df, "power") for df in dfs], ftp=250, cp=260, hr_rest=50, hr_max=190,
+                             heart_rates=[to_1hz(df, "heart_rate", fill="ffill") for df in dfs])
+    for row, metrics in zip(many.to_dict("records"), single, strict=True):
+        assert row == pytest.approx(metrics)
+    assert single[0]["tss"] == pytest.approx(single[0]["duration"] * single[0]["intensity_factor"] ** 2 / 36)
+
+
+def test_ride_index(tmp_path):
+    fit1 = "testdata/Luciano/Outdoor/Luciano_indoor_climb_528m_distance_22.98km_power5_291.fit"
+    fit2 = "testdata/cheats/pedal_calibration/Garmin_Assioma_200mm_test_Dec_20_2022.fit"
+    rides = tmp_path / "rides"
+    rides.mkdir()
+    for fit in [fit1, fit2]:
+        shutil.copy2(fit, rides)
+    index = RideIndex(tmp_path / "index.sqlite")
+    assert index.update(rides, workers=1) == {"added": 2, "unchanged": 0, "errors": []}
+    assert index.update(rides, workers=1)["unchanged"] == 2
+    shutil.copy2(fit1, rides / "copy.fit")  # same ride under another name
+    assert index.update(rides, workers=1)["added"] == 1 and len(index) == 2
+    best = index.best("power", 1200)
+    best_power = max(max_effort(fit2df(fit), seconds=1200)["power"] for fit in [fit1, fit2])
+    assert best["mean"].iloc[0] == pytest.approx(best_power)
+    assert len(index.rides(start="2022-12-01")) == 1
+    assert set(index.curve("power").columns) == {"duration", "mean", "ride_id", "start_time"}
+    (rides / os.path.basename(fit2)).unlink()
+    index.update(rides, workers=1, prune=True)
+    assert len(index) == 1
+    index.close()
+    assert len(RideIndex(tmp_path / "index.sqlite").rides()) == 1
+    records = pd.DataFrame({"device": ["a", "b", "c"], "power": [100.0, 200.0, 300.0]},
+                           index=pd.date_range("2023-01-01", periods=3, freq="2s", tz="UTC"))
+    assert _records_summary(records)["total_elapsed_time"] == 5  # the first column is not numeric
+
+
+def test_segments():
+    index = pd.date_range("2023-01-01", periods=600, freq="s", tz="UTC")
+    df = pd.DataFrame({"power": np.tile([100.0, 300.0], 300), "distance": np.arange(600) * 5.0,
+                       "altitude": np.linspace(0, 60, 600)}, index=index).drop(index[400:420])
+    df.loc[index[100:160], "power"] = 500.0
+    laps = [{"start_time": index[t].to_pydatetime()} for t in (0, 100, 300)] + [{"start_time": None}]
+    starts = lap_starts(df, laps)
+    assert list(starts) == [0, 100, 300]
+    lapless = segment_summary(df, lap_starts(df, [{"start_time": None}]))
+    assert len(lapless) == 1 and lapless.samples[0] == len(df) and lapless.avg_power[0] == df.power.mean()
+    summary = segment_summary(df, starts, durations=[30, 60, 250])
+    for segment, (a, b) in enumerate(zip(starts, [100, 300, len(df)], strict=True)):
+        assert summary.avg_power[segment] == df.power.iloc[a:b].mean()
+        assert summary.max_power[segment] == df.power.iloc[a:b].max()
+    assert list(summary.power_60s) == [200, 500, 200]
+    assert np.isnan(summary.power_250s[0]) and summary.power_250s[2] == 200 * 230 / 250
+    assert list(summary.elapsed_time) == [100, 200, 299] and summary.distance[1] == 1000
+    on_grid = segment_summary(df, starts, durations=[30, 60, 250], grid=resample_df(df))
+    pd.testing.assert_frame_equal(on_grid, summary)
+    physics = dict(rider_weight=70, bike_weight=8, wind_speed=0, wind_direction=0, temperature=20,
+                   drag_coefficient=0.8, frontal_area=0.5, rolling_resistance=0.004, efficiency_loss=0.02)
+    split = segment_summary(df.assign(seconds=np.arange(len(df))), distance_starts(df, every=1000), physics=physics)
+    assert list(split.start_row) == [0, 200, 400] and split.distance[0] == 1000
+    estimate = climb_power_estimate(df.iloc[:201].assign(seconds=np.arange(201)), **physics)
+    assert split.est_power[0] == pytest.approx(estimate["est_power"], rel=0.01)
+    events = [{"event": "timer", "event_type": "start", "timestamp": index[0].to_pydatetime()},
+              {"event": "timer", "event_type": "stop_all", "timestamp": index[200].to_pydatetime()},
+              {"event": "timer", "event_type": "start", "timestamp": index[250].to_pydatetime()},
+              {"event": "timer", "event_type": "stop_all", "timestamp": index[599].to_pydatetime()}]
+    starts, running = timer_starts(df, events)
+    assert list(starts) == [0, 201, 250] and list(running) == [True, False, True]
+    segments = fit2segments("testdata/outdoor/PARC_GATINEAU.fit", durations=[60])
+    assert len(segments) == 31 and segments.samples.sum() == len(fit2df("testdata/outdoor/PARC_GATINEAU.fit"))
+
+
+def test_compare():
+    fit1 = "testdata/cheats/pedal_calibration/Garmin_Assioma_200mm_test_Dec_20_2022.fit"
+    fit2 = "testdata/cheats/pedal_calibration/Zwift_KickrBikeV1_TruePower_Dec_20_2022.fit"
+    a, b = fit2df(fit1), fit2df(fit2)
+    result = compare_rides(a, b)
+    assert result.correlation > 0.8 and len(result.a) == len(result.b) > 3000
+    assert result.ratio == pytest.approx(0.86, abs=0.01) and result.mean_difference < -30
+    shifted = b.copy()
+    shifted.index = shifted.index + pd.Timedelta(seconds=17)
+    assert compare_rides(a, shifted).offset == result.offset - 17
+    # b reads 10% high and starts 45 s into a
+    rng = np.random.default_rng(0)
+    power = rng.gamma(4, 50, 2000)
+    index = pd.date_range("2023-01-01", periods=2000, freq="s", tz="UTC")
+    ride_a = pd.DataFrame({"power": power}, index=index)
+    ride_b = pd.DataFrame({"power": power[45:1500] * 1.1}, index=index[45:1500] + pd.Timedelta(seconds=3))
+    result = compare_rides(ride_a, ride_b, zones=[200])
+    assert result.offset == -3 and result.correlation > 0.99 and len(result.a) == 1455
+    assert result.ratio == pytest.approx(1.1) and np.all(result.zone_bias > 0) and result.zone_seconds.sum() == 1455
+    assert result.drift == pytest.approx(0, abs=5) and result.suspicious.tolist() == [[0, 1455]]
+    lags, correlations = align([power, power[:900]], [power[100:400], power[:900]])
+    assert list(lags) == [100, 0] and correlations[1] == pytest.approx(1)
+    table = compare_files([(fit1, fit2), (fit1, "testdata/missing.fit")], workers=1)
+    assert table.offset[0] == compare_rides(a, b).offset and table.error[1] is not None
+
+
+def test_track():
+    assert haversine([0, 1], [0, 0])[0] == pytest.approx(111195, rel=1e-4)
+    lat, lon = np.linspace(45, 45.1, 1001), np.linspace(-75, -75.05, 1001)
+    distance = track_distance(lat, lon)
+    semicircles = track_distance(degrees_to_semicircles(lat), degrees_to_semicircles(lon), semicircles=True)
+    assert np.allclose(distance, semicircles)
+    assert distance[-1] == pytest.approx(haversine(lat[[0, -1]], lon[[0, -1]])[0])
+    # a 5% ramp with altimeter noise, a stop (the distance does not change) and a GPS dropout
+    distance = np.concatenate([np.arange(0, 500, 5.0), np.full(20, 500.0), np.arange(505, 1000, 5.0)])
+    altitude = distance * 0.05 + np.random.default_rng(1).normal(0, 0.3, len(distance))
+    altitude[300:305] = np.nan
+    slope = grade(altitude, distance, window=100)
+    assert np.all(np.abs(slope - 0.05) < 0.015)
+    assert list(smooth(np.array([1.0, 2, 3, 4, 5]), 3, "mean")) == [1.5, 2, 3, 4, 4.5]
+    assert list(smooth(np.array([1.0, 2, 100, 4, np.nan]), 3, "median")) == [1.5, 2, 4, 52, 4]
+    index = pd.date_range("2023-01-01", periods=len(distance), freq="s", tz="UTC")
+    df = pd.DataFrame({"distance": distance, "altitude": altitude, "speed": 5.0}, index=index)
+    arrays = track_arrays(df, window=30, grade_window=100)
+    assert np.nanmax(np.abs(arrays["grade"] - 0.05)) < 0.01
+    params = dict(rider_weight=70, bike_weight=8, wind_speed=0, wind_direction=0, temperature=20,
+                  drag_coefficient=0.8, frontal_area=0.5, rolling_resistance=0.004, efficiency_loss=0.02)
+    est = simulator(df.copy(), **params, grade_window=100).est_power.to_numpy()
+    assert np.allclose(simulator(df, **params, inplace=False, grade_window=100).est_power, est)
+    assert np.all(np.isfinite(est)) and not np.all(np.isfinite(simulator(df.copy(), **params).slope))
+    points = "".join(
+        f'<trkpt lat="{la}" lon="{lo}"><ele>{i}</ele><time>2023-01-01T00:00:{i:02d}Z</time>'
+        f'<extensions><gpxtpx:TrackPointExtension><gpxtpx:hr>{100 + i}</gpxtpx:hr></gpxtpx:TrackPointExtension>'
+        f'</extensions></trkpt>' for i, (la, lo) in enumerate(zip(lat[:50], lon[:50], strict=True))
+    )
+    gpx = (f'<?xml version="1.0"?><gpx xmlns="http://www.topografix.com/GPX/1/1" '
+           f'xmlns:gpxtpx="http://www.garmin.com/xmlschemas/TrackPointExtension/v1"><trk><trkseg>{points}'
+           f'<trkpt lat="45.2" lon="-75.2"/></trkseg></trk></gpx>').encode()
+    assert [len(batch["lat"]) for batch in iter_gpx(io.BytesIO(gpx), batch_size=20)] == [20, 20, 11]
+    gpx_df = gpx2df(io.BytesIO(gpx))
+    assert len(gpx_df) == 51 and gpx_df.index[1] == pd.Timestamp("2023-01-01 00:00:01", tz="UTC")
+    assert gpx_df.heart_rate.iloc[10] == 110 and np.isnan(gpx_df.heart_rate.iloc[50])
+    assert np.isnan(gpx_df.altitude.iloc[50])
+    assert np.allclose(gpx_df.distance.iloc[:50], track_distance(lat[:50], lon[:50]))
+    assert np.allclose(track_arrays(gpx_df, recompute_distance=True)["distance"], gpx_df.distance)
+
+
+def test_gpx_mixed_offsets():
+    """Times with a Z, a UTC offset, fractional seconds or none are all naive UTC, without numpy's timezone warning"""
+    times = ["2023-01-01T00:00:00Z", "2023-01-01T02:00:01+02:00", "2022-12-31T19:00:02.500-05:00", None]
+    points = "".join(f'<trkpt lat="45" lon="-75">{f"<time>{t}</time>" if t else ""}</trkpt>' for t in times)
+    gpx = f'<gpx xmlns="http://www.topografix.com/GPX/1/1"><trk><trkseg>{points}</trkseg></trk></gpx>'.encode()
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        (batch,) = iter_gpx(io.BytesIO(gpx))
+    expected = ["2023-01-01T00:00:00", "2023-01-01T00:00:01", "2023-01-01T00:00:02.500", "NaT"]
+    assert np.array_equal(batch["timestamp"], np.array(expected, dtype="datetime64[ms]"), equal_nan=True)
+
+def test_gpx_repeated_extension():
+    """A point with hr in two extension namespaces gives one heart_rate value, the first"""
+    gpx = ('<gpx xmlns="http://www.topografix.com/GPX/1/1" xmlns:a="urn:a" xmlns:b="urn:b"><trk><trkseg>'
+           '<trkpt lat="45" lon="-75"><extensions><a:hr>120</a:hr><b:hr>121</b:hr></extensions></trkpt>'
+           '<trkpt lat="45.1" lon="-75.1"><extensions><a:hr>130</a:hr></extensions></trkpt>'
+           '<trkpt lat="45.2" lon="-75.2"/></trkseg></trk></gpx>').encode()
+    (batch,) = iter_gpx(io.BytesIO(gpx))
+    assert len(batch["heart_rate"]) == len(batch["lat"]) == 3
+    np.testing.assert_array_equal(batch["heart_rate"], [120, 130, np.nan])
+
+def test_iter_gpx_memory(tmp_path):
+    """Points are dropped from the tree once read, the peak memory does not grow with a long track segment"""
+    peaks = []
+    for n in (20_000, 200_000):
+        path = tmp_path / f"{n}.gpx"
+        with open(path, "w") as f:
+            f.write('<gpx xmlns="http://www.topografix.com/GPX/1/1"><trk><trkseg>')
+            for i in range(n):
+                f.write(f'<trkpt lat="45.{i:06d}" lon="-75.{i:06d}"><ele>{i % 100}</ele>'
+                        f'<time>2023-01-01T00:00:00Z</time></trkpt>')
+            f.write("</trkseg></trk></gpx>")
+        tracemalloc.start()
+        try:
+            assert sum(len(batch["lat"]) for batch in iter_gpx(path, batch_size=1000)) == n
+            peaks.append(tracemalloc.get_traced_memory()[1])
+        finally:
+            tracemalloc.stop()
+    assert peaks[1] < 1.5 * peaks[0]
+
+
 def test_max_effort():
     fit1 = "testdata/cheats/pedal_calibration/Zwift_KickrBikeV1_TruePower_Dec_20_2022.fit"
     fit2 = "testdata/indoor/10k_vEveresting.fit"
@@ -60,3 +641,38 @@ def test_max_effort():
     for fit in [fit1, fit2, fit3]:
         df = fit2df(fit)
         max_effort(df, seconds=300, columns=['power', 'heart_rate', 'cadence'])
+
+
+def test_mean_max():
+    index = pd.date_range("2023-01-01", periods=600, freq="s", tz="UTC")
+    power = pd.Series(100.0, index=index)
+    power.iloc[200:260] = 400.0
+    df = pd.DataFrame({"power": power}).drop(index[300:310])  # a 10 second recording gap counts as 0 watts
+    curve = mean_max(df, columns=["power"], durations=np.arange(1, 601))["power"]
+    assert len(curve) == 600
+    assert curve.loc[60, "mean"] == 400 and curve.loc[60, "start"] == 200 and curve.loc[60, "end"] == 260
+    assert curve.loc[600, "mean"] == (540 * 100 + 60 * 400 - 10 * 100) / 600
+    assert max_effort(df, seconds=60, columns=["power", "cadence"]) == {"power": 400, "cadence": None}
+    on_grid = mean_max(resample_df(df), columns=["power"], durations=np.arange(1, 601))["power"]
+    pd.testing.assert_frame_equal(on_grid, curve)
+    default = mean_max(df, columns=["power"])["power"]  # log spaced
+    assert default.index[0] == 1 and default.index[-1] == 600 and len(default) < 120
+    pd.testing.assert_frame_equal(default, curve.loc[default.index])
+    with pytest.raises(ValueError):
+        to_1hz(df, "power", fill="nearest")
+
+
+def test_max_climb():
+    # 2 km at 5% (100 m), 1 km flat, a 5 m dip, then 4 km at 8.25% (330 m), at 5 m/s
+    altitude = np.concatenate([np.linspace(0, 100, 400), np.full(200, 100.0), np.linspace(100, 95, 20),
+                               np.linspace(95, 425, 800)])
+    df = pd.DataFrame({"seconds": np.arange(len(altitude)) + 100, "distance": np.arange(len(altitude)) * 5.0,
+                       "altitude": altitude})
+    climb = max_climb(df, 300)
+    assert round(climb["gain"], 6) == round(300 * 330 / 799, 6) and climb["start_time"] >= 100 + 620
+    assert climb["end_distance"] - climb["start_distance"] == 1500
+    curve = climb_curve(df, [10, 300, 5000])
+    assert list(curve["durations"]) == [10, 300]
+    climbs = find_climbs(df, tolerance=10)
+    assert len(climbs) == 1 and climbs.category[0] == "2" and climbs.start_time[0] == 0
+    assert list(find_climbs(df, tolerance=2).category) == ["4", "2"]